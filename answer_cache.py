@@ -0,0 +1,328 @@
+"""
+回答の意味的キャッシュ（質問のEmbeddingが近ければ保存済みの回答を返す）
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+
+# 定数定義
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DOCS_DIR = os.path.join(BASE_DIR, "docs")
+ANSWER_CACHE_PATH = os.path.join(BASE_DIR, ".answer_cache.sqlite")
+# インデックス処理が書き出すマニフェスト（ingest.MANIFEST_PATHと同じ）
+MANIFEST_PATH = os.path.join(BASE_DIR, ".index_manifest.json")
+# 回答キャッシュを使うか（"0"で無効）
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") != "0"
+# 質問のコサイン類似度がこの値以上なら同じ質問とみなす
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+# 保持する最大件数（超えたら最も長く使われていない回答から削除）
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))
+
+
+class IndexState:
+    """
+    回答の有効性を判定するためのインデックスの状態
+
+    index_id は全件再構築ごとに変わるID、file_hashes は各ファイルのパスと
+    内容ハッシュ、digest はファイル一覧全体のハッシュ。
+    """
+
+    def __init__(self, index_id: Optional[str], file_hashes: Dict[str, str]):
+        self.index_id = index_id
+        self.file_hashes = file_hashes
+        self.digest = hashlib.sha256(
+            json.dumps(sorted(file_hashes.items()), ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+
+    @classmethod
+    def from_manifest(cls, manifest: Dict, docs_dir: str = DOCS_DIR) -> "IndexState":
+        """マニフェストから状態を作成（ファイルは検索結果のsourceと同じパスで表す）"""
+        file_hashes = {
+            str(os.path.join(docs_dir, *source_key.split("/"))): entry.get("hash")
+            for source_key, entry in manifest.get("files", {}).items()
+            if entry.get("hash")
+        }
+        return cls(manifest.get("index_id"), file_hashes)
+
+    def tags_for(self, sources: List[str]) -> Dict:
+        """
+        回答に付けるタグを作成
+
+        参照したファイルの内容ハッシュを記録する。参照がない回答（見つから
+        なかった場合など）はどのファイルの追加でも変わりうるため、ファイル
+        一覧全体のハッシュを記録する。
+        """
+        sources = sorted(set(s for s in sources if s))
+        return {
+            "index_id": self.index_id,
+            "sources": {s: self.file_hashes.get(s) for s in sources},
+            "digest": None if sources else self.digest,
+        }
+
+    def is_valid(self, tags: Dict) -> bool:
+        """タグを付けた時点から、回答が参照したファイルが変わっていないか"""
+        if tags.get("index_id") != self.index_id:
+            return False
+        sources = tags.get("sources") or {}
+        if not sources:
+            return tags.get("digest") == self.digest
+        return all(h is not None and self.file_hashes.get(s) == h for s, h in sources.items())
+
+
+class AnswerCache:
+    """
+    質問のEmbeddingで引く回答キャッシュ（SQLiteに永続化、LRUで削除）
+
+    回答にはインデックスの状態のタグ（IndexState.tags_for()）を付け、
+    インデックス処理で参照元のファイルが更新・削除された回答だけを無効にする。
+    検索は全エントリのEmbeddingをメモリ上の行列に持ち、内積でまとめて計算する。
+    """
+
+    def __init__(self, path: str = ANSWER_CACHE_PATH, max_entries: int = ANSWER_CACHE_SIZE,
+                 threshold: float = ANSWER_CACHE_THRESHOLD):
+        """
+        初期化
+
+        Args:
+            path: 保存先のSQLiteファイル
+            max_entries: 保持する最大件数
+            threshold: 同じ質問とみなすコサイン類似度
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, model TEXT NOT NULL,"
+            " question TEXT NOT NULL, embedding BLOB NOT NULL,"
+            " answer TEXT NOT NULL, refs TEXT NOT NULL, tags TEXT NOT NULL,"
+            " created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+        # 検索用にEmbedding（正規化済み）をメモリに読み込む
+        self._ids: List[int] = []
+        self._models: List[str] = []
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._load_matrix()
+
+    def _load_matrix(self):
+        rows = self._conn.execute("SELECT id, model, embedding FROM answers ORDER BY id").fetchall()
+        self._ids = [row[0] for row in rows]
+        self._models = [row[1] for row in rows]
+        vectors = [np.frombuffer(row[2], dtype=np.float32) for row in rows]
+        if vectors and len({v.shape[0] for v in vectors}) == 1:
+            self._matrix = np.vstack(vectors)
+        else:
+            # 次元の異なるEmbeddingが混在する場合は読み込まない（モデル変更直後など）
+            if vectors:
+                self._conn.execute("DELETE FROM answers")
+                self._conn.commit()
+                self._ids, self._models = [], []
+            self._matrix = np.zeros((0, 0), dtype=np.float32)
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(v)
+        return v / norm if norm else v
+
+    def _delete_ids(self, ids: List[int]):
+        """エントリを削除（呼び出し側でロックを取得していること）"""
+        if not ids:
+            return
+        self._conn.executemany("DELETE FROM answers WHERE id = ?", [(i,) for i in ids])
+        self._conn.commit()
+        drop = set(ids)
+        keep = [i for i, entry_id in enumerate(self._ids) if entry_id not in drop]
+        self._ids = [self._ids[i] for i in keep]
+        self._models = [self._models[i] for i in keep]
+        self._matrix = self._matrix[keep] if keep else np.zeros((0, 0), dtype=np.float32)
+
+    # ==================== 公開API ====================
+
+    def lookup(self, model: str, vector: List[float], state: IndexState) -> Optional[Dict]:
+        """
+        近い質問の有効な回答を取得
+
+        類似度が閾値以上の候補のうち、インデックスの更新で無効になったものは
+        削除して次の候補を見る。
+
+        Args:
+            model: 回答生成の設定を表すキー（モデル・プロンプトが変われば別の値）
+            vector: 質問のEmbedding
+            state: 現在のインデックスの状態
+
+        Returns:
+            question, answer, references, similarity を持つ辞書（なければNone）
+        """
+        with self._lock:
+            if not self._ids or self._matrix.shape[1] != len(vector):
+                self.misses += 1
+                return None
+
+            similarities = self._matrix @ self._normalize(vector)
+            order = np.argsort(-similarities)
+            stale = []
+            found = None
+            for i in order:
+                similarity = float(similarities[i])
+                if similarity < self.threshold:
+                    break
+                if self._models[i] != model:
+                    continue
+                row = self._conn.execute(
+                    "SELECT question, answer, refs, tags FROM answers WHERE id = ?", (self._ids[i],)
+                ).fetchone()
+                if row is None:
+                    continue
+                if not state.is_valid(json.loads(row[3])):
+                    stale.append(self._ids[i])
+                    continue
+                found = {
+                    "question": row[0],
+                    "answer": row[1],
+                    "references": json.loads(row[2]),
+                    "similarity": similarity,
+                }
+                self._conn.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), self._ids[i]))
+                self._conn.commit()
+                break
+
+            self._delete_ids(stale)
+            if found is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return found
+
+    def put(self, model: str, question: str, vector: List[float], answer: str,
+            references: List[Dict], state: IndexState):
+        """
+        回答を保存
+
+        Args:
+            model: 回答生成の設定を表すキー
+            question: 質問
+            vector: 質問のEmbedding
+            answer: 回答
+            references: 回答に使った検索結果
+            state: 回答を生成した時点のインデックスの状態
+        """
+        normalized = self._normalize(vector)
+        tags = state.tags_for([r.get("source") for r in references])
+        now = time.time()
+        with self._lock:
+            if self._ids and self._matrix.shape[1] != normalized.shape[0]:
+                # Embeddingの次元が変わった（モデル変更）場合は作り直す
+                self._delete_ids(list(self._ids))
+            cursor = self._conn.execute(
+                "INSERT INTO answers (model, question, embedding, answer, refs, tags, created_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (model, question, normalized.tobytes(), answer,
+                 json.dumps(references, ensure_ascii=False, default=str),
+                 json.dumps(tags, ensure_ascii=False), now, now)
+            )
+            self._conn.commit()
+            self._ids.append(cursor.lastrowid)
+            self._models.append(model)
+            self._matrix = normalized[None, :] if self._matrix.size == 0 else np.vstack([self._matrix, normalized])
+
+            # 上限を超えたら最も長く使われていないものから削除
+            overflow = len(self._ids) - self.max_entries
+            if overflow > 0:
+                rows = self._conn.execute(
+                    "SELECT id FROM answers ORDER BY last_used ASC LIMIT ?", (overflow,)
+                ).fetchall()
+                self._delete_ids([row[0] for row in rows])
+
+    def invalidate(self, state: IndexState) -> int:
+        """
+        インデックスの更新で無効になった回答をまとめて削除
+
+        Args:
+            state: 現在のインデックスの状態
+
+        Returns:
+            削除した件数
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT id, tags FROM answers").fetchall()
+            stale = [entry_id for entry_id, tags in rows if not state.is_valid(json.loads(tags))]
+            self._delete_ids(stale)
+        if stale:
+            print(f"回答キャッシュ: インデックスの更新により {len(stale)}件を無効にしました")
+        return len(stale)
+
+    def stats(self) -> Dict:
+        """ヒット数・ミス数・ヒット率・保持件数を取得"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._ids),
+            }
+
+
+class IndexStateWatcher:
+    """マニフェストの更新を検知してIndexStateを作り直す（変わっていなければ前回の値を返す）"""
+
+    def __init__(self, manifest_path: str = MANIFEST_PATH, docs_dir: str = DOCS_DIR):
+        self.manifest_path = manifest_path
+        self.docs_dir = docs_dir
+        self._signature: Optional[Tuple[int, int]] = None
+        self._state = IndexState(None, {})
+        self._lock = threading.Lock()
+
+    def current(self) -> Tuple[IndexState, bool]:
+        """
+        現在のインデックスの状態を取得
+
+        Returns:
+            (状態, 前回から変わったか)のタプル
+        """
+        try:
+            st = os.stat(self.manifest_path)
+            signature = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            signature = None
+        with self._lock:
+            if signature == self._signature:
+                return self._state, False
+            manifest = {}
+            if signature is not None:
+                try:
+                    with open(self.manifest_path, "r", encoding="utf-8") as f:
+                        manifest = json.load(f)
+                except Exception as e:
+                    print(f"マニフェスト読み込みエラー: {e}")
+            self._signature = signature
+            self._state = IndexState.from_manifest(manifest, self.docs_dir)
+            return self._state, True
+
+
+# グローバルインスタンス（全セッションで共有）
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    """回答キャッシュのシングルトンインスタンスを取得"""
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache()
+    return _answer_cache
@@ -4,13 +4,13 @@ Streamlit UI（チャット画面）
 import os
 import streamlit as st
 from pathlib import Path
-from rag import get_rag_system
 from auth import (
     init_default_user,
     verify_password,
     is_authenticated,
     get_current_user
 )
+from warmup import start_warmup, warmup_status, STATE_WARMING, STATE_READY
 
 # 定数定義
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -53,11 +53,32 @@ if "user_email" not in st.session_state:
 # デフォルトユーザーの初期化
 init_default_user()
 
+# RAGシステムの準備をバックグラウンドで開始（ログイン画面の表示中に済ませる、プロセスで1回だけ）
+start_warmup()
+
 
 def init_rag_system():
-    """RAGシステムを初期化"""
+    """RAGシステム（全セッションで共有するインスタンス）を取得"""
     if st.session_state.rag_system is None:
-        st.session_state.rag_system = get_rag_system()
+        # LangChain・ベクトルストアのimportはログイン画面の表示では行わない
+        # （通常は起動時のウォームアップのスレッドで読み込み済み）
+        from rag import get_rag_system
+        if warmup_status()["state"] == STATE_WARMING:
+            # バックグラウンドで作成中のインスタンスができるまで待つ
+            with st.spinner("検索エンジンを準備中..."):
+                st.session_state.rag_system = get_rag_system()
+        else:
+            st.session_state.rag_system = get_rag_system()
+
+
+def format_score(ref: dict) -> str:
+    """参照元のスコア表示（ベクトル検索の類似度スコアとキーワード検索のスコア）"""
+    parts = []
+    if ref.get("score") is not None:
+        parts.append(f"類似度スコア: {ref['score']:.4f}")
+    if ref.get("lexical_score") is not None:
+        parts.append(f"キーワード一致: {ref['lexical_score']:.2f}")
+    return " / ".join(parts)
 
 
 # ==================== 認証チェック ====================
@@ -123,7 +144,13 @@ for message in st.session_state.messages:
                 for ref in message["references"]:
                     page_info = f" (p.{ref['page']})" if ref.get("page") else ""
                     st.markdown(f"**[{ref['index']}] {ref['filename']}{page_info}**")
-                    st.caption(f"類似度スコア: {ref['score']:.4f}")
+                    st.caption(format_score(ref))
+                    if ref.get("duplicates"):
+                        same = "、".join(
+                            d["filename"] + (f" (p.{d['page']})" if d.get("page") else "")
+                            for d in ref["duplicates"]
+                        )
+                        st.caption(f"同じ内容の参照元: {same}")
                     with st.expander(f"詳細を見る", expanded=False):
                         st.text(ref["chunk"])
                     st.divider()
@@ -139,26 +166,32 @@ if prompt := st.chat_input("質問を入力してください..."):
     
     # AI回答を生成
     with st.chat_message("assistant"):
+        rag_system = st.session_state.rag_system
+        
+        # RAG検索（回答の生成はストリーミングで行う）
         with st.spinner("考え中..."):
-            rag_system = st.session_state.rag_system
-            
-            # RAG検索と回答生成
-            answer, search_results, used_llm = rag_system.query(prompt)
-            
-            # 回答を表示
-            st.markdown(answer)
-            
-            # 参照情報を表示（最初は畳まれている）
-            if search_results:
-                st.markdown("---")
-                with st.expander("📚 参照元", expanded=False):
-                    for ref in search_results:
-                        page_info = f" (p.{ref['page']})" if ref.get("page") else ""
-                        st.markdown(f"**[{ref['index']}] {ref['filename']}{page_info}**")
-                        st.caption(f"類似度スコア: {ref['score']:.4f}")
-                        with st.expander(f"詳細を見る", expanded=False):
-                            st.text(ref["chunk"])
-                        st.divider()
+            answer_stream, search_results = rag_system.query_stream(prompt)
+        
+        # 回答をトークンが届くたびに表示
+        answer = st.write_stream(answer_stream)
+        
+        # 参照情報を表示（最初は畳まれている）
+        if search_results:
+            st.markdown("---")
+            with st.expander("📚 参照元", expanded=False):
+                for ref in search_results:
+                    page_info = f" (p.{ref['page']})" if ref.get("page") else ""
+                    st.markdown(f"**[{ref['index']}] {ref['filename']}{page_info}**")
+                    st.caption(format_score(ref))
+                    if ref.get("duplicates"):
+                        same = "、".join(
+                            d["filename"] + (f" (p.{d['page']})" if d.get("page") else "")
+                            for d in ref["duplicates"]
+                        )
+                        st.caption(f"同じ内容の参照元: {same}")
+                    with st.expander(f"詳細を見る", expanded=False):
+                        st.text(ref["chunk"])
+                    st.divider()
         
         # アシスタントメッセージを追加
         st.session_state.messages.append({
@@ -182,6 +215,37 @@ with st.sidebar:
     
     st.metric("📁 ファイル数", len(files))
     
+    # 起動時のウォームアップの状態
+    warmup = warmup_status()
+    if warmup["state"] == STATE_READY:
+        st.caption(f"🔥 検索エンジン: 準備完了（起動時 {warmup['elapsed']:.1f}秒）")
+    elif warmup["state"] == STATE_WARMING:
+        st.caption("⏳ 検索エンジン: 準備中...")
+    
+    # 質問のEmbeddingキャッシュ（全セッション共通）の利用状況
+    if st.session_state.rag_system is not None:
+        cache_stats = st.session_state.rag_system.cache_stats()
+        query_cache = cache_stats["query_embedding"]
+        st.caption(
+            f"🔁 質問Embeddingキャッシュ: ヒット率 {query_cache['hit_rate']:.0%}"
+            f"（{query_cache['hits']} / {query_cache['hits'] + query_cache['misses']}件, "
+            f"保持 {query_cache['entries']}件）"
+        )
+        answer_cache = cache_stats["answer"]
+        if answer_cache:
+            st.caption(
+                f"💾 回答キャッシュ: ヒット率 {answer_cache['hit_rate']:.0%}"
+                f"（{answer_cache['hits']} / {answer_cache['hits'] + answer_cache['misses']}件, "
+                f"保持 {answer_cache['entries']}件）"
+            )
+        # Supabaseの接続プール（全セッション共通）の利用状況
+        db_pool = st.session_state.rag_system.db_pool_stats()
+        if db_pool:
+            st.caption(
+                f"🔌 DB接続プール: 使用中 {db_pool['checked_out']} / 最大 {db_pool['max']}接続"
+                f"（利用率 {db_pool['utilization']:.0%}, ピーク {db_pool['peak']}, 待機中 {db_pool['checked_in']}）"
+            )
+
     st.markdown("---")
     if st.button("🗑️ チャット履歴をクリア"):
         st.session_state.messages = []
@@ -0,0 +1,77 @@
+"""
+回答生成の同時実行の比較（スレッドで同期APIを呼ぶ場合 / AsyncOpenAIで待つ場合、ローカルの偽サーバーを使用）
+
+使い方:
+    python benchmarks/bench_async_rag.py --requests 64 --latency 0.5
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai_server import start_server  # noqa: E402
+
+
+def make_context(i: int) -> list:
+    """検索結果の形式のダミーの参照情報"""
+    chunk = "本マニュアルは製品の設置手順と保守点検について説明します。" * 20
+    return [
+        {"index": j, "filename": f"manual-{j}.pdf", "page": i % 50, "chunk": f"[{i}-{j}] {chunk}"}
+        for j in range(1, 5)
+    ]
+
+
+def run_threads(rag_system, questions: list, contexts: list) -> dict:
+    """1リクエスト1スレッドで同期のgenerate_answer()を呼ぶ（Streamlitのセッションと同じ）"""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(questions)) as executor:
+        threads = threading.active_count()
+        answers = list(executor.map(rag_system.generate_answer, questions, contexts))
+        threads = max(threads, threading.active_count())
+    return {"wall": time.perf_counter() - started, "threads": threads, "answers": answers}
+
+
+def run_async(rag_system, questions: list, contexts: list) -> dict:
+    """1スレッドのイベントループでagenerate_answer()をまとめて待つ"""
+    async def run():
+        return await asyncio.gather(*(
+            rag_system.agenerate_answer(question, context) for question, context in zip(questions, contexts)
+        ))
+
+    started = time.perf_counter()
+    answers = asyncio.run(run())
+    return {"wall": time.perf_counter() - started, "threads": threading.active_count(), "answers": answers}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="同期/非同期の回答生成の比較")
+    parser.add_argument("--requests", type=int, default=64, help="同時に投げる質問の数")
+    parser.add_argument("--latency", type=float, default=0.5, help="偽サーバーの1リクエストあたりの遅延秒数")
+    args = parser.parse_args()
+
+    server = start_server(latency=args.latency)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ["OPENAI_API_KEY"] = "dummy"
+    from rag import RAGSystem
+
+    rag_system = RAGSystem()
+    questions = [f"質問{i}: 保守点検の手順を教えてください" for i in range(args.requests)]
+    contexts = [make_context(i) for i in range(args.requests)]
+
+    print(f"質問: {args.requests}件 / サーバーの遅延: {args.latency}秒")
+    print(f"{'方式':<24} {'時間(s)':>8} {'件/s':>8} {'スレッド数':>10}")
+    for name, run in (("スレッド + OpenAI", run_threads), ("asyncio + AsyncOpenAI", run_async)):
+        result = run(rag_system, questions, contexts)
+        assert all(used_llm for _, used_llm in result["answers"])
+        print(f"{name:<24} {result['wall']:>8.2f} {args.requests / result['wall']:>8.1f} {result['threads']:>10}")
+    server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
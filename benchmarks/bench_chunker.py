@@ -0,0 +1,99 @@
+"""
+TextChunkerとRecursiveCharacterTextSplitterの分割速度の比較（合成コーパスを使用）
+
+使い方:
+    python benchmarks/bench_chunker.py --mb 20
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_chunker import TextChunker, UNIT_CHARS, UNIT_TOKENS  # noqa: E402
+from ingest import CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_MODEL  # noqa: E402
+
+try:
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+except ImportError:
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+JA_SENTENCES = [
+    "本マニュアルは製品の設置手順と保守点検について説明します。",
+    "作業を始める前に、必ず電源プラグを抜いてください。",
+    "異常な音や臭いがする場合は、直ちに使用を中止してください！",
+    "交換部品の型番は「RX-200-F」です。",
+    "設定値を変更しましたか？変更した場合は再起動が必要です。",
+]
+EN_SENTENCES = [
+    "The Model RX-200 supports input voltages from 100V to 240V.",
+    "Refer to section 4.2 for the maintenance schedule.",
+    "Do not operate the unit while the cover is open.",
+]
+
+
+def make_corpus(target_bytes: int, seed: int = 0) -> list:
+    """日本語と英語が混在した、1ページ数千文字の合成ページを作る"""
+    rng = random.Random(seed)
+    pages = []
+    size = 0
+    while size < target_bytes:
+        paragraphs = []
+        for _ in range(rng.randint(3, 8)):
+            sentences = [rng.choice(EN_SENTENCES if rng.random() < 0.3 else JA_SENTENCES)
+                         for _ in range(rng.randint(2, 12))]
+            paragraphs.append("".join(sentences) if rng.random() < 0.5 else "\n".join(sentences))
+        page = "\n\n".join(paragraphs)
+        pages.append(page)
+        size += len(page.encode("utf-8"))
+    return pages
+
+
+def sentence_end_ratio(chunks: list) -> float:
+    """文末（。！？.）または行末で終わるチャンクの割合"""
+    if not chunks:
+        return 0.0
+    ends = sum(1 for chunk in chunks if chunk.rstrip()[-1:] in ("。", "！", "？", ".", "」"))
+    return ends / len(chunks)
+
+
+def run(name: str, split, pages: list, total_bytes: int):
+    started = time.perf_counter()
+    chunks = []
+    for page in pages:
+        chunks.extend(split(page))
+    elapsed = time.perf_counter() - started
+    average = sum(len(c) for c in chunks) / len(chunks) if chunks else 0
+    print(f"{name:<28} {elapsed:>8.2f} {total_bytes / elapsed / 1e6:>8.1f} {len(chunks):>8} "
+          f"{average:>8.0f} {sentence_end_ratio(chunks) * 100:>7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="チャンク分割の速度比較")
+    parser.add_argument("--mb", type=float, default=20.0, help="合成コーパスのサイズ（MB）")
+    parser.add_argument("--tokens", action="store_true", help="トークン単位の分割も計測する")
+    args = parser.parse_args()
+
+    pages = make_corpus(int(args.mb * 1e6))
+    total_bytes = sum(len(page.encode("utf-8")) for page in pages)
+    print(f"合成コーパス: {len(pages)} ページ / {total_bytes / 1e6:.1f} MB")
+    print(f"{'分割方法':<24} {'時間(s)':>8} {'MB/s':>8} {'チャンク':>6} {'平均長':>6} {'文末終了':>6}")
+
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP, length_function=len
+    )
+    run("RecursiveCharacterTextSplitter", splitter.split_text, pages, total_bytes)
+
+    chunker = TextChunker(CHUNK_SIZE, CHUNK_OVERLAP, unit=UNIT_CHARS)
+    run("TextChunker (chars)", chunker.split_text, pages, total_bytes)
+
+    if args.tokens:
+        chunker = TextChunker(CHUNK_SIZE, CHUNK_OVERLAP, unit=UNIT_TOKENS, model=EMBEDDING_MODEL)
+        run("TextChunker (tokens)", chunker.split_text, pages, total_bytes)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+"""
+EmbeddingSchedulerのスループット計測（ローカルの偽サーバーを使用）
+
+使い方:
+    python benchmarks/bench_embedding_scheduler.py --chunks 2000 --latency 0.05 --rate-limit-every 25
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import OpenAI  # noqa: E402
+
+from embedding_scheduler import EmbeddingScheduler  # noqa: E402
+from benchmarks.fake_openai_server import start_server  # noqa: E402
+
+
+def make_chunks(n: int):
+    """800文字前後の日本語混じりのダミーチャンクを作る"""
+    base = "本マニュアルは製品の設置手順と保守点検について説明します。Model RX-200 の仕様を確認してください。"
+    return [f"[{i}] " + base * 16 for i in range(n)]
+
+
+def run(chunks, base_url: str, concurrency: int, max_batch_tokens: int) -> dict:
+    client = OpenAI(base_url=base_url, api_key="dummy", max_retries=0)
+    scheduler = EmbeddingScheduler(
+        model="text-embedding-3-small",
+        client=client,
+        max_concurrency=concurrency,
+        max_batch_tokens=max_batch_tokens,
+    )
+    started = time.perf_counter()
+    vectors = scheduler.embed_documents(chunks)
+    wall = time.perf_counter() - started
+    assert len(vectors) == len(chunks) and all(v is not None for v in vectors)
+    progress = scheduler.progress()
+    progress["wall"] = wall
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EmbeddingSchedulerのスループット計測")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05, help="偽サーバーの1リクエストあたりの遅延秒数")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="N回に1回429を返す")
+    parser.add_argument("--max-batch-tokens", type=int, default=20000)
+    args = parser.parse_args()
+
+    server = start_server(latency=args.latency, rate_limit_every=args.rate_limit_every, retry_after=0.2)
+    base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    chunks = make_chunks(args.chunks)
+
+    print(f"{'並列数':>6} {'時間(s)':>8} {'chunks/s':>10} {'tokens/s':>10} {'req':>5} {'429':>5}")
+    for concurrency in (1, 2, 4, 8):
+        p = run(chunks, base_url, concurrency, args.max_batch_tokens)
+        print(f"{concurrency:>6} {p['wall']:>8.2f} {p['chunks'] / p['wall']:>10.1f} "
+              f"{p['tokens'] / p['wall']:>10.0f} {p['requests']:>5} {p['rate_limited']:>5}")
+
+    server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
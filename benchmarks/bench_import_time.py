@@ -0,0 +1,140 @@
+"""
+ログイン画面のコールドスタート時のimport時間の計測（python -X importtime、予算を超えたら失敗）
+
+app.pyのモジュールの先頭で行うimport（ログイン画面の表示までに読み込まれるもの）を
+新しいPythonプロセスで実行し、合計時間が予算以内であることと、LangChain・ベクトルストア・
+OpenAIのモジュールが読み込まれていないことを確認する。
+
+使い方:
+    python benchmarks/bench_import_time.py --budget-ms 1500
+    python benchmarks/bench_import_time.py --modules rag --budget-ms 3000 --allow-heavy
+"""
+import os
+import re
+import ast
+import sys
+import argparse
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(BASE_DIR, "app.py")
+
+# ログイン画面の表示までに読み込んではいけないモジュール（トップレベルのパッケージ名）
+HEAVY_MODULES = (
+    "langchain", "langchain_core", "langchain_community", "langchain_openai", "langchain_postgres",
+    "langchain_text_splitters", "chromadb", "openai", "sqlalchemy", "psycopg", "psycopg2", "tiktoken", "rag",
+)
+# 予算の既定値（ミリ秒）
+DEFAULT_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "1500"))
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)")
+
+
+def app_imports(path: str = APP_PATH) -> list:
+    """app.pyのモジュールの先頭（関数の外）でimportするモジュール名"""
+    with open(path, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=path)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def _run_importtime(code: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BASE_DIR, capture_output=True, text=True,
+    )
+
+
+def _top_level_entries(stderr: str) -> list:
+    """-X importtimeの出力から最上位のimport（その下で読み込まれた時間を含む）の(累積μs, 名前)を取り出す"""
+    entries = []
+    for line in stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match and len(match.group(3)) == 1:
+            entries.append((int(match.group(2)), match.group(4)))
+    return entries
+
+
+def startup_modules() -> set:
+    """Python自体の起動時に読み込まれるモジュール（計測から除く）"""
+    return {name for _, name in _top_level_entries(_run_importtime("pass").stderr)}
+
+
+def measure(modules: list, exclude: set = frozenset()) -> dict:
+    """
+    新しいプロセスでmodulesをimportし、-X importtimeの出力を集計
+
+    Args:
+        modules: importするモジュール名
+        exclude: 集計から除くモジュール名（Python自体の起動時のもの）
+
+    Returns:
+        total_ms（合計時間）、top（時間のかかったモジュール）、loaded（読み込まれたモジュール名）の辞書
+    """
+    code = (
+        f"import sys; sys.path.insert(0, {BASE_DIR!r})\n"
+        + "".join(f"import {module}\n" for module in modules)
+        + "print('\\n'.join(sorted(sys.modules)))\n"
+    )
+    completed = _run_importtime(code)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+
+    entries = sorted(
+        ((us, name) for us, name in _top_level_entries(completed.stderr) if name not in exclude), reverse=True
+    )
+    return {
+        "total_ms": sum(us for us, _ in entries) / 1000,
+        "top": [(name, us / 1000) for us, name in entries[:10]],
+        "loaded": completed.stdout.split(),
+    }
+
+
+def heavy_modules(loaded: list) -> list:
+    """読み込まれたモジュールのうち、ログイン画面で読み込んではいけないもの（パッケージ単位）"""
+    return sorted({name.split(".")[0] for name in loaded if name.split(".")[0] in HEAVY_MODULES})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ログイン画面のimport時間の計測")
+    parser.add_argument("--modules", nargs="+", help="計測するモジュール（省略時はapp.pyの先頭のimport）")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="import時間の予算（ミリ秒）")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数（最小値で判定する）")
+    parser.add_argument("--allow-heavy", action="store_true", help="LangChain等の読み込みを失敗にしない")
+    args = parser.parse_args()
+
+    modules = args.modules or app_imports()
+    print(f"対象: {', '.join(modules)}")
+    try:
+        exclude = startup_modules()
+        results = [measure(modules, exclude) for _ in range(args.repeat)]
+    except RuntimeError as e:
+        print(f"❌ importに失敗しました: {e}")
+        return 2
+    best = min(results, key=lambda result: result["total_ms"])
+
+    print(f"{'モジュール':<32} {'時間(ms)':>9}")
+    for name, ms in best["top"]:
+        print(f"{name:<32} {ms:>9.1f}")
+    print(f"{'合計（最小 / ' + str(args.repeat) + '回）':<32} {best['total_ms']:>9.1f}  予算 {args.budget_ms:.0f}ms")
+
+    failed = False
+    heavy = heavy_modules(best["loaded"])
+    if heavy and not args.allow_heavy:
+        print(f"❌ ログイン画面の表示前に読み込まれています: {', '.join(heavy)}")
+        failed = True
+    if best["total_ms"] > args.budget_ms:
+        print(f"❌ import時間が予算を超えています: {best['total_ms']:.1f}ms > {args.budget_ms:.0f}ms")
+        failed = True
+    if not failed:
+        print("✅ 予算内です")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""
+MMRの選択にかかる時間（NumPyの行列演算 / 候補の組ごとに類似度を計算するPythonのループ）
+
+使い方:
+    python benchmarks/bench_mmr.py --pools 50 100 200 500 --dim 1536 --k 4
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mmr import mmr_select  # noqa: E402
+
+
+def mmr_select_loop(query: list, candidates: list, k: int, lambda_mult: float) -> list:
+    """比較用: 候補の組ごとにコサイン類似度を計算する素朴な実装"""
+    def cosine(a, b):
+        dot = sum(x * y for x, y in zip(a, b))
+        return dot / ((sum(x * x for x in a) ** 0.5) * (sum(y * y for y in b) ** 0.5))
+
+    relevance = [cosine(c, query) for c in candidates]
+    selected = []
+    while len(selected) < min(k, len(candidates)):
+        best, best_score = None, -float("inf")
+        for i, candidate in enumerate(candidates):
+            if i in selected:
+                continue
+            redundancy = max((cosine(candidate, candidates[j]) for j in selected), default=None)
+            score = relevance[i] if redundancy is None else lambda_mult * relevance[i] - (1 - lambda_mult) * redundancy
+            if score > best_score:
+                best, best_score = i, score
+        selected.append(best)
+    return selected
+
+
+def measure(fn, repeat: int) -> np.ndarray:
+    """repeat回実行した時間（ミリ秒）"""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return np.array(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MMRの選択の速度")
+    parser.add_argument("--pools", type=int, nargs="+", default=[50, 100, 200, 500], help="候補数")
+    parser.add_argument("--dim", type=int, default=1536, help="Embeddingの次元数")
+    parser.add_argument("--k", type=int, default=4, help="選ぶ件数")
+    parser.add_argument("--lambda-mult", type=float, default=0.5, help="関連度と多様性の重み")
+    parser.add_argument("--repeat", type=int, default=200, help="NumPy版の計測回数")
+    parser.add_argument("--loop-repeat", type=int, default=3, help="ループ版の計測回数（0で省略）")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"次元: {args.dim} / k: {args.k} / lambda: {args.lambda_mult}")
+    print(f"{'候補数':>6} {'NumPy p50(ms)':>14} {'p95(ms)':>9} {'ループ(ms)':>11}")
+    for pool in args.pools:
+        query = rng.standard_normal(args.dim).astype(np.float32)
+        candidates = rng.standard_normal((pool, args.dim)).astype(np.float32)
+        selected = mmr_select(query, candidates, args.k, args.lambda_mult)
+        times = measure(lambda: mmr_select(query, candidates, args.k, args.lambda_mult), args.repeat)
+
+        loop = "-"
+        if args.loop_repeat:
+            query_list, candidate_list = query.tolist(), candidates.tolist()
+            assert mmr_select_loop(query_list, candidate_list, args.k, args.lambda_mult) == selected
+            loop_times = measure(
+                lambda: mmr_select_loop(query_list, candidate_list, args.k, args.lambda_mult), args.loop_repeat
+            )
+            loop = f"{np.median(loop_times):.1f}"
+        print(f"{pool:>6} {np.percentile(times, 50):>14.3f} {np.percentile(times, 95):>9.3f} {loop:>11}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+NumpyVectorStoreとChroma DBの書き込み・検索速度の比較（ランダムなEmbeddingを使用）
+
+使い方:
+    python benchmarks/bench_vectorstore.py --n 100000 --dim 1536 --queries 200
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from numpy_vectorstore import NumpyVectorStore  # noqa: E402
+
+try:
+    from langchain_community.vectorstores import Chroma
+except ImportError:
+    Chroma = None
+
+# 書き込み1回あたりの件数（ingest.EMBED_BATCH_SIZEの既定値に合わせる）
+BATCH_SIZE = 256
+
+
+def make_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    """正規化したランダムなEmbeddingを作る"""
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, dim), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> list:
+    """正解（全件の内積）のtop-kの行番号"""
+    scores = queries @ vectors.T
+    return [set(np.argsort(-row)[:k]) for row in scores]
+
+
+def write(store_add, vectors: np.ndarray) -> float:
+    started = time.perf_counter()
+    for start in range(0, len(vectors), BATCH_SIZE):
+        rows = range(start, min(start + BATCH_SIZE, len(vectors)))
+        store_add(
+            ids=[f"chunk-{i}" for i in rows],
+            vectors=vectors[start:start + BATCH_SIZE].tolist(),
+            texts=[f"chunk text {i}" for i in rows],
+            metadatas=[{"source": f"doc-{i % 100}.pdf", "page": i % 50} for i in rows],
+        )
+    return time.perf_counter() - started
+
+
+def measure(name: str, search, queries: np.ndarray, expected: list, write_seconds: float, open_seconds: float):
+    latencies = []
+    hits = 0
+    for query, truth in zip(queries, expected):
+        started = time.perf_counter()
+        rows = search(query)
+        latencies.append(time.perf_counter() - started)
+        hits += len(truth & rows)
+    latencies = np.array(latencies) * 1000
+    recall = hits / sum(len(t) for t in expected)
+    print(f"{name:<22} {write_seconds:>8.2f} {open_seconds * 1000:>9.1f} {np.percentile(latencies, 50):>8.2f} "
+          f"{np.percentile(latencies, 95):>8.2f} {recall:>7.3f}")
+
+
+def bench_numpy(vectors, queries, expected, k: int, dtype: str, work_dir: str):
+    path = os.path.join(work_dir, f"numpy-{dtype}")
+    store = NumpyVectorStore(path, dtype=dtype)
+    write_seconds = write(
+        lambda ids, vectors, texts, metadatas: store.add_embeddings(texts, vectors, metadatas, ids),
+        vectors
+    )
+    # 検索側のプロセスと同じく、開き直してから検索する
+    started = time.perf_counter()
+    store = NumpyVectorStore(path)
+    open_seconds = time.perf_counter() - started
+
+    def search(query):
+        return {int(doc.page_content.rsplit(" ", 1)[1])
+                for doc, _ in store.similarity_search_by_vector_with_score(query.tolist(), k)}
+
+    measure(f"NumpyVectorStore ({dtype})", search, queries, expected, write_seconds, open_seconds)
+    return store
+
+
+def bench_numpy_batch(store, queries, expected, k: int, batch: int):
+    """複数クエリをまとめて検索した場合（RAGSystem.search_many()と同じ経路）の1クエリあたりの時間"""
+    latencies = []
+    hits = 0
+    for start in range(0, len(queries), batch):
+        started = time.perf_counter()
+        results = store.similarity_search_by_vectors_with_score(queries[start:start + batch].tolist(), k)
+        elapsed = time.perf_counter() - started
+        latencies.extend([elapsed / len(results)] * len(results))
+        for docs, truth in zip(results, expected[start:start + batch]):
+            hits += len(truth & {int(doc.page_content.rsplit(" ", 1)[1]) for doc, _ in docs})
+    latencies = np.array(latencies) * 1000
+    recall = hits / sum(len(t) for t in expected)
+    name = f"  バッチ{batch}件 (1件あたり)"
+    print(f"{name:<22} {'':>8} {'':>9} {np.percentile(latencies, 50):>8.2f} "
+          f"{np.percentile(latencies, 95):>8.2f} {recall:>7.3f}")
+
+
+def bench_chroma(vectors, queries, expected, k: int, work_dir: str):
+    path = os.path.join(work_dir, "chroma")
+    store = Chroma(persist_directory=path, collection_name="bench")
+    write_seconds = write(
+        lambda ids, vectors, texts, metadatas: store._collection.upsert(
+            ids=ids, embeddings=vectors, documents=texts, metadatas=metadatas
+        ),
+        vectors
+    )
+    del store
+    started = time.perf_counter()
+    store = Chroma(persist_directory=path, collection_name="bench")
+    open_seconds = time.perf_counter() - started
+
+    def search(query):
+        result = store._collection.query(query_embeddings=[query.tolist()], n_results=k, include=[])
+        return {int(chunk_id.rsplit("-", 1)[1]) for chunk_id in result["ids"][0]}
+
+    measure("Chroma DB", search, queries, expected, write_seconds, open_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベクトルストアの速度比較")
+    parser.add_argument("--n", type=int, default=100000, help="保存するEmbeddingの件数")
+    parser.add_argument("--dim", type=int, default=1536, help="Embeddingの次元（text-embedding-3-smallは1536）")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=64, help="まとめて検索するクエリ数（0で省略）")
+    parser.add_argument("--skip-chroma", action="store_true", help="Chroma DBの計測を省略する")
+    args = parser.parse_args()
+
+    vectors = make_vectors(args.n, args.dim)
+    queries = make_vectors(args.queries, args.dim, seed=1)
+    expected = exact_top_k(vectors, queries, args.k)
+    print(f"Embedding: {args.n}件 x {args.dim}次元 / クエリ: {args.queries}件 / k={args.k}")
+    print(f"{'ストア':<19} {'書込(s)':>8} {'起動(ms)':>9} {'p50(ms)':>8} {'p95(ms)':>8} {'recall':>7}")
+
+    work_dir = tempfile.mkdtemp(prefix="bench_vectorstore_")
+    try:
+        for dtype in ("float32", "float16"):
+            store = bench_numpy(vectors, queries, expected, args.k, dtype, work_dir)
+            if args.batch:
+                bench_numpy_batch(store, queries, expected, args.k, args.batch)
+        if args.skip_chroma:
+            pass
+        elif Chroma is None:
+            print("Chroma DBが利用できないため省略しました")
+        else:
+            bench_chroma(vectors, queries, expected, args.k, work_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
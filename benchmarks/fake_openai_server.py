@@ -0,0 +1,183 @@
+"""
+ベンチマーク・動作確認用のOpenAI互換ローカルサーバー
+
+/v1/embeddings にテキストから決定的に作ったベクトルを、
+/v1/chat/completions に入力から決定的に作った回答を返す（"stream": true の場合はSSEで少しずつ返す）。
+遅延や一定間隔の429応答を注入して、スケジューラのバックオフを確認できる
+（--insufficient-quota で利用枠不足の429を常に返す）。
+
+使い方:
+    python benchmarks/fake_openai_server.py --port 8765 --latency 0.05 --rate-limit-every 20
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=dummy python ingest.py
+"""
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+EMBEDDING_DIM = 1536
+
+
+def fake_answer(messages: list) -> str:
+    """最後のメッセージのハッシュから決定的な回答を作る"""
+    content = str(messages[-1].get("content", "")) if messages else ""
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:8]
+    return f"偽の回答です（入力 {len(content)}文字, {digest}）。"
+
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM) -> list:
+    """テキストのハッシュから正規化済みの疑似ベクトルを作る"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    vector /= np.linalg.norm(vector)
+    return vector.tolist()
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """OpenAI APIの一部を模したリクエストハンドラ"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, model: str, content: str):
+        """回答をServer-Sent Eventsのchat.completion.chunkとして数文字ずつ送る"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        chunk = {"id": "chatcmpl-stream", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+        pieces = [{"role": "assistant", "content": ""}]
+        pieces += [{"content": content[i:i + 4]} for i in range(0, len(content), 4)]
+        for i, delta in enumerate(pieces):
+            if i and self.server.stream_interval:
+                time.sleep(self.server.stream_interval)
+            event = dict(chunk, choices=[{"index": 0, "delta": delta, "finish_reason": None}])
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        event = dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        self.wfile.write(f"data: {json.dumps(event)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length", "0"))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_POST(self):
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+            count = server.request_count
+        if server.latency:
+            time.sleep(server.latency)
+        if server.insufficient_quota:
+            self._send_json(429, {"error": {"message": "You exceeded your current quota",
+                                            "type": "insufficient_quota", "code": "insufficient_quota"}})
+            return
+        if server.rate_limit_every and count % server.rate_limit_every == 0:
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}},
+                            {"retry-after": str(server.retry_after)})
+            return
+
+        if self.path.rstrip("/").endswith("/embeddings"):
+            body = self._read_json()
+            inputs = body.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            self._send_json(200, {
+                "object": "list",
+                "model": body.get("model", ""),
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": fake_embedding(str(text), server.dim)}
+                    for i, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+        elif self.path.rstrip("/").endswith("/chat/completions"):
+            body = self._read_json()
+            if body.get("stream"):
+                self._send_stream(body.get("model", ""), fake_answer(body.get("messages", [])))
+                return
+            self._send_json(200, {
+                "id": f"chatcmpl-{count}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", ""),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": fake_answer(body.get("messages", []))},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path: {self.path}"}})
+
+
+def start_server(port: int = 0, latency: float = 0.0, rate_limit_every: int = 0,
+                 retry_after: float = 0.5, dim: int = EMBEDDING_DIM,
+                 stream_interval: float = 0.0, insufficient_quota: bool = False) -> ThreadingHTTPServer:
+    """
+    バックグラウンドスレッドでサーバーを起動
+
+    Args:
+        port: 待ち受けポート（0の場合は空きポート）
+        latency: 1リクエストごとの遅延秒数
+        rate_limit_every: N回に1回429を返す（0の場合は返さない）
+        retry_after: 429応答のRetry-Afterヘッダーの秒数
+        dim: 返すベクトルの次元数
+        stream_interval: ストリーミングの回答を送る間隔の秒数
+        insufficient_quota: すべてのリクエストに利用枠不足（insufficient_quota）の429を返す
+
+    Returns:
+        起動したサーバー（base_urlは f"http://127.0.0.1:{server.server_port}/v1"）
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.request_count = 0
+    server.latency = latency
+    server.rate_limit_every = rate_limit_every
+    server.retry_after = retry_after
+    server.dim = dim
+    server.stream_interval = stream_interval
+    server.insufficient_quota = insufficient_quota
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI互換の偽サーバー")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    parser.add_argument("--stream-interval", type=float, default=0.02)
+    parser.add_argument("--insufficient-quota", action="store_true")
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.latency, args.rate_limit_every, args.retry_after,
+                          stream_interval=args.stream_interval, insufficient_quota=args.insufficient_quota)
+    print(f"偽OpenAIサーバーを起動しました: http://127.0.0.1:{server.server_port}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
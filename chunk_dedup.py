@@ -0,0 +1,273 @@
+"""
+チャンクの重複排除（完全一致＋MinHash/LSHによる類似チャンクの検出）
+"""
+import os
+import zlib
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from typing import List, Dict, Tuple
+
+import numpy as np
+try:
+    from langchain_core.documents import Document
+except ImportError:
+    from langchain.schema import Document
+
+# 定数定義
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEDUP_INDEX_PATH = os.path.join(BASE_DIR, ".dedup_index.sqlite")
+# 重複排除を行うか（"0"で無効）
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") != "0"
+# この推定Jaccard類似度以上のチャンクを重複とみなす
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+# 文字シングルの長さ
+SHINGLE_SIZE = 5
+# MinHashのハッシュ関数の数と、LSHのバンド数（1バンドあたり NUM_PERM / BANDS 行）
+MINHASH_NUM_PERM = 64
+LSH_BANDS = 16
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+# ハッシュ関数の係数（固定シードで生成し、保存済みのシグネチャと互換を保つ）
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, (1 << 61) - 1, size=MINHASH_NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, (1 << 61) - 1, size=MINHASH_NUM_PERM, dtype=np.uint64)
+del _rng
+
+
+def normalize_text(text: str) -> str:
+    """比較用にテキストを正規化（NFKC・小文字化・空白の除去）"""
+    return "".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+def minhash_signature(normalized: str) -> np.ndarray:
+    """
+    正規化済みテキストの文字シングルからMinHashシグネチャを計算
+
+    Args:
+        normalized: normalize_text()で正規化したテキスト
+
+    Returns:
+        長さMINHASH_NUM_PERMのuint32配列
+    """
+    if len(normalized) <= SHINGLE_SIZE:
+        shingles = {normalized}
+    else:
+        shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+    hashes = np.fromiter(
+        (zlib.crc32(s.encode("utf-8")) for s in shingles),
+        dtype=np.uint64, count=len(shingles)
+    )
+    # (a * h + b) mod p を全ハッシュ関数・全シングルについてまとめて計算し、最小値を取る
+    values = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _MERSENNE_PRIME
+    return np.bitwise_and(values, _MAX_HASH).min(axis=1).astype(np.uint32)
+
+
+def _band_hashes(signature: np.ndarray) -> List[int]:
+    """シグネチャをバンドに分け、バンドごとのハッシュ（符号付き64bit整数）を計算"""
+    rows = MINHASH_NUM_PERM // LSH_BANDS
+    result = []
+    for band in range(LSH_BANDS):
+        data = bytes([band]) + signature[band * rows:(band + 1) * rows].tobytes()
+        digest = hashlib.blake2b(data, digest_size=8).digest()
+        result.append(int.from_bytes(digest, "little", signed=True))
+    return result
+
+
+class ChunkDeduplicator:
+    """
+    インデックスに保存済みのチャンクと比較して重複チャンクを取り除く
+
+    完全一致は正規化テキストのハッシュで、類似はMinHashシグネチャのLSHで
+    候補を絞ってから推定Jaccard類似度で判定する。重複と判定したチャンクは
+    保存せず、保存済みチャンクへの参照（ファイル・ページ）として記録する。
+    状態はSQLiteに保存し、差分インデックスをまたいで使う。
+    """
+
+    def __init__(self, path: str = DEDUP_INDEX_PATH, threshold: float = DEDUP_THRESHOLD):
+        """
+        初期化
+
+        Args:
+            path: 重複排除インデックスの保存先
+            threshold: 重複とみなす推定Jaccard類似度
+        """
+        self.path = path
+        self.threshold = threshold
+        self.exact_duplicates = 0
+        self.near_duplicates = 0
+        self.checked = 0
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " chunk_id TEXT PRIMARY KEY, source_key TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL, signature BLOB NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source_key)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_hash ON chunks (text_hash)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS bands (band_hash INTEGER NOT NULL, chunk_id TEXT NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bands_hash ON bands (band_hash)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS bands_chunk ON bands (chunk_id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS refs ("
+            " chunk_id TEXT NOT NULL, source_key TEXT NOT NULL,"
+            " source TEXT, page INTEGER, similarity REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS refs_chunk ON refs (chunk_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS refs_source ON refs (source_key)")
+        self._conn.commit()
+
+    def close(self):
+        """接続を閉じる"""
+        with self._lock:
+            self._conn.close()
+
+    # ==================== 重複排除 ====================
+
+    def _find_duplicate(self, text_hash: str, signature: np.ndarray, bands: List[int]) -> Tuple[str, float]:
+        """保存済みチャンクから重複を探す（見つからなければ (None, 0.0)）"""
+        row = self._conn.execute("SELECT chunk_id FROM chunks WHERE text_hash = ? LIMIT 1", (text_hash,)).fetchone()
+        if row:
+            return row[0], 1.0
+
+        placeholders = ",".join("?" * len(bands))
+        rows = self._conn.execute(
+            f"SELECT DISTINCT c.chunk_id, c.signature FROM bands b JOIN chunks c ON c.chunk_id = b.chunk_id"
+            f" WHERE b.band_hash IN ({placeholders})",
+            bands
+        ).fetchall()
+        best_id, best_similarity = None, 0.0
+        for chunk_id, blob in rows:
+            similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+            if similarity > best_similarity:
+                best_id, best_similarity = chunk_id, similarity
+        if best_similarity >= self.threshold:
+            return best_id, best_similarity
+        return None, 0.0
+
+    def deduplicate(self, source_key: str, chunks: List[Document],
+                    ids: List[str]) -> Tuple[List[Document], List[str]]:
+        """
+        1ファイル分のチャンクから重複を取り除く
+
+        重複でないチャンクはこのファイルが所有するチャンクとして登録し、
+        重複チャンクは保存済みチャンクへの参照として登録する。
+
+        Args:
+            source_key: マニフェストのファイルキー
+            chunks: ファイルのチャンク
+            ids: チャンクID
+
+        Returns:
+            (保存するチャンク, 保存するチャンクのID)のタプル
+        """
+        kept_chunks, kept_ids = [], []
+        with self._lock:
+            for chunk, chunk_id in zip(chunks, ids):
+                normalized = normalize_text(chunk.page_content)
+                text_hash = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+                signature = minhash_signature(normalized)
+                bands = _band_hashes(signature)
+                self.checked += 1
+
+                duplicate_of, similarity = self._find_duplicate(text_hash, signature, bands)
+                if duplicate_of is not None:
+                    if similarity == 1.0:
+                        self.exact_duplicates += 1
+                    else:
+                        self.near_duplicates += 1
+                    self._conn.execute(
+                        "INSERT INTO refs (chunk_id, source_key, source, page, similarity) VALUES (?, ?, ?, ?, ?)",
+                        (duplicate_of, source_key, chunk.metadata.get("source"), chunk.metadata.get("page"), similarity)
+                    )
+                    continue
+
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO chunks (chunk_id, source_key, text_hash, signature) VALUES (?, ?, ?, ?)",
+                    (chunk_id, source_key, text_hash, signature.tobytes())
+                )
+                self._conn.executemany(
+                    "INSERT INTO bands (band_hash, chunk_id) VALUES (?, ?)",
+                    [(band, chunk_id) for band in bands]
+                )
+                kept_chunks.append(chunk)
+                kept_ids.append(chunk_id)
+            self._conn.commit()
+        return kept_chunks, kept_ids
+
+    def remove_file(self, source_key: str) -> List[str]:
+        """
+        ファイルの所有チャンクと参照を削除
+
+        Args:
+            source_key: マニフェストのファイルキー
+
+        Returns:
+            削除したチャンクを参照していた他のファイルのキー。これらのファイルは
+            参照先がなくなるため、インデックスし直す必要がある
+        """
+        with self._lock:
+            owned = "SELECT chunk_id FROM chunks WHERE source_key = ?"
+            dependents = [row[0] for row in self._conn.execute(
+                f"SELECT DISTINCT source_key FROM refs WHERE chunk_id IN ({owned}) AND source_key != ?",
+                (source_key, source_key)
+            )]
+            self._conn.execute(f"DELETE FROM refs WHERE chunk_id IN ({owned})", (source_key,))
+            self._conn.execute("DELETE FROM refs WHERE source_key = ?", (source_key,))
+            self._conn.execute(f"DELETE FROM bands WHERE chunk_id IN ({owned})", (source_key,))
+            self._conn.execute("DELETE FROM chunks WHERE source_key = ?", (source_key,))
+            self._conn.commit()
+        return sorted(dependents)
+
+    # ==================== 統計 ====================
+
+    def stats(self) -> Dict:
+        """保存チャンク数と重複参照数、この処理で除外した件数を取得"""
+        with self._lock:
+            stored = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            references = self._conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        return {
+            "stored": stored,
+            "references": references,
+            "checked": self.checked,
+            "exact_duplicates": self.exact_duplicates,
+            "near_duplicates": self.near_duplicates,
+        }
+
+
+def lookup_references(chunk_ids: List[str], path: str = DEDUP_INDEX_PATH) -> Dict[str, List[Dict]]:
+    """
+    保存チャンクと同じ内容を持つ他のファイル・ページを取得（検索結果の表示用）
+
+    Args:
+        chunk_ids: 保存チャンクのID
+        path: 重複排除インデックスの保存先
+
+    Returns:
+        チャンクIDごとの参照（source, page, similarity）のリスト
+    """
+    chunk_ids = [i for i in chunk_ids if i]
+    if not chunk_ids or not os.path.exists(path):
+        return {}
+    conn = sqlite3.connect(path)
+    try:
+        placeholders = ",".join("?" * len(chunk_ids))
+        rows = conn.execute(
+            f"SELECT chunk_id, source, page, similarity FROM refs WHERE chunk_id IN ({placeholders})"
+            f" ORDER BY source, page",
+            chunk_ids
+        ).fetchall()
+    except sqlite3.Error as e:
+        print(f"重複参照の取得エラー: {e}")
+        return {}
+    finally:
+        conn.close()
+
+    references: Dict[str, List[Dict]] = {}
+    for chunk_id, source, page, similarity in rows:
+        references.setdefault(chunk_id, []).append({"source": source, "page": page, "similarity": similarity})
+    return references
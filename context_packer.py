@@ -0,0 +1,160 @@
+"""
+LLMに渡す参照情報の組み立て（重なったチャンクの結合とトークン数の上限）
+"""
+import os
+from typing import List, Dict, Optional
+
+# 定数定義
+# 参照情報全体のトークン数の上限
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+# トークン数を数えるモデル（回答生成に使うモデルに合わせる）
+CONTEXT_TOKEN_MODEL = "gpt-4o-mini"
+# 位置の間がこの文字数以下のチャンクは隣接とみなして結合する（チャンク分割で除かれた空白・改行）
+MERGE_GAP_CHARS = 2
+# 参照情報の区切り（"\n\n"）のトークン数の見積もり
+_SEPARATOR_TOKENS = 1
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        from embedding_scheduler import get_encoding
+        _encoding = get_encoding(CONTEXT_TOKEN_MODEL)
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """テキストのトークン数（tiktoken）"""
+    return len(_get_encoding().encode(text, disallowed_special=()))
+
+
+def format_part(part: Dict) -> str:
+    """参照情報1件分のテキスト（[ファイル名 (page N)] + 本文）"""
+    page = part["page"]
+    page_info = f" (page {page})" if page is not None else ""
+    return f"[{part['filename']}{page_info}]\n{part['chunk']}"
+
+
+def _span(result: Dict):
+    """ページ内の位置（start_index, end_index）。ない場合はNone"""
+    start, end = result.get("start_index"), result.get("end_index")
+    if isinstance(start, int) and isinstance(end, int):
+        return start, end
+    return None
+
+
+def _merge_text(part: Dict, start: int, end: int, chunk: str):
+    """同じページのチャンクを位置に従って結合（重なりの部分は1回だけ含める）"""
+    if start < part["start_index"]:
+        # 前側に結合する場合は入れ替えて、後ろ側に結合する場合と同じ処理にする
+        first = {"start_index": start, "end_index": end, "chunk": chunk}
+        start, end, chunk = part["start_index"], part["end_index"], part["chunk"]
+    else:
+        first = part
+    if end <= first["end_index"]:
+        # 完全に含まれている
+        merged = first["chunk"]
+    elif start <= first["end_index"]:
+        merged = first["chunk"] + chunk[first["end_index"] - start:]
+    else:
+        # 隣接（間の空白はチャンク分割で除かれている）
+        merged = first["chunk"] + "\n" + chunk
+    return min(first["start_index"], start), max(first["end_index"], end), merged
+
+
+def _find_mergeable(parts: List[Dict], source, page, span) -> Optional[Dict]:
+    """同じファイル・ページで、位置が重なるか隣接する参照情報を探す"""
+    if span is None:
+        return None
+    start, end = span
+    for part in parts:
+        if (part["start_index"] is not None and part["source"] == source and part["page"] == page
+                and start <= part["end_index"] + MERGE_GAP_CHARS
+                and part["start_index"] <= end + MERGE_GAP_CHARS):
+            return part
+    return None
+
+
+def _merge(part: Dict, start: int, end: int, chunk: str, indexes: List) -> Dict:
+    """参照情報にチャンクを結合した新しい参照情報（トークン数も数え直す）"""
+    start, end, chunk = _merge_text(part, start, end, chunk)
+    merged = dict(part, start_index=start, end_index=end, chunk=chunk, indexes=part["indexes"] + indexes)
+    merged["tokens"] = count_tokens(format_part(merged))
+    return merged
+
+
+def pack_context(results: List[Dict], budget: int = CONTEXT_TOKEN_BUDGET) -> List[Dict]:
+    """
+    検索結果を、トークン数の上限内に収まる参照情報に詰める
+
+    検索結果の順位（スコアの高い順）に見ていき、同じファイル・ページで位置が重なる
+    または隣接するチャンクは1つに結合する（チャンクの重なりの部分を重複して送らない）。
+    上限を超える検索結果は飛ばし、後ろの順位で収まるものがあれば入れる。
+
+    Args:
+        results: RAGSystem.search()の検索結果（順位順）
+        budget: 参照情報全体のトークン数の上限
+
+    Returns:
+        参照情報のリスト（filename, page, chunk, indexes（結合した検索結果の番号）、
+        tokensを持つ、順位順）
+    """
+    parts = []
+    used = 0
+    for result in results:
+        span = _span(result)
+        part = _find_mergeable(parts, result.get("source"), result.get("page"), span)
+        if part is not None:
+            candidate = _merge(part, span[0], span[1], result["chunk"], [result.get("index")])
+            cost = candidate["tokens"] - part["tokens"]
+        else:
+            candidate = {
+                "filename": result["filename"],
+                "page": result["page"],
+                "source": result.get("source"),
+                "chunk": result["chunk"],
+                "start_index": span[0] if span else None,
+                "end_index": span[1] if span else None,
+                "indexes": [result.get("index")],
+            }
+            candidate["tokens"] = count_tokens(format_part(candidate))
+            cost = candidate["tokens"] + (_SEPARATOR_TOKENS if parts else 0)
+
+        if used + cost > budget:
+            if parts:
+                continue
+            # 最上位の検索結果だけで上限を超える場合は、本文を切り詰めて入れる
+            encoding = _get_encoding()
+            header_tokens = count_tokens(format_part(dict(candidate, chunk="")))
+            tokens = encoding.encode(candidate["chunk"], disallowed_special=())
+            candidate["chunk"] = encoding.decode(tokens[:max(0, budget - header_tokens)])
+            candidate["start_index"] = candidate["end_index"] = None
+            candidate["tokens"] = cost = count_tokens(format_part(candidate))
+
+        if part is None:
+            parts.append(candidate)
+            used += cost
+            continue
+
+        # 結合で広がった範囲が別の参照情報とつながった場合は、それも1つにまとめる
+        parts[parts.index(part)] = candidate
+        used += cost
+        while True:
+            others = [p for p in parts if p is not candidate]
+            other = _find_mergeable(others, candidate["source"], candidate["page"],
+                                    (candidate["start_index"], candidate["end_index"]))
+            if other is None:
+                break
+            merged = _merge(candidate, other["start_index"], other["end_index"], other["chunk"], other["indexes"])
+            used += merged["tokens"] - candidate["tokens"] - other["tokens"] - _SEPARATOR_TOKENS
+            parts[parts.index(candidate)] = merged
+            parts.remove(other)
+            candidate = merged
+    return parts
+
+
+def build_context(results: List[Dict], budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """検索結果からLLMに渡す参照情報のテキストを作成"""
+    return "\n\n".join(format_part(part) for part in pack_context(results, budget))
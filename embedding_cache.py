@@ -0,0 +1,461 @@
+"""
+Embeddingの永続キャッシュ（SQLiteインデックス＋メモリマップしたfloat32ファイル）
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Optional, Dict, Tuple
+
+import numpy as np
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError:
+    from langchain.embeddings.base import Embeddings
+
+# 定数定義
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EMBEDDING_CACHE_DIR = os.path.join(BASE_DIR, ".embedding_cache")
+# キャッシュの最大サイズ（ベクトルファイルのバイト数、MB単位）
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+# 上限を超えた場合、この割合まで古いエントリを削除する
+EVICTION_TARGET_RATIO = 0.8
+# SQLiteのプレースホルダ数の上限対策
+_SQL_BATCH_SIZE = 500
+# 他プロセスの書き込み（追記・整理）が終わるのを待つ最大秒数
+WRITE_LOCK_TIMEOUT = 60.0
+# クエリEmbeddingのメモリキャッシュの最大件数と有効期間（秒）
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+
+
+def text_hash(text: str) -> str:
+    """チャンクテキストのSHA-256ハッシュを計算"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def normalize_query(text: str) -> str:
+    """クエリを正規化（NFKC・前後の空白の除去・連続する空白を1つに）"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+class QueryEmbeddingCache:
+    """
+    クエリEmbeddingのプロセス内LRUキャッシュ（有効期限つき、スレッドセーフ）
+
+    Streamlitの全セッションで共有し、同じ質問ではEmbedding APIを呼ばずにベクトルを返す。
+    クエリのEmbeddingはこのキャッシュにだけ保存する（ディスクのキャッシュはチャンク用）。
+    """
+
+    def __init__(self, max_entries: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL):
+        """
+        初期化
+
+        Args:
+            max_entries: 保持する最大件数
+            ttl: エントリの有効期間（秒）
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, List[float]]]" = OrderedDict()
+
+    def get(self, model: str, query: str) -> Optional[List[float]]:
+        """
+        正規化済みクエリのEmbeddingを取得
+
+        Args:
+            model: Embeddingモデル名
+            query: normalize_query()で正規化したクエリ
+
+        Returns:
+            Embedding（ないか期限切れの場合はNone）
+        """
+        key = (model, query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, model: str, query: str, vector: List[float]):
+        """正規化済みクエリのEmbeddingを保存（上限を超えたら最も長く使われていないものを削除）"""
+        key = (model, query)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        """ヒット数・ミス数・ヒット率・保持件数を取得"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+            }
+
+
+class EmbeddingCache:
+    """
+    (モデル名, テキストハッシュ) をキーにしたEmbeddingのディスクキャッシュ
+
+    ベクトルは追記専用のfloat32ファイルに連続して保存し、memmapで読み出す。
+    オフセットと最終利用時刻はSQLiteで管理し、サイズ上限を超えたら
+    最近使われていないエントリから削除してファイルを詰め直す。
+    追記と詰め直しはSQLiteの書き込みロック（BEGIN IMMEDIATE）の中で行うため、
+    インデックス処理とStreamlitなど複数のプロセスで同じディレクトリを共有できる。
+    """
+
+    def __init__(self, cache_dir: str = EMBEDDING_CACHE_DIR, max_bytes: int = EMBEDDING_CACHE_MAX_MB * 1024 * 1024):
+        """
+        初期化
+
+        Args:
+            cache_dir: キャッシュの保存ディレクトリ
+            max_bytes: ベクトルファイルの最大バイト数
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._mmap = None
+        self._mmap_path = None
+        self._mmap_size = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), timeout=WRITE_LOCK_TIMEOUT,
+                                     check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, text_hash TEXT NOT NULL,"
+            " offset INTEGER NOT NULL, dim INTEGER NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', '0')")
+        self._conn.commit()
+
+    # ==================== ファイル管理 ====================
+
+    def _generation(self) -> int:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return int(row[0])
+
+    def _blob_path(self, generation: Optional[int] = None) -> str:
+        if generation is None:
+            generation = self._generation()
+        return os.path.join(self.cache_dir, f"vectors-{generation}.f32")
+
+    def _blob_size(self) -> int:
+        path = self._blob_path()
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _get_mmap(self):
+        """ベクトルファイルのmemmapを取得（ファイルが伸びたか、他プロセスが詰め直していれば開き直す）"""
+        path = self._blob_path()
+        try:
+            size = os.path.getsize(path)
+            if size == 0:
+                return None
+            if self._mmap is None or self._mmap_path != path or self._mmap_size != size:
+                self._mmap = np.memmap(path, dtype=np.float32, mode="r")
+                self._mmap_path = path
+                self._mmap_size = size
+        except FileNotFoundError:
+            # 詰め直しで削除された古い世代のファイル（キャッシュにないものとして扱う）
+            return None
+        return self._mmap
+
+    @contextmanager
+    def _write_transaction(self):
+        """
+        他プロセスと排他する書き込みトランザクション（self._lockを取得済みであること）
+
+        BEGIN IMMEDIATEでSQLiteの書き込みロックを先に取るため、ファイルの末尾（追記位置）の
+        確認から追記・オフセットの登録までの間に、他プロセスが同じ位置へ書き込むことはない。
+        """
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.rollback()
+            raise
+        self._conn.commit()
+
+    # ==================== 読み書き ====================
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        キャッシュからEmbeddingをまとめて取得
+
+        Args:
+            model: Embeddingモデル名
+            texts: テキストのリスト
+
+        Returns:
+            Embeddingのリスト（キャッシュにないものはNone）
+        """
+        hashes = [text_hash(t) for t in texts]
+        found: Dict[str, tuple] = {}
+
+        with self._lock:
+            # オフセットと世代（開くベクトルファイル）は同じ時点のものを読む
+            # （他プロセスが詰め直しても、古いファイルに新しいオフセットを当てない）
+            self._conn.execute("BEGIN")
+            try:
+                unique = list(dict.fromkeys(hashes))
+                for start in range(0, len(unique), _SQL_BATCH_SIZE):
+                    batch = unique[start:start + _SQL_BATCH_SIZE]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = self._conn.execute(
+                        "SELECT text_hash, offset, dim FROM embeddings"
+                        f" WHERE model = ? AND text_hash IN ({placeholders})",
+                        [model, *batch]
+                    ).fetchall()
+                    for h, offset, dim in rows:
+                        found[h] = (offset, dim)
+                mm = self._get_mmap() if found else None
+            finally:
+                self._conn.commit()
+
+            results = []
+            used = []
+            for h in hashes:
+                entry = found.get(h)
+                vector = None
+                if entry is not None and mm is not None:
+                    offset, dim = entry
+                    start = offset // 4
+                    if start + dim <= mm.shape[0]:
+                        vector = mm[start:start + dim].tolist()
+                        used.append(h)
+                if vector is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                results.append(vector)
+
+            if used:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in dict.fromkeys(used)]
+                )
+                self._conn.commit()
+
+        return results
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        """
+        Embeddingをキャッシュに保存
+
+        Args:
+            model: Embeddingモデル名
+            texts: テキストのリスト
+            vectors: textsに対応するEmbeddingのリスト
+        """
+        if not texts:
+            return
+
+        with self._lock:
+            with self._write_transaction():
+                path = self._blob_path()
+                offset = self._blob_size()
+                rows = []
+                now = time.time()
+                with open(path, "ab") as f:
+                    for text, vector in zip(texts, vectors):
+                        data = np.asarray(vector, dtype=np.float32)
+                        f.write(data.tobytes())
+                        rows.append((model, text_hash(text), offset, int(data.shape[0]), now))
+                        offset += data.nbytes
+
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (model, text_hash, offset, dim, last_used)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+
+            if offset > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """最近使われていないエントリを削除し、ベクトルファイルを詰め直す"""
+        with self._write_transaction():
+            if self._blob_size() <= self.max_bytes:
+                # 他プロセスが先に詰め直した
+                return
+            target = int(self.max_bytes * EVICTION_TARGET_RATIO)
+            rows = self._conn.execute(
+                "SELECT model, text_hash, offset, dim FROM embeddings ORDER BY last_used DESC"
+            ).fetchall()
+            mm = self._get_mmap()
+            old_generation = self._generation()
+            new_generation = old_generation + 1
+            new_path = self._blob_path(new_generation)
+
+            kept = []
+            removed = []
+            new_offset = 0
+            with open(new_path, "wb") as f:
+                for model, h, offset, dim in rows:
+                    start = offset // 4
+                    if mm is None or new_offset + dim * 4 > target or start + dim > mm.shape[0]:
+                        removed.append((model, h))
+                        continue
+                    f.write(np.asarray(mm[start:start + dim], dtype=np.float32).tobytes())
+                    kept.append((new_offset, model, h))
+                    new_offset += dim * 4
+
+            # オフセットの更新と世代の切り替えを1トランザクションで行う
+            # （途中で落ちても古いファイルと古いオフセットの組が残る）
+            self._conn.executemany("DELETE FROM embeddings WHERE model = ? AND text_hash = ?", removed)
+            self._conn.executemany("UPDATE embeddings SET offset = ? WHERE model = ? AND text_hash = ?", kept)
+            self._conn.execute("UPDATE meta SET value = ? WHERE key = 'generation'", (str(new_generation),))
+
+        self._mmap = None
+        self._mmap_path = None
+        self._mmap_size = 0
+        try:
+            os.remove(self._blob_path(old_generation))
+        except OSError:
+            pass
+        print(f"Embeddingキャッシュを整理しました: {len(removed)}件削除 / {len(kept)}件保持")
+
+    # ==================== 統計 ====================
+
+    def stats(self) -> Dict:
+        """ヒット数・ミス数・エントリ数・サイズを取得"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": entries,
+                "size_bytes": self._blob_size(),
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """EmbeddingCacheを経由してEmbeddingを計算するラッパー"""
+
+    def __init__(self, underlying: Embeddings, model: str, cache: Optional[EmbeddingCache] = None,
+                 query_cache: Optional[QueryEmbeddingCache] = None):
+        """
+        初期化
+
+        Args:
+            underlying: 実際にEmbeddingを計算するモデル
+            model: キャッシュキーに使うモデル名
+            cache: 使用するキャッシュ（省略時はプロセス共通のキャッシュ）
+            query_cache: クエリ用のメモリキャッシュ（省略時はプロセス共通のキャッシュ）
+        """
+        self.underlying = underlying
+        self.model = model
+        self.cache = cache or get_embedding_cache()
+        self.query_cache = query_cache or get_query_embedding_cache()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """ドキュメントのEmbeddingを取得（キャッシュにないものだけAPIで計算）"""
+        vectors = self.cache.get_many(self.model, texts)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            # 同じテキストは1回だけ計算する
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            computed = self.underlying.embed_documents(unique_texts)
+            self.cache.put_many(self.model, unique_texts, computed)
+            by_text = dict(zip(unique_texts, computed))
+            for i in missing:
+                vectors[i] = by_text[texts[i]]
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        クエリのEmbeddingを取得（メモリキャッシュ → APIの順）
+
+        正規化したクエリはメモリキャッシュのキーにだけ使い、APIには元のテキストを渡す。
+        クエリのベクトルはディスクのキャッシュ（チャンク用）には保存しない。
+        """
+        key = normalize_query(text) or text
+        vector = self.query_cache.get(self.model, key)
+        if vector is None:
+            vector = self.underlying.embed_query(text)
+            self.query_cache.put(self.model, key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """embed_query()の非同期版（キャッシュにない場合だけAPIを非同期で呼ぶ）"""
+        key = normalize_query(text) or text
+        vector = self.query_cache.get(self.model, key)
+        if vector is None:
+            vector = await self.underlying.aembed_query(text)
+            self.query_cache.put(self.model, key, vector)
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        複数のクエリのEmbeddingをまとめて取得（評価などの一括処理用）
+
+        メモリキャッシュにないクエリだけを1回のAPI呼び出しで計算し、メモリキャッシュに
+        保存する（続くembed_query()ではAPIを呼ばない）。
+        """
+        keys = [normalize_query(text) or text for text in texts]
+        vectors = [self.query_cache.get(self.model, key) for key in keys]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            # 正規化すると同じになるクエリは、最初のテキストで1回だけ計算する
+            uncached = {}
+            for i in missing:
+                uncached.setdefault(keys[i], texts[i])
+            computed = dict(zip(uncached, self.underlying.embed_documents(list(uncached.values()))))
+            for key, vector in computed.items():
+                self.query_cache.put(self.model, key, vector)
+            for i in missing:
+                vectors[i] = computed[keys[i]]
+        return vectors
+
+
+# グローバルインスタンス
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Embeddingキャッシュのシングルトンインスタンスを取得"""
+    global _embedding_cache
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+
+_query_embedding_cache = None
+
+
+def get_query_embedding_cache() -> QueryEmbeddingCache:
+    """クエリEmbeddingのメモリキャッシュのシングルトンインスタンスを取得（全セッションで共有）"""
+    global _query_embedding_cache
+    with _embedding_cache_lock:
+        if _query_embedding_cache is None:
+            _query_embedding_cache = QueryEmbeddingCache()
+    return _query_embedding_cache
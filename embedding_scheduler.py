@@ -0,0 +1,348 @@
+"""
+トークン数でバッチを組み、レート制限に合わせて並列にEmbeddingを計算するスケジューラ
+"""
+import os
+import time
+import random
+import threading
+from typing import List, Dict, Optional, Callable
+from concurrent.futures import ThreadPoolExecutor
+
+import tiktoken
+import openai
+from openai import OpenAI
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError:
+    from langchain.embeddings.base import Embeddings
+
+# 定数定義
+# 同時に投げるリクエスト数の上限
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+# 1リクエストあたりのトークン数の上限（APIの上限は300kトークン）
+EMBED_MAX_BATCH_TOKENS = int(os.getenv("EMBED_MAX_BATCH_TOKENS", "20000"))
+# 1リクエストあたりの入力数の上限（APIの上限）
+EMBED_MAX_BATCH_INPUTS = 2048
+# 1入力あたりのトークン数の上限（超える分は切り詰める）
+EMBED_MAX_INPUT_TOKENS = 8191
+# 1分あたりのトークン数の上限（TPM）
+EMBED_TPM_LIMIT = int(os.getenv("EMBED_TPM_LIMIT", "1000000"))
+# 429などの一時的なエラーの最大リトライ回数
+EMBED_MAX_RETRIES = 8
+# バックオフの基準秒数と上限秒数
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+# リトライ対象の一時的なエラー
+_RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+def _is_quota_exhausted(error: Exception) -> bool:
+    """429のうち、利用枠（クレジット・請求上限）の不足によるもの（待っても解消しないためリトライしない）"""
+    return isinstance(error, openai.RateLimitError) and "insufficient_quota" in (
+        getattr(error, "code", None), getattr(error, "type", None)
+    )
+
+
+def get_encoding(model: str):
+    """モデルに対応するtiktokenのエンコーディングを取得"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def pack_batches(token_counts: List[int], max_tokens: int = EMBED_MAX_BATCH_TOKENS,
+                 max_inputs: int = EMBED_MAX_BATCH_INPUTS) -> List[List[int]]:
+    """
+    入力を先頭から順にトークン数の上限に収まるバッチへ詰める
+
+    Args:
+        token_counts: 入力ごとのトークン数
+        max_tokens: 1バッチあたりのトークン数の上限
+        max_inputs: 1バッチあたりの入力数の上限
+
+    Returns:
+        バッチごとの入力インデックスのリスト
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for i, count in enumerate(token_counts):
+        if current and (current_tokens + count > max_tokens or len(current) >= max_inputs):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += count
+    if current:
+        batches.append(current)
+    return batches
+
+
+class _TokenBucket:
+    """1分あたりのトークン数を制限するトークンバケット"""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60.0
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        """tokens分の枠が空くまで待つ（容量を超える要求は満杯になった時点で通す）"""
+        tokens = min(float(tokens), self.capacity)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.available >= tokens:
+                    self.available -= tokens
+                    return
+                wait = (tokens - self.available) / self.rate
+            time.sleep(min(wait, 1.0))
+
+
+class EmbeddingScheduler(Embeddings):
+    """
+    バッチ化・並列化・レート制限対応のEmbedding計算
+
+    入力をtiktokenで数えたトークン数の上限ごとにバッチへ詰め、スレッドで
+    複数バッチを同時にリクエストする。429を受けたら同時実行数を半分に下げて
+    全体で待機し、成功が続いたら1ずつ戻す（AIMD）。利用枠の不足による429
+    （insufficient_quota）はリトライせずにそのまま送出する。
+    OPENAI_BASE_URL または base_url を指定すればローカルの偽サーバーでも動作する。
+    """
+
+    def __init__(
+        self,
+        model: str,
+        client: Optional[OpenAI] = None,
+        base_url: Optional[str] = None,
+        max_concurrency: int = EMBED_CONCURRENCY,
+        max_batch_tokens: int = EMBED_MAX_BATCH_TOKENS,
+        tpm_limit: int = EMBED_TPM_LIMIT,
+        progress_callback: Optional[Callable[[Dict], None]] = None,
+    ):
+        """
+        初期化
+
+        Args:
+            model: Embeddingモデル名
+            client: OpenAIクライアント（省略時は初回リクエスト時に作成）
+            base_url: APIのベースURL（省略時は環境変数またはOpenAIの既定値）
+            max_concurrency: 同時リクエスト数の上限
+            max_batch_tokens: 1リクエストあたりのトークン数の上限
+            tpm_limit: 1分あたりのトークン数の上限
+            progress_callback: バッチ完了ごとに進捗（progress()の戻り値）を受け取る関数
+        """
+        self.model = model
+        self.base_url = base_url
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_batch_tokens = max_batch_tokens
+        self.progress_callback = progress_callback
+
+        self._client = client
+        self._encoding = None
+        self._bucket = _TokenBucket(tpm_limit)
+        self._executor = None
+
+        # 同時実行数の制御
+        self._cond = threading.Condition()
+        self._limit = self.max_concurrency
+        self._in_flight = 0
+        self._success_streak = 0
+        self._cooldown_until = 0.0
+
+        # 進捗
+        self._stats_lock = threading.Lock()
+        self._chunks = 0
+        self._tokens = 0
+        self._requests = 0
+        self._retries = 0
+        self._rate_limited = 0
+        self._busy_seconds = 0.0
+
+    # ==================== 公開API ====================
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """ドキュメントのEmbeddingを取得（入力と同じ順序）"""
+        if not texts:
+            return []
+
+        started = time.perf_counter()
+        inputs, token_counts = self._prepare(texts)
+        batches = pack_batches(token_counts, self.max_batch_tokens)
+
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        if len(batches) == 1:
+            self._run_batch(batches[0], inputs, token_counts, results)
+        else:
+            executor = self._get_executor()
+            futures = [
+                executor.submit(self._run_batch, batch, inputs, token_counts, results)
+                for batch in batches
+            ]
+            for future in futures:
+                future.result()
+
+        with self._stats_lock:
+            self._busy_seconds += time.perf_counter() - started
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        """クエリのEmbeddingを取得"""
+        return self.embed_documents([text])[0]
+
+    def progress(self) -> Dict:
+        """
+        これまでの処理量とスループットを取得
+
+        Returns:
+            chunks, tokens, requests, retries, rate_limited, concurrency,
+            elapsed, chunks_per_sec, tokens_per_sec を持つ辞書
+        """
+        with self._stats_lock:
+            elapsed = self._busy_seconds
+            return {
+                "chunks": self._chunks,
+                "tokens": self._tokens,
+                "requests": self._requests,
+                "retries": self._retries,
+                "rate_limited": self._rate_limited,
+                "concurrency": self._limit,
+                "elapsed": elapsed,
+                "chunks_per_sec": self._chunks / elapsed if elapsed else 0.0,
+                "tokens_per_sec": self._tokens / elapsed if elapsed else 0.0,
+            }
+
+    # ==================== 内部処理 ====================
+
+    def _get_client(self) -> OpenAI:
+        if self._client is None:
+            # リトライはスケジューラ側で行うため、SDKのリトライは無効にする
+            self._client = OpenAI(base_url=self.base_url, max_retries=0)
+        return self._client
+
+    def _get_encoding(self):
+        # エンコーディングの読み込みは重いため、最初に必要になった時点で行う
+        if self._encoding is None:
+            self._encoding = get_encoding(self.model)
+        return self._encoding
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency,
+                thread_name_prefix="embedding"
+            )
+        return self._executor
+
+    def _prepare(self, texts: List[str]):
+        """トークン数を数え、上限を超える入力を切り詰める"""
+        encoding = self._get_encoding()
+        inputs = []
+        token_counts = []
+        for text in texts:
+            # 空文字列はAPIでエラーになるため空白に置き換える
+            text = text or " "
+            tokens = encoding.encode(text, disallowed_special=())
+            if len(tokens) > EMBED_MAX_INPUT_TOKENS:
+                tokens = tokens[:EMBED_MAX_INPUT_TOKENS]
+                text = encoding.decode(tokens)
+            inputs.append(text)
+            token_counts.append(len(tokens))
+        return inputs, token_counts
+
+    def _acquire_slot(self):
+        """同時実行数の枠と、429後の待機時間が空くまで待つ"""
+        with self._cond:
+            while True:
+                wait = self._cooldown_until - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+                if self._in_flight < self._limit:
+                    self._in_flight += 1
+                    return
+                self._cond.wait()
+
+    def _release_slot(self, succeeded: bool, rate_limited: bool = False, delay: float = 0.0):
+        with self._cond:
+            self._in_flight -= 1
+            if rate_limited:
+                # 乗算的に減らし、全ワーカーをまとめて待たせる
+                self._limit = max(1, self._limit // 2)
+                self._success_streak = 0
+                self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+            elif succeeded:
+                # 成功が続いたら加算的に戻す
+                self._success_streak += 1
+                if self._limit < self.max_concurrency and self._success_streak >= self._limit:
+                    self._limit += 1
+                    self._success_streak = 0
+            self._cond.notify_all()
+
+    def _backoff_delay(self, attempt: int, error: Exception) -> float:
+        """Retry-Afterヘッダー、なければ指数バックオフ＋ジッターで待機秒数を決める"""
+        response = getattr(error, "response", None)
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after:
+                try:
+                    return min(float(retry_after), BACKOFF_MAX_SECONDS)
+                except ValueError:
+                    pass
+        delay = BACKOFF_BASE_SECONDS * (2 ** attempt)
+        return min(delay, BACKOFF_MAX_SECONDS) * random.uniform(0.5, 1.0)
+
+    def _run_batch(self, indices: List[int], inputs: List[str], token_counts: List[int],
+                   results: List[Optional[List[float]]]):
+        """1バッチ分をリクエストし、結果をresultsの該当位置に書き込む"""
+        batch_inputs = [inputs[i] for i in indices]
+        batch_tokens = sum(token_counts[i] for i in indices)
+
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            self._bucket.acquire(batch_tokens)
+            self._acquire_slot()
+            try:
+                response = self._get_client().embeddings.create(model=self.model, input=batch_inputs)
+            except _RETRYABLE_ERRORS as e:
+                if _is_quota_exhausted(e):
+                    self._release_slot(False)
+                    raise
+                rate_limited = isinstance(e, openai.RateLimitError)
+                delay = self._backoff_delay(attempt, e)
+                self._release_slot(False, rate_limited, delay)
+                with self._stats_lock:
+                    self._retries += 1
+                    if rate_limited:
+                        self._rate_limited += 1
+                if attempt == EMBED_MAX_RETRIES:
+                    raise
+                print(f"⚠️ Embedding APIエラーのため {delay:.1f}秒後に再試行します: {e}")
+                if not rate_limited:
+                    time.sleep(delay)
+                continue
+            except Exception:
+                self._release_slot(False)
+                raise
+
+            self._release_slot(True)
+            for item in response.data:
+                results[indices[item.index]] = item.embedding
+            break
+
+        with self._stats_lock:
+            self._chunks += len(indices)
+            self._tokens += batch_tokens
+            self._requests += 1
+        if self.progress_callback:
+            self.progress_callback(self.progress())
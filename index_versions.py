@@ -0,0 +1,230 @@
+"""
+ローカルのベクトルストア（Chroma DB / NumPy）のバージョン管理（ブルー/グリーン切り替えと不要バージョンの削除）
+
+chroma_db/
+├ CURRENT              # 現在のバージョンID（アトミックに置き換える）
+├ versions/<id>/       # バージョンごとのChroma DB
+└ leases/<id>.<pid>    # そのバージョンを読んでいるプロセスの印
+"""
+import os
+import stat
+import time
+import uuid
+import shutil
+import datetime
+import threading
+from typing import Dict, Optional, Tuple
+
+CURRENT_FILENAME = "CURRENT"
+VERSIONS_DIRNAME = "versions"
+LEASES_DIRNAME = "leases"
+# バージョン管理導入前にルート直下に作られたChroma DBのバージョンID
+LEGACY_VERSION = "legacy"
+
+# プロセス内の参照カウント（バージョンIDごと）
+_refcounts: Dict[Tuple[str, str], int] = {}
+_refcounts_lock = threading.Lock()
+
+
+def _versions_dir(root: str) -> str:
+    return os.path.join(root, VERSIONS_DIRNAME)
+
+
+def _leases_dir(root: str) -> str:
+    return os.path.join(root, LEASES_DIRNAME)
+
+
+def _has_legacy_files(root: str) -> bool:
+    """ルート直下にバージョン管理外のChroma DBファイルがあるか"""
+    if not os.path.isdir(root):
+        return False
+    managed = {CURRENT_FILENAME, VERSIONS_DIRNAME, LEASES_DIRNAME}
+    return any(name not in managed and not name.startswith(".") for name in os.listdir(root))
+
+
+def get_current_version(root: str) -> Optional[str]:
+    """
+    現在のバージョンIDを取得
+
+    Args:
+        root: Chroma DBのルートディレクトリ
+
+    Returns:
+        バージョンID（CURRENTがなくルート直下に旧形式のDBがあれば "legacy"、何もなければNone）
+    """
+    try:
+        with open(os.path.join(root, CURRENT_FILENAME), "r", encoding="utf-8") as f:
+            version = f.read().strip()
+            if version:
+                return version
+    except FileNotFoundError:
+        pass
+    return LEGACY_VERSION if _has_legacy_files(root) else None
+
+
+def version_path(root: str, version: str) -> str:
+    """バージョンIDに対応するChroma DBのディレクトリ"""
+    if version == LEGACY_VERSION:
+        return root
+    return os.path.join(_versions_dir(root), version)
+
+
+def create_version(root: str) -> Tuple[str, str]:
+    """
+    新しいバージョンのディレクトリを作成（まだ公開しない）
+
+    Args:
+        root: Chroma DBのルートディレクトリ
+
+    Returns:
+        (バージョンID, ディレクトリ)のタプル
+    """
+    version = f"{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    path = version_path(root, version)
+    os.makedirs(path, mode=0o777, exist_ok=True)
+    # 確実に書き込み権限を付与
+    os.chmod(path, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
+    return version, path
+
+
+def publish_version(root: str, version: str):
+    """
+    CURRENTを新しいバージョンに切り替え（一時ファイルに書いてから置き換え）
+
+    置き換え後、どの読み手も使っていない古いバージョンを削除する。
+    """
+    temp_path = os.path.join(root, f".{CURRENT_FILENAME}.{os.getpid()}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, os.path.join(root, CURRENT_FILENAME))
+    print(f"ベクトルストアのバージョンを切り替えました: {version}")
+    collect_garbage(root)
+
+
+def discard_version(root: str, version: str):
+    """公開前に失敗したバージョンを削除"""
+    remove_directory(version_path(root, version))
+
+
+# ==================== 読み手の管理 ====================
+
+def _lease_path(root: str, version: str) -> str:
+    return os.path.join(_leases_dir(root), f"{version}.{os.getpid()}")
+
+
+def acquire(root: str, version: str):
+    """
+    バージョンの参照を取得（参照中のバージョンは削除されない）
+
+    同一プロセス内は参照カウント、他プロセスに対してはリースファイルで示す。
+    """
+    key = (root, version)
+    with _refcounts_lock:
+        count = _refcounts.get(key, 0)
+        if count == 0:
+            os.makedirs(_leases_dir(root), exist_ok=True)
+            open(_lease_path(root, version), "w").close()
+        _refcounts[key] = count + 1
+
+
+def release(root: str, version: str):
+    """バージョンの参照を解放し、不要になったバージョンを削除"""
+    key = (root, version)
+    with _refcounts_lock:
+        count = _refcounts.get(key, 0) - 1
+        if count > 0:
+            _refcounts[key] = count
+            return
+        _refcounts.pop(key, None)
+        try:
+            os.remove(_lease_path(root, version))
+        except OSError:
+            pass
+    collect_garbage(root)
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _is_leased(root: str, version: str) -> bool:
+    """いずれかの生きているプロセスがバージョンを参照しているか"""
+    with _refcounts_lock:
+        if _refcounts.get((root, version), 0) > 0:
+            return True
+    leases_dir = _leases_dir(root)
+    if not os.path.isdir(leases_dir):
+        return False
+    for name in os.listdir(leases_dir):
+        lease_version, _, pid = name.rpartition(".")
+        if lease_version != version or not pid.isdigit():
+            continue
+        if _pid_alive(int(pid)):
+            return True
+        # 終了したプロセスのリースは掃除する
+        try:
+            os.remove(os.path.join(leases_dir, name))
+        except OSError:
+            pass
+    return False
+
+
+def collect_garbage(root: str):
+    """現在のバージョン以外で、どの読み手も参照していないバージョンを削除"""
+    current = get_current_version(root)
+    if current is None or current == LEGACY_VERSION:
+        return
+
+    versions_dir = _versions_dir(root)
+    candidates = os.listdir(versions_dir) if os.path.isdir(versions_dir) else []
+    for version in candidates:
+        if version == current or _is_leased(root, version):
+            continue
+        try:
+            remove_directory(version_path(root, version))
+            print(f"古いベクトルストアのバージョンを削除しました: {version}")
+        except Exception as e:
+            print(f"警告: 古いバージョンの削除に失敗しました: {version} - {e}")
+
+    # バージョン管理導入前のルート直下のDBも、参照がなければ削除
+    if _has_legacy_files(root) and not _is_leased(root, LEGACY_VERSION):
+        managed = {CURRENT_FILENAME, VERSIONS_DIRNAME, LEASES_DIRNAME}
+        for name in os.listdir(root):
+            if name in managed or name.startswith("."):
+                continue
+            path = os.path.join(root, name)
+            try:
+                if os.path.isdir(path):
+                    remove_directory(path)
+                else:
+                    os.remove(path)
+            except Exception as e:
+                print(f"警告: 旧形式のChroma DBの削除に失敗しました: {name} - {e}")
+
+
+def remove_directory(path: str, max_retries: int = 3):
+    """ディレクトリを削除（確実に削除するため、権限を付与してから複数回試行）"""
+    if not os.path.exists(path):
+        return
+    for retry in range(max_retries):
+        try:
+            # ディレクトリ内のファイルの権限を変更してから削除
+            for dirpath, dirs, files in os.walk(path):
+                for d in dirs:
+                    os.chmod(os.path.join(dirpath, d), stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
+                for f in files:
+                    os.chmod(os.path.join(dirpath, f), stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH | stat.S_IWOTH)
+            shutil.rmtree(path)
+            return
+        except Exception:
+            if retry == max_retries - 1:
+                raise
+            time.sleep(0.5)  # 少し待ってから再試行
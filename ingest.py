@@ -2,10 +2,20 @@
 ファイルのインデックス処理（Chroma DBへの保存）
 """
 import os
+import json
+import stat
+import time
+import uuid
 import shutil
+import hashlib
 import datetime
+import threading
+import multiprocessing
 from pathlib import Path
-from typing import List
+from typing import List, Dict, Optional, Tuple, Iterator, Callable
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,10 +23,6 @@ try:
     from langchain_community.document_loaders import PyPDFLoader, TextLoader
 except ImportError:
     from langchain.document_loaders import PyPDFLoader, TextLoader
-try:
-    from langchain_text_splitters import RecursiveCharacterTextSplitter
-except ImportError:
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
 try:
     from langchain_postgres import PGVector
 except ImportError:
@@ -25,15 +31,20 @@ try:
     from langchain_community.vectorstores import Chroma
 except ImportError:
     from langchain.vectorstores import Chroma
-try:
-    from langchain_openai import OpenAIEmbeddings
-except ImportError:
-    # フォールバック: langchain_communityを使用
-    from langchain_community.embeddings import OpenAIEmbeddings
 try:
     from langchain_core.documents import Document
 except ImportError:
     from langchain.schema import Document
+from embedding_cache import CachedEmbeddings, get_embedding_cache
+from embedding_scheduler import EmbeddingScheduler
+from ingest_pipeline import run_pipeline
+from text_chunker import TextChunker
+from parse_cache import get_parse_cache, parser_version, PARSE_CACHE_ENABLED
+from chunk_dedup import ChunkDeduplicator, DEDUP_ENABLED, DEDUP_THRESHOLD, DEDUP_INDEX_PATH
+from numpy_vectorstore import NumpyVectorStore, NUMPY_DB_PATH
+from lexical_index import LexicalIndex, LEXICAL_INDEX_ENABLED, LEXICAL_INDEX_PATH
+from pg_engine import get_engine
+import index_versions
 
 # 定数定義
 # 絶対パスを使用して確実に動作するようにする
@@ -43,76 +54,277 @@ CHROMA_DB_PATH = os.path.join(BASE_DIR, "chroma_db")
 EMBEDDING_MODEL = "text-embedding-3-small"
 CHUNK_SIZE = 800
 CHUNK_OVERLAP = 120
+# CHUNK_SIZE/CHUNK_OVERLAPの単位（"chars": 文字数、"tokens": tiktokenのトークン数）
+CHUNK_UNIT = os.getenv("CHUNK_UNIT", "chars")
 COLLECTION_NAME = "rag_documents"
+# 差分インデックス用マニフェスト（ファイルごとのハッシュとチャンクID）
+MANIFEST_PATH = os.path.join(BASE_DIR, ".index_manifest.json")
+MANIFEST_VERSION = 1
+# ファイル読み込み・PDF解析の並列プロセス数（0の場合はCPUコア数）
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0"))
+# 並列読み込みのプロセスの起動方法（Streamlitサーバーなどマルチスレッドのプロセスからforkすると、
+# 他のスレッドが保持していたロックを子プロセスが引き継いでデッドロックし得るため、spawnを使う）
+INGEST_START_METHOD = "spawn"
+# 処理時間レポートに表示する件数
+TIMING_REPORT_TOP_N = 5
+# Embedding計算・書き込みを行う1バッチあたりのチャンク数
+# （さらにEmbeddingScheduler側でトークン数ごとのリクエストに分けて並列実行する）
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
 
 # サポートするファイル拡張子
 SUPPORTED_EXTENSIONS = {".pdf", ".txt", ".md"}
 
+# ベクトルストアの選択（"auto": Supabase優先・フォールバックでChroma DB、"chroma"、"numpy"）
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "auto")
+# ローカルに保存する場合のバックエンド
+LOCAL_BACKEND = "numpy" if VECTOR_BACKEND == "numpy" else "chroma"
+
 # データベース設定（Supabase優先、フォールバックでChroma DB）
-USE_SUPABASE = bool(os.getenv("DATABASE_URL"))
+USE_SUPABASE = bool(os.getenv("DATABASE_URL")) and VECTOR_BACKEND == "auto"
+
+# インデックスとマニフェストを更新する処理（ingest / delete_from_index）の排他制御
+INDEX_LOCK = threading.RLock()
+
+
+def iter_supported_files(docs_dir: str) -> List[Path]:
+    """
+    docs/ディレクトリ内のサポート対象ファイルを列挙
+    
+    Args:
+        docs_dir: ドキュメントディレクトリのパス
+        
+    Returns:
+        ファイルパスのリスト（パス順でソート済み）
+    """
+    docs_path = Path(docs_dir)
+    if not docs_path.exists():
+        return []
+    return sorted(
+        file_path for file_path in docs_path.rglob("*")
+        if file_path.is_file() and file_path.suffix.lower() in SUPPORTED_EXTENSIONS
+    )
+
+
+def _parse_file(file_path: Path) -> Tuple[List[Document], bool]:
+    """
+    ローダーでファイルを解析（PDFは解析キャッシュを経由）
+    
+    PDFの抽出結果はファイル内容のハッシュとパーサーのバージョンをキーに
+    キャッシュするため、チャンク設定の変更や再構築ではPDFを解析し直さない。
+    
+    Args:
+        file_path: ファイルパス
+        
+    Returns:
+        (ローダーが返したDocumentのリスト, キャッシュから取得したか)のタプル
+    """
+    suffix = file_path.suffix.lower()
+    if suffix in {".txt", ".md"}:
+        loader = TextLoader(str(file_path), encoding="utf-8")
+        return loader.load(), False
+    if suffix != ".pdf":
+        return [], False
+    
+    if not PARSE_CACHE_ENABLED:
+        return PyPDFLoader(str(file_path)).load(), False
+    
+    cache = get_parse_cache()
+    parser = parser_version("pdf")
+    file_hash = compute_file_hash(file_path)
+    pages = cache.get(file_hash, parser)
+    if pages is not None:
+        return [Document(page_content=text, metadata=metadata) for text, metadata in pages], True
+    
+    docs = PyPDFLoader(str(file_path)).load()
+    cache.put(file_hash, parser, [(doc.page_content, dict(doc.metadata)) for doc in docs])
+    return docs, False
 
 
-def load_documents(docs_dir: str) -> List[Document]:
+def load_file(file_path: Path) -> List[Document]:
+    """
+    1ファイルを読み込んでメタデータを付与
+    
+    Args:
+        file_path: ファイルパス
+        
+    Returns:
+        読み込んだDocumentのリスト（PDFはページごと）
+    """
+    return _load_file(file_path)[0]
+
+
+def _load_file(file_path: Path) -> Tuple[List[Document], bool]:
+    """load_file()の本体（解析キャッシュを使ったかも返す）"""
+    docs, cached = _parse_file(file_path)
+    
+    # 各ドキュメントにメタデータを追加（本格的な構造）
+    indexed_at = datetime.datetime.now()
+    for doc in docs:
+        # 基本メタデータ
+        doc.metadata["source"] = str(file_path)
+        doc.metadata["filename"] = file_path.name
+        doc.metadata["file_type"] = file_path.suffix.lower().replace(".", "")
+        doc.metadata["file_size"] = file_path.stat().st_size
+        
+        # PDFの場合はページ番号を追加
+        if file_path.suffix.lower() == ".pdf" and "page" in doc.metadata:
+            doc.metadata["page"] = doc.metadata["page"]
+        else:
+            doc.metadata["page"] = None
+        
+        # タイムスタンプ（範囲のフィルタ用にUNIX時刻も保存）
+        doc.metadata["indexed_at"] = indexed_at.isoformat()
+        doc.metadata["indexed_at_ts"] = indexed_at.timestamp()
+        doc.metadata["chunk_size"] = len(doc.page_content)
+    
+    return docs, cached
+
+
+def resolve_workers(workers: Optional[int] = None) -> int:
+    """並列プロセス数を決定（未指定時はINGEST_WORKERS、0以下はCPUコア数）"""
+    if workers is None:
+        workers = INGEST_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def _load_file_task(task: Tuple[str, str, bool]) -> Dict:
+    """
+    ワーカープロセスで1ファイルを読み込む（必要ならチャンク分割まで行う）
+    
+    エラーはここで捕捉して結果に含めるため、1ファイルの失敗が
+    他のファイルの処理に影響しない。
+    """
+    file_path, source_key, split = task
+    started = time.perf_counter()
+    result = {
+        "file_path": Path(file_path),
+        "source_key": source_key,
+        "documents": None,
+        "chunks": None,
+        "pages": 0,
+        "cached": False,
+        "error": None,
+        "elapsed": 0.0,
+    }
+    try:
+        docs, result["cached"] = _load_file(Path(file_path))
+        result["pages"] = len(docs)
+        if split:
+            # 分割後は元のページテキストを返さない（プロセス間転送とメモリを節約）
+            result["chunks"] = _get_text_splitter().split_documents(docs) if docs else []
+        else:
+            result["documents"] = docs
+    except Exception as e:
+        result["error"] = str(e)
+    result["elapsed"] = time.perf_counter() - started
+    return result
+
+
+def load_files(files: List[Tuple[Path, str]], split: bool = False,
+               workers: Optional[int] = None) -> Iterator[Dict]:
+    """
+    複数ファイルをプロセスプールで並列に読み込む
+    
+    Args:
+        files: (ファイルパス, マニフェストのファイルキー)のリスト
+        split: Trueの場合はワーカー側でチャンク分割まで行う
+        workers: 並列プロセス数（省略時はINGEST_WORKERS）
+        
+    Yields:
+        ファイルごとの結果（入力と同じ順序）。キーは file_path, source_key,
+        documents, chunks, pages, cached, error, elapsed
+    """
+    tasks = [(str(file_path), source_key, split) for file_path, source_key in files]
+    workers = min(resolve_workers(workers), len(tasks))
+    done = 0
+    
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=multiprocessing.get_context(INGEST_START_METHOD)) as executor:
+                # 投入するタスクをワーカー数の2倍までに制限し、
+                # 読み込み済みの結果がメモリに溜まり続けないようにする
+                pending = deque()
+                next_task = 0
+                while done < len(tasks):
+                    while next_task < len(tasks) and len(pending) < workers * 2:
+                        pending.append(executor.submit(_load_file_task, tasks[next_task]))
+                        next_task += 1
+                    result = pending.popleft().result()
+                    done += 1
+                    yield result
+        except (BrokenProcessPool, OSError) as e:
+            print(f"⚠️ 並列読み込みに失敗したため、逐次処理に切り替えます: {e}")
+    
+    for task in tasks[done:]:
+        yield _load_file_task(task)
+
+
+def print_timing_report(timings: List[Tuple[str, float, int]], top_n: int = TIMING_REPORT_TOP_N):
+    """
+    ファイルごとの読み込み時間のうち、遅いものを表示
+    
+    Args:
+        timings: (ファイルキー, 処理秒数, ページ数)のリスト
+        top_n: 表示する件数
+    """
+    if not timings:
+        return
+    total = sum(elapsed for _, elapsed, _ in timings)
+    print(f"\n読み込み時間: 合計 {total:.2f}秒（{len(timings)}ファイル）")
+    for source_key, elapsed, pages in sorted(timings, key=lambda t: t[1], reverse=True)[:top_n]:
+        print(f"  {elapsed:7.2f}秒  {source_key}（{pages}ページ）")
+
+
+def load_documents(docs_dir: str, files: Optional[List[Path]] = None,
+                   workers: Optional[int] = None) -> List[Document]:
     """
     docs/ディレクトリ内の全ファイルを読み込む
     
     Args:
         docs_dir: ドキュメントディレクトリのパス
+        files: 読み込むファイルのリスト（省略時はdocs_dir内の全ファイル）
+        workers: 並列プロセス数（省略時はINGEST_WORKERS）
         
     Returns:
         読み込んだDocumentのリスト
     """
     documents = []
-    docs_path = Path(docs_dir)
     
-    if not docs_path.exists():
+    if not Path(docs_dir).exists():
         print(f"警告: {docs_dir} ディレクトリが存在しません")
         return documents
     
-    # サポートされているファイルを検索
-    for file_path in docs_path.rglob("*"):
-        if file_path.is_file() and file_path.suffix.lower() in SUPPORTED_EXTENSIONS:
-            try:
-                print(f"読み込み中: {file_path.name}")
-                
-                if file_path.suffix.lower() == ".pdf":
-                    loader = PyPDFLoader(str(file_path))
-                    docs = loader.load()
-                elif file_path.suffix.lower() in {".txt", ".md"}:
-                    loader = TextLoader(str(file_path), encoding="utf-8")
-                    docs = loader.load()
-                else:
-                    continue
-                
-                # 各ドキュメントにメタデータを追加（本格的な構造）
-                for doc in docs:
-                    # 基本メタデータ
-                    doc.metadata["source"] = str(file_path)
-                    doc.metadata["filename"] = file_path.name
-                    doc.metadata["file_type"] = file_path.suffix.lower().replace(".", "")
-                    doc.metadata["file_size"] = file_path.stat().st_size
-                    
-                    # PDFの場合はページ番号を追加
-                    if file_path.suffix.lower() == ".pdf" and "page" in doc.metadata:
-                        doc.metadata["page"] = doc.metadata["page"]
-                    else:
-                        doc.metadata["page"] = None
-                    
-                    # タイムスタンプ
-                    doc.metadata["indexed_at"] = datetime.datetime.now().isoformat()
-                    doc.metadata["chunk_size"] = len(doc.page_content)
-                
-                documents.extend(docs)
-                print(f"  ✓ {len(docs)} チャンクを読み込みました")
-                
-            except Exception as e:
-                print(f"  ✗ エラー: {file_path.name} - {e}")
-                continue
+    if files is None:
+        files = iter_supported_files(docs_dir)
+    
+    timings = []
+    for result in load_files([(f, get_source_key(f, docs_dir)) for f in files], workers=workers):
+        timings.append((result["source_key"], result["elapsed"], result["pages"]))
+        name = result["file_path"].name
+        if result["error"] is not None:
+            print(f"  ✗ エラー: {name} - {result['error']}")
+            continue
+        documents.extend(result["documents"])
+        print(f"  ✓ {name}: {len(result['documents'])} チャンクを読み込みました")
     
     print(f"\n合計 {len(documents)} ドキュメントを読み込みました")
+    print_timing_report(timings)
     return documents
 
 
+def _get_text_splitter() -> TextChunker:
+    """チャンク分割に使うテキストスプリッターを作成"""
+    return TextChunker(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        unit=CHUNK_UNIT,
+        model=EMBEDDING_MODEL,
+    )
+
+
 def split_documents(documents: List[Document]) -> List[Document]:
     """
     ドキュメントをチャンクに分割
@@ -123,57 +335,252 @@ def split_documents(documents: List[Document]) -> List[Document]:
     Returns:
         分割後のDocumentリスト
     """
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        length_function=len,
-    )
-    
-    chunks = text_splitter.split_documents(documents)
+    chunks = _get_text_splitter().split_documents(documents)
     print(f"{len(chunks)} チャンクに分割しました")
     return chunks
 
 
-def create_vectorstore(chunks: List[Document], persist_directory: str = None):
+def create_embeddings() -> CachedEmbeddings:
+    """Embeddingモデルを初期化（永続キャッシュ＋並列バッチスケジューラ経由）"""
+    # APIキーは環境変数から自動的に読み込まれる
+    return CachedEmbeddings(EmbeddingScheduler(model=EMBEDDING_MODEL), EMBEDDING_MODEL)
+
+
+def get_source_key(file_path: Path, docs_dir: str) -> str:
     """
-    ベクトルストアを作成して保存（Supabase優先、フォールバックでChroma DB）
+    マニフェストで使用するファイルのキー（docs_dirからの相対パス）を取得
     
     Args:
-        chunks: チャンク化されたDocumentリスト
-        persist_directory: Chroma DBの保存ディレクトリ（Supabase使用時は無視）
+        file_path: ファイルパス
+        docs_dir: ドキュメントディレクトリのパス
+        
+    Returns:
+        POSIX形式の相対パス
     """
-    if not chunks:
-        print("警告: チャンクが空のため、ベクトルストアを作成しませんでした")
-        return
+    try:
+        return Path(file_path).resolve().relative_to(Path(docs_dir).resolve()).as_posix()
+    except ValueError:
+        return Path(file_path).name
+
+
+def compute_file_hash(file_path: Path, block_size: int = 1024 * 1024) -> str:
+    """
+    ファイル内容のSHA-256ハッシュを計算（ブロック単位で読み込み）
     
-    # Embeddingモデルの初期化（OpenAI text-embedding-3-small）
-    # APIキーは環境変数から自動的に読み込まれる
-    embeddings = OpenAIEmbeddings(
-        model=EMBEDDING_MODEL
-    )
+    Args:
+        file_path: ファイルパス
+        block_size: 1回に読み込むバイト数
+        
+    Returns:
+        16進数のハッシュ文字列
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def make_chunk_id(source_key: str, chunk_index: int) -> str:
+    """
+    ソースファイルとチャンク番号から決定的なチャンクIDを生成
+    
+    同じファイルの同じ位置のチャンクは常に同じIDになるため、
+    再インデックス時にupsertで上書きできる。
+    
+    Args:
+        source_key: マニフェストのファイルキー
+        chunk_index: ファイル内のチャンク番号
+        
+    Returns:
+        UUID形式のチャンクID
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{COLLECTION_NAME}/{source_key}#{chunk_index}"))
+
+
+def load_manifest(manifest_path: str = MANIFEST_PATH) -> Dict:
+    """マニフェストを読み込む"""
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"マニフェスト読み込みエラー: {e}")
+    return {}
+
+
+def save_manifest(manifest: Dict, manifest_path: str = MANIFEST_PATH):
+    """マニフェストを保存（一時ファイルに書いてから置き換え）"""
+    temp_path = f"{manifest_path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, manifest_path)
+
+
+def get_indexed_hash(source_key: str) -> Optional[str]:
+    """
+    インデックス済みのファイルの内容ハッシュを取得
     
+    Args:
+        source_key: マニフェストのファイルキー（docs_dirからの相対パス）
+        
+    Returns:
+        compute_file_hash()と同じ形式のハッシュ（未登録・再処理待ちの場合はNone）
+    """
+    return load_manifest().get("files", {}).get(source_key, {}).get("hash")
+
+
+def new_manifest(backend: str, persist_directory: Optional[str]) -> Dict:
+    """現在の設定で空のマニフェストを作成"""
+    return {
+        "version": MANIFEST_VERSION,
+        # 全件再構築ごとに変わるID（回答キャッシュの無効化に使用）
+        "index_id": uuid.uuid4().hex,
+        "backend": backend,
+        "persist_directory": _version_root(backend, persist_directory) if backend != "pgvector" else None,
+        "embedding_model": EMBEDDING_MODEL,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "chunk_unit": CHUNK_UNIT,
+        "dedup_threshold": DEDUP_THRESHOLD if DEDUP_ENABLED else None,
+        "lexical_index": LEXICAL_INDEX_ENABLED,
+        "files": {},
+    }
+
+
+def is_manifest_compatible(manifest: Dict, persist_directory: str) -> bool:
+    """
+    マニフェストが現在の設定で差分インデックスに使えるか判定
+    
+    チャンク設定・重複排除とキーワード検索の設定・Embeddingモデル・保存先が変わった場合は全件再構築が必要。
+    """
+    if not manifest or manifest.get("version") != MANIFEST_VERSION:
+        return False
+    if (manifest.get("embedding_model") != EMBEDDING_MODEL
+            or manifest.get("chunk_size") != CHUNK_SIZE
+            or manifest.get("chunk_overlap") != CHUNK_OVERLAP
+            or manifest.get("chunk_unit") != CHUNK_UNIT
+            or manifest.get("dedup_threshold") != (DEDUP_THRESHOLD if DEDUP_ENABLED else None)
+            or bool(manifest.get("lexical_index")) != LEXICAL_INDEX_ENABLED):
+        return False
+    
+    backend = manifest.get("backend")
+    if USE_SUPABASE and PGVector:
+        return backend == "pgvector"
+    return backend == LOCAL_BACKEND and manifest.get("persist_directory") == _version_root(backend, persist_directory)
+
+
+def _version_root(backend: str, persist_directory: str) -> str:
+    """ローカルのベクトルストアのルートディレクトリ（バージョン管理の単位）"""
+    return NUMPY_DB_PATH if backend == "numpy" else persist_directory
+
+
+def open_vectorstore(backend: str, embeddings, persist_directory: str):
+    """
+    既存のベクトルストアを開く（差分更新用）
+    
+    Args:
+        backend: "pgvector"、"chroma" または "numpy"
+        embeddings: Embeddingモデル
+        persist_directory: Chroma DBの保存ディレクトリ
+        
+    Returns:
+        ベクトルストア（開けない場合はNone）
+    """
+    try:
+        if backend == "pgvector" and PGVector:
+            engine = get_engine()
+            if engine is not None:
+                return PGVector(
+                    connection=engine,
+                    embeddings=embeddings,
+                    collection_name=COLLECTION_NAME
+                )
+        elif backend == "chroma" and Chroma:
+            # 現在公開中のバージョンに対して差分更新する
+            version = index_versions.get_current_version(persist_directory)
+            if version is not None:
+                return Chroma(
+                    persist_directory=index_versions.version_path(persist_directory, version),
+                    embedding_function=embeddings,
+                    collection_name=COLLECTION_NAME
+                )
+        elif backend == "numpy":
+            version = index_versions.get_current_version(NUMPY_DB_PATH)
+            if version is not None:
+                return NumpyVectorStore(index_versions.version_path(NUMPY_DB_PATH, version), embeddings)
+    except Exception as e:
+        print(f"既存ベクトルストアのオープンエラー: {e}")
+    return None
+
+
+def load_and_split_files(files: List[Tuple[Path, str]]) -> Iterator[Tuple[str, Optional[List[Document]], List[str]]]:
+    """
+    複数ファイルを並列に読み込んでチャンクに分割し、決定的なチャンクIDを付与
+    
+    Args:
+        files: (ファイルパス, マニフェストのファイルキー)のリスト
+        
+    Yields:
+        (ファイルキー, チャンクリスト, チャンクIDリスト)のタプル（入力と同じ順序）。
+        読み込みに失敗したファイルはチャンクリストがNone
+    """
+    timings = []
+    cached_files = 0
+    for result in load_files(files, split=True):
+        timings.append((result["source_key"], result["elapsed"], result["pages"]))
+        cached_files += result["cached"]
+        source_key = result["source_key"]
+        if result["error"] is not None:
+            print(f"  ✗ エラー: {source_key} - {result['error']}")
+            yield source_key, None, []
+            continue
+        
+        chunks = result["chunks"]
+        ids = [make_chunk_id(source_key, i) for i in range(len(chunks))]
+        cached = "、解析キャッシュ" if result["cached"] else ""
+        print(f"  ✓ {source_key}: {result['pages']} ページ / {len(chunks)} チャンク"
+              f"（{result['elapsed']:.2f}秒{cached}）")
+        yield source_key, chunks, ids
+    
+    print_timing_report(timings)
+    if cached_files:
+        print(f"解析キャッシュ: {cached_files}件のPDFは解析を省略しました")
+
+
+def _create_empty_vectorstore(embeddings, persist_directory: str):
+    """
+    全件再構築用に空のベクトルストアを作成（Supabase優先、フォールバックでChroma DB。
+    VECTOR_BACKEND=numpy の場合はNumpyVectorStore）
+    
+    ローカルのベクトルストアは未公開の新しいバージョンとして作成し、書き込み完了後に
+    _finalize_version() で公開する。
+    
+    Args:
+        embeddings: Embeddingモデル
+        persist_directory: Chroma DBのルートディレクトリ（Supabase使用時は無視）
+        
+    Returns:
+        (ベクトルストア, バックエンド名, ローカルのベクトルストアのバージョンID)のタプル。
+        Supabase使用時のバージョンIDはNone
+    """
     # Supabaseが利用可能な場合
     if USE_SUPABASE and PGVector:
         try:
-            database_url = os.getenv("DATABASE_URL")
-            if not database_url:
+            engine = get_engine()
+            if engine is None:
                 raise ValueError("DATABASE_URL環境変数が設定されていません")
             
             print(f"Supabase + pgvectorに保存します...")
             
-            # Supabaseに保存（既存コレクションは自動的に上書き）
             # pre_delete_collection=Trueで既存データを削除してから保存
-            vectorstore = PGVector.from_documents(
-                documents=chunks,
-                embedding=embeddings,  # from_documentsではembedding（単数形）
-                connection=database_url,
+            vectorstore = PGVector(
+                connection=engine,
+                embeddings=embeddings,
                 collection_name=COLLECTION_NAME,
                 pre_delete_collection=True  # 既存コレクションを削除してから保存
             )
-            
-            print(f"✅ Supabase + pgvectorに保存しました")
-            print(f"  {len(chunks)} チャンクを保存しました")
-            return
+            return vectorstore, "pgvector", None
             
         except Exception as e:
             print(f"Supabase保存エラー: {e}")
@@ -181,154 +588,672 @@ def create_vectorstore(chunks: List[Document], persist_directory: str = None):
             import traceback
             traceback.print_exc()
     
+    if LOCAL_BACKEND == "numpy":
+        version, version_dir = index_versions.create_version(NUMPY_DB_PATH)
+        print(f"新しいバージョンのNumPyベクトルストアを作成します: {version}")
+        return NumpyVectorStore(version_dir, embeddings), "numpy", version
+    
     # フォールバック: Chroma DBを使用（ローカル開発用）
     if not Chroma:
         raise ValueError("Chroma DBも利用できません。SupabaseまたはChroma DBの設定を確認してください")
     
+    collection_metadata = {
+        "description": "RAG system document collection",
+        "version": "1.0",
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "chunk_unit": CHUNK_UNIT,
+        "embedding_model": EMBEDDING_MODEL
+    }
+    
+    # 新しいバージョンのディレクトリに作成し、書き込み完了後にCURRENTを切り替える
+    # （切り替えまでは読み手は古いバージョンを使い続ける）
+    version, version_dir = index_versions.create_version(persist_directory)
+    print(f"新しいバージョンのChroma DBを作成します: {version}")
+    try:
+        vectorstore = Chroma(
+            persist_directory=version_dir,
+            embedding_function=embeddings,
+            collection_name=COLLECTION_NAME,
+            collection_metadata=collection_metadata
+        )
+    except Exception as e:
+        print(f"エラー: Chroma DBの作成に失敗しました: {e}")
+        index_versions.discard_version(persist_directory, version)
+        raise
+    return vectorstore, "chroma", version
+
+
+def _finalize_version(backend: str, version: str, persist_directory: str):
+    """書き込みが完了したバージョンを公開（CURRENTを切り替え、古いバージョンを削除）"""
+    root = _version_root(backend, persist_directory)
+    index_versions.publish_version(root, version)
+    name = "NumPyベクトルストア" if backend == "numpy" else "Chroma DB"
+    print(f"{name}を作成しました: {index_versions.version_path(root, version)}")
+
+
+def _discard_version(backend: str, version: str, persist_directory: str):
+    """公開前に失敗したバージョンを削除"""
+    index_versions.discard_version(_version_root(backend, persist_directory), version)
+
+
+def write_batch(vectorstore, chunks: List[Document], ids: List[str], vectors: List[List[float]]):
+    """
+    Embedding計算済みのチャンクをベクトルストアにupsert
+    
+    Args:
+        vectorstore: 書き込み先のベクトルストア
+        chunks: チャンクのリスト
+        ids: チャンクIDのリスト
+        vectors: chunksに対応するEmbeddingのリスト
+    """
+    texts = [chunk.page_content for chunk in chunks]
+    metadatas = [chunk.metadata for chunk in chunks]
+    
+    if hasattr(vectorstore, "add_embeddings"):
+        # PGVector / NumpyVectorStore
+        vectorstore.add_embeddings(texts=texts, embeddings=vectors, metadatas=metadatas, ids=ids)
+    else:
+        # Chroma（LangChainのラッパーには計算済みEmbeddingを渡すAPIがないため直接upsert）
+        # Chromaのメタデータには None を保存できないため除外する
+        vectorstore._collection.upsert(
+            ids=ids,
+            embeddings=vectors,
+            metadatas=[{k: v for k, v in m.items() if v is not None} for m in metadatas],
+            documents=texts
+        )
+
+
+def create_vectorstore(chunks: List[Document], persist_directory: str = None,
+                       ids: Optional[List[str]] = None) -> Optional[str]:
+    """
+    ベクトルストアを作成して保存（Supabase優先、フォールバックでChroma DB）
+    
+    Args:
+        chunks: チャンク化されたDocumentリスト
+        persist_directory: Chroma DBの保存ディレクトリ（Supabase使用時は無視）
+        ids: チャンクIDのリスト（省略時は自動採番）
+        
+    Returns:
+        保存先のバックエンド名（"pgvector"、"chroma" または "numpy"）
+    """
+    if not chunks:
+        print("警告: チャンクが空のため、ベクトルストアを作成しませんでした")
+        return None
+    
+    # Embeddingモデルの初期化（OpenAI text-embedding-3-small、キャッシュ経由）
+    embeddings = create_embeddings()
     persist_directory = os.path.abspath(persist_directory or CHROMA_DB_PATH)
+    ids = ids or [str(uuid.uuid4()) for _ in chunks]
+    
+    vectorstore, backend, version = _create_empty_vectorstore(embeddings, persist_directory)
+    try:
+        for start in range(0, len(chunks), EMBED_BATCH_SIZE):
+            batch = chunks[start:start + EMBED_BATCH_SIZE]
+            vectors = embeddings.embed_documents([chunk.page_content for chunk in batch])
+            write_batch(vectorstore, batch, ids[start:start + EMBED_BATCH_SIZE], vectors)
+    except Exception:
+        if version:
+            _discard_version(backend, version, persist_directory)
+        raise
+    
+    if version:
+        _finalize_version(backend, version, persist_directory)
+    print(f"  {len(chunks)} チャンクを保存しました")
+    return backend
+
+
+class IngestProgress:
+    """インデックス処理の段ごとの進捗を集計し、コールバックに通知する"""
+    
+    def __init__(self, callback: Optional[Callable[[Dict], None]] = None):
+        """
+        初期化
+        
+        Args:
+            callback: 進捗が更新されるたびに snapshot() の値を受け取る関数
+        """
+        self.callback = callback
+        self._lock = threading.Lock()
+        self._values = {
+            "stage": "scanning",
+            "files_total": 0,
+            "files_parsed": 0,
+            "files_removed": 0,
+            "chunks_parsed": 0,
+            "chunks_duplicate": 0,
+            "chunks_embedded": 0,
+            "chunks_written": 0,
+        }
     
-    # 既存のDBを削除（確実に削除するため、複数回試行）
-    if os.path.exists(persist_directory):
-        max_retries = 3
-        for retry in range(max_retries):
+    def update(self, stage: Optional[str] = None, total: Optional[Dict] = None, **increments):
+        """
+        進捗を更新
+        
+        Args:
+            stage: 現在の段階（scanning, indexing, removing, done）
+            total: 上書きする値
+            **increments: 加算する値（例: chunks_written=128）
+        """
+        with self._lock:
+            if stage is not None:
+                self._values["stage"] = stage
+            if total:
+                self._values.update(total)
+            for key, value in increments.items():
+                self._values[key] = self._values.get(key, 0) + value
+            snapshot = dict(self._values)
+        if self.callback:
             try:
-                # ディレクトリ内のファイルの権限を変更してから削除
-                import stat
-                for root, dirs, files in os.walk(persist_directory):
-                    for d in dirs:
-                        os.chmod(os.path.join(root, d), stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
-                    for f in files:
-                        os.chmod(os.path.join(root, f), stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP | stat.S_IROTH | stat.S_IWOTH)
-                
-                shutil.rmtree(persist_directory)
-                print(f"既存のChroma DBを削除しました: {persist_directory}")
-                break
+                self.callback(snapshot)
             except Exception as e:
-                if retry == max_retries - 1:
-                    print(f"警告: 既存DBの削除に失敗しました: {e}")
-                    # 最後の試行でも失敗した場合は、エラーを出す
-                    raise
-                import time
-                time.sleep(0.5)  # 少し待ってから再試行
-    
-    # ディレクトリを作成（権限付き）
+                print(f"進捗通知エラー: {e}")
+    
+    def snapshot(self) -> Dict:
+        """現在の進捗を取得"""
+        with self._lock:
+            return dict(self._values)
+
+
+def _iter_chunk_batches(files: List[Tuple[Path, str]], batch_size: int = EMBED_BATCH_SIZE,
+                        progress: Optional[IngestProgress] = None,
+                        dedup: Optional[ChunkDeduplicator] = None) -> Iterator[Dict]:
+    """
+    読み込み・分割したチャンクを一定数ごとのバッチにまとめる
+    
+    Args:
+        files: (ファイルパス, マニフェストのファイルキー)のリスト
+        batch_size: 1バッチあたりのチャンク数
+        progress: 進捗の集計先
+        dedup: 指定した場合、保存済みチャンクと重複するチャンクを取り除く
+        
+    Yields:
+        chunks, ids, completed を持つ辞書。completedは、このバッチを書き込んだ
+        時点で全チャンクの保存が完了するファイルの (ファイルキー, チャンクIDリスト)
+    """
+    batch = {"chunks": [], "ids": [], "completed": []}
+    for source_key, chunks, ids in load_and_split_files(files):
+        if progress:
+            progress.update(files_parsed=1, chunks_parsed=len(chunks or []))
+        if chunks is None:
+            continue
+        if dedup is not None:
+            total = len(chunks)
+            chunks, ids = dedup.deduplicate(source_key, chunks, ids)
+            if progress:
+                progress.update(chunks_duplicate=total - len(chunks))
+        for chunk, chunk_id in zip(chunks, ids):
+            # 検索結果から重複参照を引けるよう、チャンクIDをメタデータに持たせる
+            chunk.metadata["chunk_id"] = chunk_id
+            batch["chunks"].append(chunk)
+            batch["ids"].append(chunk_id)
+            if len(batch["chunks"]) >= batch_size:
+                yield batch
+                batch = {"chunks": [], "ids": [], "completed": []}
+        batch["completed"].append((source_key, ids))
+    
+    if batch["chunks"] or batch["completed"]:
+        yield batch
+
+
+def _write_files(vectorstore, embeddings, files: List[Tuple[Path, str]],
+                 on_file_written: Callable[[str, List[str]], None],
+                 progress: Optional[IngestProgress] = None,
+                 dedup: Optional[ChunkDeduplicator] = None,
+                 lexical: Optional[LexicalIndex] = None) -> int:
+    """
+    ファイルを 読み込み → 分割 → Embedding → 書き込み のパイプラインで処理
+    
+    各段は境界付きキューでつながっているため、ファイル数に関わらず
+    メモリ上に保持されるチャンクは数バッチ分に限られる。
+    
+    Args:
+        vectorstore: 書き込み先のベクトルストア
+        embeddings: Embeddingモデル
+        files: (ファイルパス, マニフェストのファイルキー)のリスト
+        on_file_written: ファイルの全チャンクを書き込んだ後に呼ぶ関数
+        progress: 進捗の集計先
+        dedup: 重複排除に使うインデックス（Noneの場合は重複排除しない）
+        lexical: 書き込んだチャンクを登録するキーワード検索インデックス
+        
+    Returns:
+        書き込んだチャンク数
+    """
+    progress = progress or IngestProgress()
+    progress.update(stage="indexing", total={"files_total": len(files)})
+    
+    def embed(batch: Dict) -> Dict:
+        texts = [chunk.page_content for chunk in batch["chunks"]]
+        batch["vectors"] = embeddings.embed_documents(texts) if texts else []
+        progress.update(chunks_embedded=len(texts))
+        return batch
+    
+    written = 0
+    batches = _iter_chunk_batches(files, progress=progress, dedup=dedup)
+    for batch in run_pipeline(batches, [embed]):
+        if batch["chunks"]:
+            write_batch(vectorstore, batch["chunks"], batch["ids"], batch["vectors"])
+            if lexical is not None:
+                lexical.add_chunks(batch["chunks"], batch["ids"])
+            written += len(batch["chunks"])
+            progress.update(chunks_written=len(batch["chunks"]))
+        for source_key, ids in batch["completed"]:
+            on_file_written(source_key, ids)
+    return written
+
+
+def _full_ingest(files: Dict[str, Tuple[Path, str]], persist_directory: str, embeddings,
+                 progress: IngestProgress):
+    """全ファイルを読み込み直してベクトルストアを再構築し、マニフェストを作成"""
+    if not files:
+        print("警告: 読み込むドキュメントがありません")
+        return
+    
+    vectorstore, backend, version = _create_empty_vectorstore(embeddings, persist_directory)
+    manifest = new_manifest(backend, persist_directory)
+    dedup = _create_empty_dedup_index()
+    lexical = _create_empty_lexical_index()
+    now = datetime.datetime.now().isoformat()
+    
+    def on_file_written(source_key: str, ids: List[str]):
+        manifest["files"][source_key] = {"hash": files[source_key][1], "chunk_ids": ids, "indexed_at": now}
+    
+    targets = [(file_path, source_key) for source_key, (file_path, _) in files.items()]
     try:
-        import stat
-        os.makedirs(persist_directory, mode=0o777, exist_ok=True)
-        # 確実に書き込み権限を付与
-        os.chmod(persist_directory, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
-        print(f"Chroma DBディレクトリを作成しました: {persist_directory}")
-    except Exception as e:
-        print(f"エラー: ディレクトリの作成に失敗しました: {e}")
+        written = _write_files(vectorstore, embeddings, targets, on_file_written, progress, dedup, lexical)
+    except Exception:
+        if version:
+            _discard_version(backend, version, persist_directory)
+        _discard_dedup_index(dedup)
+        _discard_lexical_index(lexical)
         raise
     
-    # 新しいベクトルストアを作成
-    if chunks:
-        # 一時ディレクトリに作成してから移動する方法を試す
-        import tempfile
-        temp_dir = None
-        try:
-            # まず一時ディレクトリに作成
-            temp_dir = tempfile.mkdtemp(prefix="chroma_temp_")
-            print(f"一時ディレクトリに作成: {temp_dir}")
-            
-            # 一時ディレクトリにChroma DBを作成（コレクション名とメタデータを設定）
-            vectorstore = Chroma.from_documents(
-                documents=chunks,
-                embedding=embeddings,
-                persist_directory=temp_dir,
-                collection_name="rag_documents",
-                collection_metadata={
-                    "description": "RAG system document collection",
-                    "version": "1.0",
-                    "chunk_size": CHUNK_SIZE,
-                    "chunk_overlap": CHUNK_OVERLAP,
-                    "embedding_model": EMBEDDING_MODEL
-                }
-            )
-            print(f"一時ディレクトリにChroma DBを作成しました（コレクション: rag_documents）")
-            
-            # 既存のpersist_directoryを削除
-            if os.path.exists(persist_directory):
-                shutil.rmtree(persist_directory)
-            
-            # 一時ディレクトリをpersist_directoryに移動
-            shutil.move(temp_dir, persist_directory)
-            temp_dir = None  # 移動成功したのでNoneに設定
-            
-            print(f"Chroma DBを作成しました: {persist_directory}")
-            print(f"  {len(chunks)} チャンクを保存しました")
-            
-        except Exception as e:
-            print(f"エラー: Chroma DBの作成に失敗しました: {e}")
-            # エラーの詳細を表示
-            import traceback
-            traceback.print_exc()
-            
-            # 一時ディレクトリのクリーンアップ
-            if temp_dir and os.path.exists(temp_dir):
-                try:
-                    shutil.rmtree(temp_dir)
-                except:
-                    pass
-            
-            # 直接persist_directoryに作成する方法を試す（フォールバック）
+    if written == 0 and version:
+        # 1件も書き込めなかった場合は既存のベクトルストアを残す
+        print("警告: チャンクが空のため、ベクトルストアを作成しませんでした")
+        _discard_version(backend, version, persist_directory)
+        _discard_dedup_index(dedup)
+        _discard_lexical_index(lexical)
+        return
+    
+    if version:
+        _finalize_version(backend, version, persist_directory)
+    print(f"  {written} チャンクを保存しました")
+    _print_dedup_report(dedup)
+    _publish_dedup_index(dedup)
+    _publish_lexical_index(lexical)
+    save_manifest(manifest)
+
+
+def _reindex_files(vectorstore, manifest: Dict, files: Dict[str, Tuple[Path, str]], source_keys: List[str],
+                   embeddings, progress: IngestProgress, dedup: Optional[ChunkDeduplicator],
+                   lexical: Optional[LexicalIndex]) -> int:
+    """
+    指定したファイルのチャンクを既存のベクトルストアにupsertし、マニフェストを更新
+    
+    読み込みに失敗したファイルはマニフェストを更新せず、次回再試行する。
+    
+    Returns:
+        書き込んだチャンク数
+    """
+    indexed = manifest.setdefault("files", {})
+    now = datetime.datetime.now().isoformat()
+    
+    def on_file_written(source_key: str, ids: List[str]):
+        # 更新でチャンク数が減った場合（重複として除外された場合を含む）、余ったチャンクを削除
+        new_ids = set(ids)
+        stale_ids = [i for i in indexed.get(source_key, {}).get("chunk_ids", []) if i not in new_ids]
+        if stale_ids:
+            vectorstore.delete(ids=stale_ids)
+            if lexical is not None:
+                lexical.delete(stale_ids)
+        
+        indexed[source_key] = {"hash": files[source_key][1], "chunk_ids": ids, "indexed_at": now}
+        save_manifest(manifest)
+    
+    targets = [(files[source_key][0], source_key) for source_key in source_keys]
+    return _write_files(vectorstore, embeddings, targets, on_file_written, progress, dedup, lexical)
+
+
+def _incremental_ingest(vectorstore, manifest: Dict, files: Dict[str, Tuple[Path, str]], embeddings,
+                        progress: IngestProgress):
+    """変更のあったファイルのチャンクのみを追加・更新・削除"""
+    indexed = manifest.setdefault("files", {})
+    added = [key for key in files if key not in indexed]
+    changed = [key for key in files if key in indexed and indexed[key]["hash"] != files[key][1]]
+    removed = [key for key in indexed if key not in files]
+    
+    print(f"追加: {len(added)}件 / 更新: {len(changed)}件 / 削除: {len(removed)}件 / "
+          f"変更なし: {len(files) - len(added) - len(changed)}件")
+    
+    dedup = ChunkDeduplicator(DEDUP_INDEX_PATH) if DEDUP_ENABLED else None
+    lexical = LexicalIndex(LEXICAL_INDEX_PATH) if LEXICAL_INDEX_ENABLED else None
+    try:
+        # 削除されるチャンクを重複として参照していたファイルも保存し直す
+        dependents = _release_dedup_state(dedup, indexed, files, added + changed + removed)
+        if dependents:
+            save_manifest(manifest)
+            print(f"重複チャンクの参照先が変わるため再処理: {len(dependents)}件")
+        
+        # 追加・更新されたファイルをupsert
+        targets = added + changed + dependents
+        if targets:
+            written = _reindex_files(vectorstore, manifest, files, targets, embeddings, progress, dedup, lexical)
+            print(f"  {written} チャンクを保存しました")
+        
+        # 削除されたファイルのチャンクを削除
+        if removed:
+            progress.update(stage="removing")
+        for source_key in removed:
+            stale_ids = indexed[source_key].get("chunk_ids", [])
+            if stale_ids:
+                vectorstore.delete(ids=stale_ids)
+                if lexical is not None:
+                    lexical.delete(stale_ids)
+            del indexed[source_key]
+            save_manifest(manifest)
+            progress.update(files_removed=1)
+            print(f"  ✓ {source_key}: {len(stale_ids)} チャンクを削除しました")
+        
+        if targets:
+            _print_dedup_report(dedup)
+    finally:
+        if dedup is not None:
+            dedup.close()
+        if lexical is not None:
+            lexical.close()
+
+
+# ==================== 重複排除 ====================
+
+def _create_empty_dedup_index() -> Optional[ChunkDeduplicator]:
+    """全件再構築用に空の重複排除インデックスを一時ファイルに作成（無効な場合はNone）"""
+    if not DEDUP_ENABLED:
+        return None
+    temp_path = f"{DEDUP_INDEX_PATH}.{os.getpid()}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    return ChunkDeduplicator(temp_path)
+
+
+def _publish_dedup_index(dedup: Optional[ChunkDeduplicator]):
+    """全件再構築した重複排除インデックスを既存のものと置き換える"""
+    if dedup is None:
+        # 重複排除を無効にした場合、古い参照が検索結果に出ないよう削除する
+        if os.path.exists(DEDUP_INDEX_PATH):
+            os.remove(DEDUP_INDEX_PATH)
+        return
+    dedup.close()
+    os.replace(dedup.path, DEDUP_INDEX_PATH)
+
+
+def _discard_dedup_index(dedup: Optional[ChunkDeduplicator]):
+    """全件再構築に失敗した重複排除インデックスを削除"""
+    if dedup is None:
+        return
+    dedup.close()
+    try:
+        os.remove(dedup.path)
+    except OSError:
+        pass
+
+
+def _release_dedup_state(dedup: Optional[ChunkDeduplicator], indexed: Dict,
+                         files: Dict[str, Tuple[Path, str]], source_keys: List[str]) -> List[str]:
+    """
+    再処理・削除するファイルの重複排除の状態を削除し、巻き込まれるファイルを求める
+    
+    削除されるチャンクを重複として参照していたファイルは、内容が変わっていなくても
+    チャンクを保存し直す必要がある（Embeddingはキャッシュから取得される）。
+    処理が中断しても次回再処理されるよう、それらのファイルはマニフェスト上の
+    ハッシュを消しておく（保存は呼び出し側で行う）。
+    
+    Args:
+        dedup: 重複排除インデックス（Noneの場合は何もしない）
+        indexed: マニフェストのファイル一覧
+        files: docs/に存在するファイル（キー → (パス, ハッシュ)）
+        source_keys: 再処理・削除するファイルのキー
+        
+    Returns:
+        追加で再処理が必要なファイルのキー
+    """
+    if dedup is None:
+        return []
+    dependents = []
+    seen = set(source_keys)
+    pending = list(source_keys)
+    while pending:
+        for source_key in dedup.remove_file(pending.pop()):
+            if source_key in seen:
+                continue
+            seen.add(source_key)
+            pending.append(source_key)
+            if source_key in indexed:
+                indexed[source_key]["hash"] = None
+            if source_key in files:
+                dependents.append(source_key)
+    return dependents
+
+
+def _print_dedup_report(dedup: Optional[ChunkDeduplicator]):
+    """重複排除で削減できたチャンク数を表示"""
+    if dedup is None:
+        return
+    stats = dedup.stats()
+    removed = stats["exact_duplicates"] + stats["near_duplicates"]
+    if stats["checked"]:
+        print(f"重複排除: {stats['checked']} チャンク中 {removed} 件を除外"
+              f"（完全一致 {stats['exact_duplicates']}件 / 類似 {stats['near_duplicates']}件、"
+              f"Embedding・保存量を {removed / stats['checked']:.1%} 削減）")
+    print(f"  インデックス全体: 保存 {stats['stored']} チャンク / 重複として参照 {stats['references']} 件")
+
+
+# ==================== キーワード検索 ====================
+
+def _create_empty_lexical_index() -> Optional[LexicalIndex]:
+    """全件再構築用に空のキーワード検索インデックスを一時ファイルに作成（無効な場合はNone）"""
+    if not LEXICAL_INDEX_ENABLED:
+        return None
+    temp_path = f"{LEXICAL_INDEX_PATH}.{os.getpid()}.tmp"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    return LexicalIndex(temp_path)
+
+
+def _publish_lexical_index(lexical: Optional[LexicalIndex]):
+    """全件再構築したキーワード検索インデックスを既存のものと置き換える"""
+    if lexical is None:
+        # キーワード検索を無効にした場合、古いチャンクが検索結果に出ないよう削除する
+        if os.path.exists(LEXICAL_INDEX_PATH):
+            os.remove(LEXICAL_INDEX_PATH)
+        return
+    lexical.close()
+    os.replace(lexical.path, LEXICAL_INDEX_PATH)
+
+
+def _discard_lexical_index(lexical: Optional[LexicalIndex]):
+    """全件再構築に失敗したキーワード検索インデックスを削除"""
+    if lexical is None:
+        return
+    lexical.close()
+    try:
+        os.remove(lexical.path)
+    except OSError:
+        pass
+
+
+def _delete_legacy_chunks(vectorstore, source: str) -> int:
+    """
+    チャンクIDがマニフェストにないチャンク（マニフェスト導入前に登録されたもの）をsourceで削除
+
+    ベクトルストアの公開APIでメタデータからIDを引ける場合だけ削除する
+    （NumPy: delete_by_source()、Chroma: get(where=...)）。PGVectorにはメタデータで
+    IDを引く公開APIがないため削除せず、全件再構築を促す。
+
+    Args:
+        vectorstore: ベクトルストア
+        source: load_file()がメタデータに書き込んだファイルパス
+
+    Returns:
+        削除したチャンク数
+    """
+    if isinstance(vectorstore, NumpyVectorStore):
+        return vectorstore.delete_by_source(source)
+    if PGVector is not None and isinstance(vectorstore, PGVector):
+        print(f"警告: チャンクIDが記録されていないため削除できません（全件再構築で削除されます）: {source}")
+        return 0
+    if not callable(getattr(vectorstore, "get", None)):
+        print(f"警告: このベクトルストアはメタデータでの削除に対応していません: {source}")
+        return 0
+    ids = vectorstore.get(where={"source": source}, include=[])["ids"]
+    if ids:
+        vectorstore.delete(ids=ids)
+    return len(ids)
+
+
+def delete_from_index(filename: str, docs_dir: str = DOCS_DIR, chroma_db_path: str = None) -> Tuple[int, List[str]]:
+    """
+    1ファイル分のチャンクだけをインデックスから削除（Embeddingの再計算なし）
+    
+    マニフェストに記録されたチャンクIDで削除する（マニフェスト作成前に登録された
+    ファイルは source メタデータで削除する）。削除したチャンクを重複として参照していた
+    ファイルは、マニフェスト上のハッシュを消して返す。それらのチャンクは次の差分
+    インデックスで保存し直されるため、呼び出し側でインデックスジョブを投入すること
+    （Embeddingはキャッシュから取得されるため、通常APIは呼ばれない）。
+    
+    Args:
+        filename: 削除するファイルのキー（docs_dirからの相対パス）
+        docs_dir: ドキュメントディレクトリのパス
+        chroma_db_path: Chroma DBの保存パス（Supabase使用時は無視）
+        
+    Returns:
+        (削除したチャンク数, 再処理が必要なファイルのキー)のタプル
+    """
+    persist_directory = os.path.abspath(chroma_db_path or CHROMA_DB_PATH)
+    
+    with INDEX_LOCK:
+        manifest = load_manifest()
+        if manifest:
+            backend = manifest.get("backend")
+        else:
+            backend = "pgvector" if USE_SUPABASE and PGVector else LOCAL_BACKEND
+        
+        # 削除ではEmbeddingを計算しないため、Embeddingモデルは渡すだけ
+        vectorstore = open_vectorstore(backend, create_embeddings(), persist_directory)
+        if vectorstore is None:
+            print(f"警告: インデックスが見つからないため削除をスキップしました: {filename}")
+            return 0, []
+        
+        entry = manifest.get("files", {}).pop(filename, None)
+        chunk_ids = entry.get("chunk_ids", []) if entry else []
+        source = str(Path(docs_dir) / filename)
+        if chunk_ids:
+            vectorstore.delete(ids=chunk_ids)
+            deleted = len(chunk_ids)
+        else:
+            deleted = _delete_legacy_chunks(vectorstore, source)
+        
+        lexical = LexicalIndex(LEXICAL_INDEX_PATH) if LEXICAL_INDEX_ENABLED and os.path.exists(LEXICAL_INDEX_PATH) else None
+        if lexical is not None:
             try:
-                print("\nフォールバック: 直接persist_directoryに作成を試みます...")
-                # 再度ディレクトリを作成
-                import stat
-                if os.path.exists(persist_directory):
-                    shutil.rmtree(persist_directory)
-                os.makedirs(persist_directory, mode=0o777, exist_ok=True)
-                os.chmod(persist_directory, stat.S_IRWXU | stat.S_IRWXG | stat.S_IRWXO)
-                
-                # Chroma DBを作成（コレクション名とメタデータを設定）
-                vectorstore = Chroma.from_documents(
-                    documents=chunks,
-                    embedding=embeddings,
-                    persist_directory=persist_directory,
-                    collection_name="rag_documents",
-                    collection_metadata={
-                        "description": "RAG system document collection",
-                        "version": "1.0",
-                        "chunk_size": CHUNK_SIZE,
-                        "chunk_overlap": CHUNK_OVERLAP,
-                        "embedding_model": EMBEDDING_MODEL
-                    }
-                )
-                print(f"フォールバック成功: Chroma DBを作成しました")
-                print(f"  {len(chunks)} チャンクを保存しました")
-            except Exception as e2:
-                print(f"フォールバックも失敗しました: {e2}")
-                raise
-    else:
-        print("警告: チャンクが空のため、Chroma DBを作成しませんでした")
+                lexical.delete(chunk_ids)
+                lexical.delete_by_source(source)
+            finally:
+                lexical.close()
+        
+        # 削除したチャンクを重複として参照していたファイルは、次の差分インデックスで保存し直す
+        dependents = []
+        if DEDUP_ENABLED and manifest:
+            dedup = ChunkDeduplicator(DEDUP_INDEX_PATH)
+            try:
+                existing = {key: (Path(docs_dir) / key, None) for key in manifest["files"]
+                            if (Path(docs_dir) / key).exists()}
+                dependents = _release_dedup_state(dedup, manifest["files"], existing, [filename])
+            finally:
+                dedup.close()
+        
+        if entry is not None or dependents:
+            save_manifest(manifest)
+    
+    print(f"インデックスから削除しました: {filename}（{deleted} チャンク）")
+    if dependents:
+        print(f"  重複チャンクの参照先が変わったため再処理が必要です: {', '.join(dependents)}")
+    return deleted, dependents
 
 
-def ingest(docs_dir: str = DOCS_DIR, chroma_db_path: str = None):
+def ingest(docs_dir: str = DOCS_DIR, chroma_db_path: str = None, full_rebuild: bool = False,
+           progress_callback: Optional[Callable[[Dict], None]] = None):
     """
     インデックス処理を実行
     
+    前回のマニフェストが現在の設定と互換性がある場合は、内容が変わった
+    ファイルのチャンクのみを追加・更新・削除する（差分インデックス）。
+    読み込み・分割・Embedding・書き込みはバッチ単位のパイプラインで行うため、
+    ファイル数が増えてもメモリ使用量は一定に保たれる。
+    
     Args:
         docs_dir: ドキュメントディレクトリのパス
         chroma_db_path: Chroma DBの保存パス（Supabase使用時は無視）
+        full_rebuild: Trueの場合はマニフェストを無視して全件再構築
+        progress_callback: 段ごとの進捗（IngestProgress.snapshot()の値）を受け取る関数
     """
+    with INDEX_LOCK:
+        _ingest(docs_dir, chroma_db_path, full_rebuild, progress_callback)
+
+
+def _ingest(docs_dir: str, chroma_db_path: Optional[str], full_rebuild: bool,
+            progress_callback: Optional[Callable[[Dict], None]]):
+    """ingest()の本体（INDEX_LOCKを取得した状態で呼ぶ）"""
     print("=" * 50)
     print("インデックス処理を開始します...")
     print("=" * 50)
     
-    # 1. ドキュメントを読み込む
-    documents = load_documents(docs_dir)
+    if not Path(docs_dir).exists():
+        print(f"警告: {docs_dir} ディレクトリが存在しません")
     
-    if not documents:
-        print("警告: 読み込むドキュメントがありません")
-        return
+    persist_directory = os.path.abspath(chroma_db_path or CHROMA_DB_PATH)
+    cache_stats_before = get_embedding_cache().stats()
+    progress = IngestProgress(progress_callback)
+    progress.update(stage="scanning")
+    
+    # 1. ファイル一覧と内容ハッシュを取得
+    files = {}
+    for file_path in iter_supported_files(docs_dir):
+        try:
+            files[get_source_key(file_path, docs_dir)] = (file_path, compute_file_hash(file_path))
+        except Exception as e:
+            print(f"  ✗ エラー: {file_path.name} - {e}")
+    
+    # 2. 既存インデックスが使えれば差分更新、使えなければ全件再構築
+    # Embeddingモデルの初期化（OpenAI text-embedding-3-small、キャッシュ経由）
+    embeddings = create_embeddings()
+    manifest = load_manifest()
+    vectorstore = None
+    if not full_rebuild and is_manifest_compatible(manifest, persist_directory):
+        vectorstore = open_vectorstore(manifest["backend"], embeddings, persist_directory)
+    
+    if vectorstore is not None:
+        print("差分インデックスを実行します")
+        _incremental_ingest(vectorstore, manifest, files, embeddings, progress)
+    else:
+        print("全件インデックスを実行します")
+        _full_ingest(files, persist_directory, embeddings, progress)
+    
+    # Embeddingキャッシュの利用状況を表示
+    cache_stats = get_embedding_cache().stats()
+    hits = cache_stats["hits"] - cache_stats_before["hits"]
+    misses = cache_stats["misses"] - cache_stats_before["misses"]
+    print(f"Embeddingキャッシュ: ヒット {hits}件 / ミス {misses}件"
+          f"（保存数 {cache_stats['entries']}件, {cache_stats['size_bytes'] / (1024 * 1024):.1f} MB）")
     
-    # 2. チャンクに分割
-    chunks = split_documents(documents)
+    # Embedding APIのスループットを表示
+    api_stats = embeddings.underlying.progress()
+    if api_stats["requests"]:
+        print(f"Embedding API: {api_stats['chunks']} チャンク / {api_stats['tokens']} トークン"
+              f"（{api_stats['chunks_per_sec']:.1f} chunks/s, {api_stats['tokens_per_sec']:.0f} tokens/s, "
+              f"リクエスト {api_stats['requests']}回, 429 {api_stats['rate_limited']}回）")
     
-    # 3. Chroma DBを作成
-    create_vectorstore(chunks, chroma_db_path)
+    progress.update(stage="done")
     
     print("=" * 50)
     print("インデックス処理が完了しました！")
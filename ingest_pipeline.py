@@ -0,0 +1,112 @@
+"""
+境界付きキューでつないだストリーミング処理パイプライン
+"""
+import os
+import queue
+import threading
+from typing import Callable, Iterable, Iterator, List
+
+# 段と段の間のキューに溜められる要素数（メモリ使用量の上限を決める）
+PIPELINE_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "4"))
+# キュー操作の待ち時間（停止要求の確認間隔）
+_POLL_INTERVAL = 0.1
+
+# 終端を表すマーカー
+_END = object()
+
+
+class _StageError:
+    """段で発生した例外を下流に伝えるためのラッパー"""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def run_pipeline(source: Iterable, stages: List[Callable], queue_size: int = PIPELINE_QUEUE_SIZE) -> Iterator:
+    """
+    sourceの各要素をstagesの関数に順に通し、最終段の結果を順番にyieldする
+
+    sourceの読み出しと各段はそれぞれ専用スレッドで動き、段の間は
+    maxsize=queue_size のキューでつなぐ。下流が詰まると上流が待つため、
+    処理中の要素数は (段数 + 1) * queue_size を超えない。
+    いずれかの段で例外が発生した場合は、全スレッドを止めて呼び出し元で再送出する。
+
+    Args:
+        source: 入力要素のイテラブル（ジェネレータ可）
+        stages: 各段で要素に適用する関数のリスト
+        queue_size: 段の間のキューの大きさ
+
+    Yields:
+        最終段の結果（入力と同じ順序）
+    """
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+
+    def put(q: queue.Queue, item) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(q: queue.Queue):
+        while True:
+            try:
+                return q.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                if stop.is_set():
+                    return _END
+
+    def produce():
+        try:
+            for item in source:
+                if not put(queues[0], item):
+                    return
+            put(queues[0], _END)
+        except BaseException as e:
+            put(queues[0], _StageError(e))
+        finally:
+            # 途中で止めた場合もジェネレータ側の後始末（プロセスプールの終了など）を行う
+            close = getattr(source, "close", None)
+            if close:
+                close()
+
+    def work(func: Callable, in_queue: queue.Queue, out_queue: queue.Queue):
+        while True:
+            item = get(in_queue)
+            if item is _END or isinstance(item, _StageError):
+                put(out_queue, item)
+                return
+            try:
+                result = func(item)
+            except BaseException as e:
+                put(out_queue, _StageError(e))
+                return
+            if not put(out_queue, result):
+                return
+
+    threads = [threading.Thread(target=produce, name="pipeline-source", daemon=True)]
+    for i, func in enumerate(stages):
+        threads.append(threading.Thread(
+            target=work,
+            args=(func, queues[i], queues[i + 1]),
+            name=f"pipeline-stage-{i}",
+            daemon=True
+        ))
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = get(queues[-1])
+            if item is _END:
+                break
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
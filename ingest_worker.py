@@ -0,0 +1,262 @@
+"""
+バックグラウンドでインデックス処理を実行するワーカーと永続ジョブキュー
+"""
+import os
+import json
+import time
+import uuid
+import datetime
+import threading
+from typing import Dict, List, Optional
+
+from ingest import ingest
+
+# 定数定義
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+INGEST_JOBS_PATH = os.path.join(BASE_DIR, ".ingest_jobs.json")
+# 保持する完了済みジョブの件数
+MAX_FINISHED_JOBS = 20
+# 進捗をファイルに書き出す最小間隔（秒）
+PROGRESS_SAVE_INTERVAL = 0.5
+
+# ジョブの状態
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_ERROR = "error"
+
+
+def estimate_fraction(job: Dict) -> float:
+    """
+    ジョブの進み具合（0.0〜1.0）を推定
+
+    解析済みファイルの割合と、解析済みチャンクのうち書き込み済みの割合の積を
+    全体の進み具合とみなす（書き込みは解析の後を追うため）。
+
+    Args:
+        job: ジョブ情報
+
+    Returns:
+        進み具合
+    """
+    progress = job.get("progress") or {}
+    files_total = progress.get("files_total", 0)
+    if not files_total:
+        return 0.0
+    parsed_ratio = progress.get("files_parsed", 0) / files_total
+    # 重複として除外されたチャンクは書き込まれない
+    chunks_to_write = progress.get("chunks_parsed", 0) - progress.get("chunks_duplicate", 0)
+    written_ratio = progress.get("chunks_written", 0) / chunks_to_write if chunks_to_write > 0 else 0.0
+    return min(parsed_ratio * written_ratio, 1.0)
+
+
+def estimate_eta(job: Dict) -> Optional[float]:
+    """
+    ジョブの残り時間（秒）を経過時間と進み具合から推定
+
+    Args:
+        job: ジョブ情報
+
+    Returns:
+        残り秒数（推定できない場合はNone）
+    """
+    started_at = job.get("started_at")
+    if job.get("status") != JOB_RUNNING or not started_at:
+        return None
+    fraction = estimate_fraction(job)
+    if fraction <= 0:
+        return None
+    elapsed = time.time() - started_at
+    return elapsed * (1 - fraction) / fraction
+
+
+class IngestWorker:
+    """
+    インデックス処理ジョブを1件ずつ実行するバックグラウンドワーカー
+
+    ジョブはJSONファイルに保存されるため、ブラウザの再読み込みやStreamlitの
+    再実行の影響を受けない。プロセスが再起動した場合、実行中だったジョブは
+    キューに戻して再実行する。キューに待機中のジョブがある間に投入された
+    ジョブはそのジョブにまとめる（差分インデックスは最新のdocs/を見るため、
+    1回の実行で両方の変更が反映される）。
+    """
+
+    def __init__(self, jobs_path: str = INGEST_JOBS_PATH):
+        """
+        初期化
+
+        Args:
+            jobs_path: ジョブキューの保存先
+        """
+        self.jobs_path = jobs_path
+        self._cond = threading.Condition()
+        self._jobs: List[Dict] = self._load_jobs()
+        self._last_saved = 0.0
+
+        # 前回のプロセスで実行中だったジョブはキューに戻す
+        for job in self._jobs:
+            if job["status"] == JOB_RUNNING:
+                job["status"] = JOB_QUEUED
+                job["started_at"] = None
+        self._save_jobs()
+
+        self._thread = threading.Thread(target=self._run, name="ingest-worker", daemon=True)
+        self._thread.start()
+
+    # ==================== 永続化 ====================
+
+    def _load_jobs(self) -> List[Dict]:
+        if os.path.exists(self.jobs_path):
+            try:
+                with open(self.jobs_path, "r", encoding="utf-8") as f:
+                    return json.load(f)
+            except Exception as e:
+                print(f"ジョブファイル読み込みエラー: {e}")
+        return []
+
+    def _save_jobs(self):
+        """ジョブ一覧を保存（呼び出し側でロックを取得していること）"""
+        finished = [j for j in self._jobs if j["status"] in (JOB_DONE, JOB_ERROR)]
+        if len(finished) > MAX_FINISHED_JOBS:
+            drop = {j["id"] for j in finished[:-MAX_FINISHED_JOBS]}
+            self._jobs = [j for j in self._jobs if j["id"] not in drop]
+        try:
+            temp_path = f"{self.jobs_path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self._jobs, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.jobs_path)
+            self._last_saved = time.time()
+        except Exception as e:
+            print(f"ジョブファイル保存エラー: {e}")
+
+    # ==================== 公開API ====================
+
+    def submit(self, full_rebuild: bool = False) -> str:
+        """
+        インデックス処理ジョブを投入
+
+        待機中のジョブがあれば新しいジョブは作らずにまとめる。
+
+        Args:
+            full_rebuild: Trueの場合は全件再構築
+
+        Returns:
+            ジョブID
+        """
+        with self._cond:
+            for job in self._jobs:
+                if job["status"] == JOB_QUEUED:
+                    job["full_rebuild"] = job["full_rebuild"] or full_rebuild
+                    job["merged"] += 1
+                    self._save_jobs()
+                    return job["id"]
+
+            job = {
+                "id": uuid.uuid4().hex,
+                "status": JOB_QUEUED,
+                "full_rebuild": full_rebuild,
+                "merged": 1,
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "progress": {},
+                "error": None,
+            }
+            self._jobs.append(job)
+            self._save_jobs()
+            self._cond.notify_all()
+            return job["id"]
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        """ジョブ情報を取得"""
+        with self._cond:
+            for job in self._jobs:
+                if job["id"] == job_id:
+                    return dict(job)
+        return None
+
+    def latest_job(self) -> Optional[Dict]:
+        """実行中または待機中のジョブ、なければ最後に完了したジョブを取得"""
+        with self._cond:
+            for status in (JOB_RUNNING, JOB_QUEUED):
+                for job in self._jobs:
+                    if job["status"] == status:
+                        return dict(job)
+            return dict(self._jobs[-1]) if self._jobs else None
+
+    def is_busy(self) -> bool:
+        """実行中または待機中のジョブがあるか"""
+        with self._cond:
+            return any(j["status"] in (JOB_QUEUED, JOB_RUNNING) for j in self._jobs)
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Optional[Dict]:
+        """ジョブの完了を待つ（CLIやスクリプトからの利用向け）"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while True:
+                job = next((j for j in self._jobs if j["id"] == job_id), None)
+                if job is None or job["status"] in (JOB_DONE, JOB_ERROR):
+                    return dict(job) if job else None
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return dict(job)
+                self._cond.wait(remaining)
+
+    # ==================== ワーカー ====================
+
+    def _next_job(self) -> Dict:
+        with self._cond:
+            while True:
+                for job in self._jobs:
+                    if job["status"] == JOB_QUEUED:
+                        job["status"] = JOB_RUNNING
+                        job["started_at"] = time.time()
+                        job["progress"] = {}
+                        self._save_jobs()
+                        return job
+                self._cond.wait()
+
+    def _on_progress(self, job: Dict, progress: Dict):
+        with self._cond:
+            job["progress"] = progress
+            # 書き込み頻度を抑えつつ、完了時は必ず保存する
+            if time.time() - self._last_saved >= PROGRESS_SAVE_INTERVAL or progress.get("stage") == "done":
+                self._save_jobs()
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            print(f"インデックスジョブを開始します: {job['id']}（{job['merged']}件の要求）")
+            try:
+                ingest(
+                    full_rebuild=job["full_rebuild"],
+                    progress_callback=lambda progress, job=job: self._on_progress(job, progress)
+                )
+                status, error = JOB_DONE, None
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                status, error = JOB_ERROR, str(e)
+
+            with self._cond:
+                job["status"] = status
+                job["error"] = error
+                job["finished_at"] = time.time()
+                self._save_jobs()
+                self._cond.notify_all()
+            finished = datetime.datetime.fromtimestamp(job["finished_at"]).isoformat(timespec="seconds")
+            print(f"インデックスジョブが終了しました: {job['id']} - {status}（{finished}）")
+
+
+# グローバルインスタンス（Streamlitの再実行をまたいでプロセス内で共有）
+_ingest_worker = None
+_ingest_worker_lock = threading.Lock()
+
+
+def get_ingest_worker() -> IngestWorker:
+    """インデックスワーカーのシングルトンインスタンスを取得"""
+    global _ingest_worker
+    with _ingest_worker_lock:
+        if _ingest_worker is None:
+            _ingest_worker = IngestWorker()
+    return _ingest_worker
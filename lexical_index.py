@@ -0,0 +1,334 @@
+"""
+文字n-gramの転置インデックスによるキーワード検索（型番・文書名などの完全一致向け）
+"""
+import os
+import re
+import json
+import math
+import heapq
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple, Iterable
+
+try:
+    from langchain_core.documents import Document
+except ImportError:
+    from langchain.schema import Document
+
+from metadata_filter import parse_filters, to_sqlite_where
+
+# 定数定義
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LEXICAL_INDEX_PATH = os.path.join(BASE_DIR, ".lexical_index.sqlite")
+# キーワード検索を使うか（"0"で無効）
+LEXICAL_INDEX_ENABLED = os.getenv("LEXICAL_INDEX_ENABLED", "1") != "0"
+# インデックスするn-gramの長さ（日本語向けに2文字・3文字）
+NGRAM_SIZES = (2, 3)
+# 質問がこの範囲の長さで、質問全体が最上位のチャンク（またはファイル名）にそのまま含まれ、
+# BM25のスコアが2位のCONFIDENT_MARGIN倍以上ある場合はキーワード検索だけで回答する
+MIN_CONFIDENT_CHARS = 3
+MAX_CONFIDENT_CHARS = 40
+CONFIDENT_MARGIN = 1.5
+# BM25のパラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Reciprocal Rank Fusionの定数
+RRF_K = 60
+
+# n-gramを作る文字の並び（記号・句読点・空白で区切る。型番の「-」「.」は含める）
+_RUN_RE = re.compile(r"[\w][\w\-.]*")
+# ひらがなだけのn-gram（検索の手がかりにならないため除く）
+_HIRAGANA_RE = re.compile(r"[ぁ-ゟ]+")
+
+
+def _runs(text: str) -> List[str]:
+    """NFKC・小文字化したテキストを、記号・空白で区切った文字の並びに分ける"""
+    normalized = unicodedata.normalize("NFKC", text).lower()
+    return [run.rstrip("-.") for run in _RUN_RE.findall(normalized)]
+
+
+def ngrams(text: str) -> Counter:
+    """
+    テキストの文字n-gramと出現回数
+
+    ひらがなだけのn-gram（「して」「ます」など）は検索の手がかりにならないため除く。
+    n-gramより短い並び（1文字の漢字・英単語など）はそのまま使う。
+    """
+    counts = Counter()
+    for run in _runs(text):
+        if len(run) < NGRAM_SIZES[0]:
+            if run:
+                counts[run] += 1
+            continue
+        for n in NGRAM_SIZES:
+            counts.update(run[i:i + n] for i in range(len(run) - n + 1))
+    for gram in [gram for gram in counts if _HIRAGANA_RE.fullmatch(gram)]:
+        del counts[gram]
+    return counts
+
+
+def _match_text(text: str) -> str:
+    """完全一致の判定用に正規化したテキスト"""
+    return " ".join(_runs(text))
+
+
+def _contains_phrase(phrase: str, text: str) -> bool:
+    """正規化したphraseがtextに英数字の途中で切れずに含まれるか（「ab-100」は「ab-1000」に一致しない）"""
+    return re.search(rf"(?<![a-z0-9]){re.escape(phrase)}(?![a-z0-9])", text) is not None
+
+
+def _indexed_text(content: str, metadata: Dict) -> str:
+    """インデックスするテキスト（文書名で引けるよう、ファイル名をチャンクの前に付ける）"""
+    source = metadata.get("source")
+    title = Path(source).stem if isinstance(source, str) else ""
+    return f"{title}\n{content}"
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[str]], k: int = RRF_K) -> List[Tuple[str, float]]:
+    """
+    複数の検索結果の順位を統合（Reciprocal Rank Fusion）
+
+    Args:
+        rankings: 検索方法ごとの、キーを順位の高い順に並べたリスト
+        k: 順位の差をならす定数
+
+    Returns:
+        (キー, 統合スコア)のリスト（スコアの高い順）
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, 1):
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class LexicalIndex:
+    """
+    チャンクの文字n-gramの転置インデックス（SQLite）
+
+    インデックス処理ではベクトルストアと同じチャンクを登録・削除し、検索では
+    質問のn-gramのポスティングだけを読んでBM25でスコアを付ける（よく現れるn-gramは
+    IDFで重みが小さくなる）。型番のような珍しい文字列の検索はサブミリ秒で終わる。
+    """
+
+    def __init__(self, path: str = LEXICAL_INDEX_PATH):
+        """
+        初期化
+
+        Args:
+            path: 転置インデックスの保存先
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+        self._inode = None
+        self._data_version = None
+        self._stats: Tuple[int, float] = (0, 0.0)
+        self._open()
+
+    def _open(self):
+        if self._conn is not None:
+            self._conn.close()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " id INTEGER PRIMARY KEY, chunk_id TEXT NOT NULL UNIQUE, source TEXT,"
+            " length INTEGER NOT NULL, content TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            " gram TEXT NOT NULL, chunk INTEGER NOT NULL, tf INTEGER NOT NULL,"
+            " PRIMARY KEY (gram, chunk)) WITHOUT ROWID"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS grams (gram TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID"
+        )
+        self._conn.commit()
+        self._inode = os.stat(self.path).st_ino
+        self._data_version = None
+
+    def close(self):
+        """接続を閉じる"""
+        with self._lock:
+            self._conn.close()
+
+    # ==================== 登録・削除 ====================
+
+    def _remove_rows(self, rows: List[Tuple[int, str, str]]):
+        """(id, content, metadata)の行とそのポスティングを削除（ロック取得済みであること）"""
+        for row_id, content, metadata in rows:
+            grams = list(ngrams(_indexed_text(content, json.loads(metadata))))
+            self._conn.executemany("DELETE FROM postings WHERE gram = ? AND chunk = ?",
+                                   [(gram, row_id) for gram in grams])
+            self._conn.executemany("UPDATE grams SET df = df - 1 WHERE gram = ?", [(gram,) for gram in grams])
+            self._conn.execute("DELETE FROM chunks WHERE id = ?", (row_id,))
+        if rows:
+            self._conn.execute("DELETE FROM grams WHERE df <= 0")
+
+    def add_chunks(self, chunks: List[Document], ids: List[str]):
+        """
+        チャンクを登録（同じチャンクIDの登録済みチャンクは置き換える）
+
+        Args:
+            chunks: チャンク
+            ids: チャンクID
+        """
+        with self._lock:
+            placeholders = ",".join("?" * len(ids))
+            if ids:
+                self._remove_rows(self._conn.execute(
+                    f"SELECT id, content, metadata FROM chunks WHERE chunk_id IN ({placeholders})", ids
+                ).fetchall())
+            # 文書頻度はバッチ内で集計してからまとめて更新する
+            postings, df = [], Counter()
+            for chunk, chunk_id in zip(chunks, ids):
+                counts = ngrams(_indexed_text(chunk.page_content, chunk.metadata))
+                cursor = self._conn.execute(
+                    "INSERT INTO chunks (chunk_id, source, length, content, metadata) VALUES (?, ?, ?, ?, ?)",
+                    (chunk_id, chunk.metadata.get("source"), sum(counts.values()), chunk.page_content,
+                     json.dumps(chunk.metadata, ensure_ascii=False, default=str))
+                )
+                postings.extend((gram, cursor.lastrowid, tf) for gram, tf in counts.items())
+                df.update(counts.keys())
+            self._conn.executemany("INSERT INTO postings (gram, chunk, tf) VALUES (?, ?, ?)", sorted(postings))
+            self._conn.executemany(
+                "INSERT INTO grams (gram, df) VALUES (?, ?) ON CONFLICT(gram) DO UPDATE SET df = df + excluded.df",
+                df.items()
+            )
+            self._conn.commit()
+            self._data_version = None
+
+    def delete(self, ids: List[str]) -> int:
+        """
+        チャンクIDを指定して削除
+
+        Returns:
+            削除したチャンク数
+        """
+        if not ids:
+            return 0
+        with self._lock:
+            placeholders = ",".join("?" * len(ids))
+            rows = self._conn.execute(
+                f"SELECT id, content, metadata FROM chunks WHERE chunk_id IN ({placeholders})", ids
+            ).fetchall()
+            self._remove_rows(rows)
+            self._conn.commit()
+            self._data_version = None
+        return len(rows)
+
+    def delete_by_source(self, source: str) -> int:
+        """
+        メタデータのsourceが一致するチャンクを削除
+
+        Returns:
+            削除したチャンク数
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, content, metadata FROM chunks WHERE source = ?", (source,)
+            ).fetchall()
+            self._remove_rows(rows)
+            self._conn.commit()
+            self._data_version = None
+        return len(rows)
+
+    # ==================== 検索 ====================
+
+    def _refresh(self):
+        """インデックスの置き換え・他プロセスの更新を反映（ロック取得済みであること）"""
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            inode = None
+        if inode != self._inode:
+            # 全件再構築でファイルが置き換えられた
+            self._open()
+        data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM chunks").fetchone()
+            self._stats = (count, total / count if count else 0.0)
+            self._data_version = data_version
+
+    def search(self, query: str, k: int = 4, filter: Optional[Dict] = None) -> Tuple[List[Dict], bool]:
+        """
+        n-gramのBM25でチャンクを検索
+
+        Args:
+            query: 検索クエリ
+            k: 取得する件数
+            filter: メタデータのフィルタ（metadata_filterの形式）。一致するチャンクだけを採点する
+
+        Returns:
+            (chunk_id, content, metadata, score を持つ辞書のリスト, 確信度が高いか)のタプル。
+            確信度が高いのは、短いクエリ全体が最上位のチャンク（またはファイル名）に
+            そのまま含まれ、スコアが2位を大きく上回る場合で、ベクトル検索を省略してよい
+        """
+        grams = list(ngrams(query))
+        if not grams:
+            return [], False
+        where, params = to_sqlite_where(parse_filters(filter), "c.metadata")
+
+        with self._lock:
+            self._refresh()
+            count, average_length = self._stats
+            if count == 0:
+                return [], False
+
+            placeholders = ",".join("?" * len(grams))
+            usable = self._conn.execute(
+                f"SELECT gram, df FROM grams WHERE gram IN ({placeholders})", grams
+            ).fetchall()
+
+            scores: Dict[int, float] = {}
+            for gram, df in usable:
+                idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+                for row_id, tf, length in self._conn.execute(
+                    "SELECT p.chunk, p.tf, c.length FROM postings p JOIN chunks c ON c.id = p.chunk"
+                    f" WHERE p.gram = ? AND {where}",
+                    (gram, *params)
+                ):
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                    scores[row_id] = scores.get(row_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            hits = []
+            for row_id, score in top:
+                chunk_id, content, metadata = self._conn.execute(
+                    "SELECT chunk_id, content, metadata FROM chunks WHERE id = ?", (row_id,)
+                ).fetchone()
+                hits.append({"chunk_id": chunk_id, "content": content,
+                             "metadata": json.loads(metadata), "score": score})
+
+        return hits, self._is_confident(_match_text(query), hits)
+
+    @staticmethod
+    def _is_confident(query_text: str, hits: List[Dict]) -> bool:
+        """最上位のヒットだけでベクトル検索を省略してよいか（質問全体の完全一致と2位とのスコア差）"""
+        if not hits or not MIN_CONFIDENT_CHARS <= len(query_text) <= MAX_CONFIDENT_CHARS:
+            return False
+        if not _contains_phrase(query_text, _match_text(_indexed_text(hits[0]["content"], hits[0]["metadata"]))):
+            return False
+        return len(hits) == 1 or hits[0]["score"] >= CONFIDENT_MARGIN * hits[1]["score"]
+
+    def stats(self) -> Dict:
+        """登録チャンク数とn-gramの種類数を取得"""
+        with self._lock:
+            self._refresh()
+            grams = self._conn.execute("SELECT COUNT(*) FROM grams").fetchone()[0]
+            return {"chunks": self._stats[0], "grams": grams}
+
+
+def open_lexical_index(path: str = LEXICAL_INDEX_PATH) -> Optional[LexicalIndex]:
+    """検索用にキーワード検索インデックスを開く（無効・未作成の場合はNone）"""
+    if not LEXICAL_INDEX_ENABLED or not os.path.exists(path):
+        return None
+    try:
+        return LexicalIndex(path)
+    except sqlite3.Error as e:
+        print(f"キーワード検索インデックスの読み込みエラー: {e}")
+        return None
@@ -0,0 +1,140 @@
+"""
+検索のメタデータフィルタ（ベクトルストア・キーワード検索ごとの条件式への変換）
+
+フィルタの形式:
+    {"filename": "料金表2025.pdf"}                       # 一致
+    {"file_type": {"$in": ["pdf", "md"]}, "page": {"$gte": 3, "$lte": 10}}
+    {"indexed_at": {"$gte": "2025-01-01"}}              # インデックス処理した日時の範囲
+"""
+import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# フィルタに使えるメタデータ（ingest.pyのload_file()が保存するもの）と値の型
+STRING_FIELDS = ("filename", "file_type")
+NUMBER_FIELDS = ("page", "indexed_at")
+FILTER_FIELDS = STRING_FIELDS + NUMBER_FIELDS
+# indexed_at（ISO形式の文字列）の代わりに比較する数値のメタデータ（UNIX時刻）
+# Chroma DBの範囲比較は数値しか扱えないため、ingest.pyが両方を保存する
+INDEXED_AT_TS_FIELD = "indexed_at_ts"
+
+EQUALITY_OPERATORS = ("$eq", "$ne")
+SET_OPERATORS = ("$in", "$nin")
+RANGE_OPERATORS = ("$gt", "$gte", "$lt", "$lte")
+OPERATORS = EQUALITY_OPERATORS + SET_OPERATORS + RANGE_OPERATORS
+
+# 条件 (メタデータのキー, 演算子, 値)
+Condition = Tuple[str, str, Any]
+
+_SQL_OPERATORS = {"$eq": "=", "$ne": "IS NOT", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def _to_timestamp(value) -> float:
+    """indexed_atの比較値（ISO形式の文字列・date・datetime）をUNIX時刻に変換"""
+    if isinstance(value, str):
+        try:
+            value = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"indexed_atの日時の形式が正しくありません: {value}")
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time()).timestamp()
+    raise ValueError(f"indexed_atには日時を指定してください: {value!r}")
+
+
+def _normalize_value(field: str, value):
+    """比較値をメタデータの保存形式に合わせる"""
+    if field == "indexed_at":
+        return _to_timestamp(value)
+    if field == "page":
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError(f"pageには整数を指定してください: {value!r}")
+        return value
+    if not isinstance(value, str):
+        raise ValueError(f"{field}には文字列を指定してください: {value!r}")
+    if field == "file_type":
+        return value.lower().lstrip(".")
+    return value
+
+
+def parse_filters(filters: Optional[Dict]) -> List[Condition]:
+    """
+    フィルタを検証して条件のリストに変換（すべての条件をANDで結合する）
+
+    Args:
+        filters: フィルタ（{メタデータ名: 値 または {演算子: 値}}）
+
+    Returns:
+        (メタデータのキー, 演算子, 値)のリスト。indexed_atはindexed_at_tsの数値比較になる
+
+    Raises:
+        ValueError: 未対応のメタデータ名・演算子・値の場合
+    """
+    conditions = []
+    for field, spec in (filters or {}).items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"未対応のフィルタです: {field}（使用可能: {', '.join(FILTER_FIELDS)}）")
+        operations = spec.items() if isinstance(spec, dict) else [("$eq", spec)]
+        for operator, value in operations:
+            if operator not in OPERATORS:
+                raise ValueError(f"未対応の演算子です: {operator}")
+            if operator in RANGE_OPERATORS and field in STRING_FIELDS:
+                raise ValueError(f"{field}には範囲の条件を指定できません: {operator}")
+            if field == "indexed_at" and operator not in RANGE_OPERATORS:
+                raise ValueError(f"indexed_atには範囲の条件（$gt/$gte/$lt/$lte）を指定してください: {operator}")
+            if operator in SET_OPERATORS:
+                if not isinstance(value, (list, tuple, set)) or not value:
+                    raise ValueError(f"{operator}には空でないリストを指定してください")
+                value = [_normalize_value(field, v) for v in value]
+            else:
+                value = _normalize_value(field, value)
+            key = INDEXED_AT_TS_FIELD if field == "indexed_at" else field
+            conditions.append((key, operator, value))
+    return conditions
+
+
+def _combine(clauses: List[Dict]) -> Optional[Dict]:
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def to_pgvector_filter(conditions: List[Condition]) -> Optional[Dict]:
+    """
+    PGVector（langchain_postgres）のfilter引数に変換
+
+    文字列の一致は $in に変換する（cmetadata->>'キー' IN (...) のSQLになり、
+    式インデックスで絞り込める）。
+    """
+    clauses = []
+    for key, operator, value in conditions:
+        if operator == "$eq" and isinstance(value, str):
+            operator, value = "$in", [value]
+        clauses.append({key: {operator: value}})
+    return _combine(clauses)
+
+
+def to_chroma_where(conditions: List[Condition]) -> Optional[Dict]:
+    """Chroma DBのwhere句に変換"""
+    return _combine([{key: {operator: value}} for key, operator, value in conditions])
+
+
+def to_sqlite_where(conditions: List[Condition], column: str = "metadata") -> Tuple[str, List]:
+    """
+    JSON文字列のメタデータ列に対するSQLiteのWHERE句に変換
+
+    Returns:
+        (条件式, パラメータ)のタプル
+    """
+    clauses, params = [], []
+    for key, operator, value in conditions:
+        expression = f"json_extract({column}, '$.{key}')"
+        if operator in SET_OPERATORS:
+            placeholders = ",".join("?" * len(value))
+            negate = "NOT " if operator == "$nin" else ""
+            clauses.append(f"{expression} {negate}IN ({placeholders})")
+            params.extend(value)
+        else:
+            clauses.append(f"{expression} {_SQL_OPERATORS[operator]} ?")
+            params.append(value)
+    return " AND ".join(clauses) or "1", params
@@ -0,0 +1,61 @@
+"""
+Maximal Marginal Relevance（MMR）による検索結果の多様化（NumPyの行列演算）
+"""
+import os
+from typing import List
+
+import numpy as np
+
+# 定数定義
+# 検索時にMMRで多様化するか（RAGSystem.search()のmmr引数の既定値）
+MMR_ENABLED = os.getenv("MMR_ENABLED", "0") == "1"
+# MMRの候補として取得する件数
+MMR_FETCH_K = int(os.getenv("MMR_FETCH_K", "20"))
+# 関連度と多様性の重み（1.0で関連度のみ、0.0で多様性のみ）
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.5"))
+
+
+def _norms(vectors: np.ndarray) -> np.ndarray:
+    """行ごとのノルム（0は1に置き換える）"""
+    norms = np.sqrt(np.einsum("...i,...i->...", vectors, vectors))
+    norms[norms == 0] = 1.0
+    return norms
+
+
+def mmr_select(query: np.ndarray, candidates: np.ndarray, k: int, lambda_mult: float = MMR_LAMBDA) -> List[int]:
+    """
+    候補からMMRでk件を選ぶ
+
+    1件選ぶたびに、選んだ候補と全候補のコサイン類似度を1回の行列ベクトル積で求め、
+    各候補の「選択済みとの最大類似度」を更新する（候補同士の類似度行列や
+    正規化した候補の行列は作らず、内積をノルムで割る）。
+
+    Args:
+        query: クエリのEmbedding（次元数 d）
+        candidates: 候補のEmbeddingの行列（候補数 x d）
+        k: 選ぶ件数
+        lambda_mult: 関連度と多様性の重み
+
+    Returns:
+        選んだ候補の行番号（選んだ順）
+    """
+    m = len(candidates)
+    k = min(k, m)
+    if k <= 0:
+        return []
+    candidates = np.asarray(candidates, dtype=np.float32)
+    query = np.asarray(query, dtype=np.float32)
+    norms = _norms(candidates)
+
+    relevance = (candidates @ query) / (norms * _norms(query[None])[0])
+    max_similarity = np.full(m, -np.inf, dtype=np.float32)
+    scores = relevance.copy()
+    selected = []
+    for _ in range(k):
+        index = int(np.argmax(scores))
+        selected.append(index)
+        similarity = (candidates @ candidates[index]) / (norms * norms[index])
+        np.maximum(max_similarity, similarity, out=max_similarity)
+        scores = lambda_mult * relevance - (1.0 - lambda_mult) * max_similarity
+        scores[selected] = -np.inf
+    return selected
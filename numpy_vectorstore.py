@@ -0,0 +1,595 @@
+"""
+NumPyによるインプロセスのベクトルストア（Embeddingをメモリマップした行列で保持）
+
+numpy_db/versions/<id>/
+├ state.json          # 行数・次元・削除済みの行など（アトミックに置き換える）
+├ vectors.<gen>.bin   # 正規化済みEmbeddingの行列（float32/float16、行優先で連続）
+├ docs.<gen>.jsonl    # 行ごとのチャンクID・テキスト・メタデータ
+└ offsets.<gen>.bin   # docs.<gen>.jsonl の各行の終了位置（int64）
+
+バージョンの切り替えはChroma DBと同じくindex_versionsで行う。
+"""
+import os
+import json
+import threading
+from typing import List, Dict, Optional, Tuple, Iterator
+
+import numpy as np
+try:
+    from langchain_core.documents import Document
+except ImportError:
+    from langchain.schema import Document
+
+from metadata_filter import parse_filters, STRING_FIELDS, INDEXED_AT_TS_FIELD
+
+# 定数定義
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+NUMPY_DB_PATH = os.path.abspath(os.getenv("NUMPY_DB_PATH", os.path.join(BASE_DIR, "numpy_db")))
+# Embeddingの保存形式（"float32" または "float16"。float16はサイズが半分になるが、
+# 検索時にfloat32へ変換するため検索は遅くなる）
+NUMPY_VECTOR_DTYPE = os.getenv("NUMPY_VECTOR_DTYPE", "float32")
+# 検索時に一度に内積を計算する行数
+SEARCH_BLOCK_ROWS = 16384
+# float16の場合にfloat32へ変換する行数（CPUキャッシュに収まる大きさ）
+HALF_BLOCK_ROWS = 256
+# 複数クエリをまとめて検索する場合に一度に内積を計算する行数（行数 x クエリ数のスコア行列を作る）
+BATCH_BLOCK_ROWS = 4096
+# 削除済みの行がこの割合を超えたらファイルを詰め直す
+COMPACT_RATIO = 0.3
+# 保存形式のバージョン
+STATE_FORMAT = 1
+STATE_FILENAME = "state.json"
+SUPPORTED_DTYPES = ("float32", "float16")
+
+
+class NumpyVectorStore:
+    """
+    正規化済みEmbeddingの連続した行列に対して、内積とargpartitionでtop-kを求める
+
+    書き込みは行の追記で行い、upsert・削除された行は削除済みとして記録する
+    （削除済みが増えたらファイルを詰め直す）。行数などの状態はstate.jsonに
+    書いてから置き換えるため、読み手は常に書き込み完了済みの行だけを見る。
+    別プロセスの書き込みは、検索のたびにstate.jsonの更新を確認して取り込む。
+
+    ingest.py / rag.py からはPGVector・Chromaと同じように
+    add_embeddings() / delete() / similarity_search_with_score() で使う。
+    """
+
+    def __init__(self, persist_directory: str, embedding_function=None, dtype: str = NUMPY_VECTOR_DTYPE):
+        """
+        初期化
+
+        Args:
+            persist_directory: 保存先ディレクトリ
+            embedding_function: クエリのEmbeddingに使うモデル（embed_queryを持つもの）
+            dtype: 新規作成時のEmbeddingの保存形式（既存のストアは作成時の形式を使う）
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"未対応のEmbeddingの保存形式です: {dtype}")
+        self.persist_directory = persist_directory
+        self.embedding_function = embedding_function
+        self._default_dtype = dtype
+        self._lock = threading.RLock()
+        self._signature = None
+        self._state: Dict = {}
+        self._vectors: Optional[np.memmap] = None
+        self._offsets: Optional[np.memmap] = None
+        self._deleted = np.zeros(0, dtype=bool)
+        # チャンクID → 行番号（書き込み時に初めて読み込む）
+        self._id_rows: Optional[Dict[str, int]] = None
+        # フィルタ用のメタデータの列（フィルタつきの検索で初めて読み込み、追記分だけ読み足す）
+        self._columns: Optional[Dict] = None
+        os.makedirs(persist_directory, exist_ok=True)
+        self._refresh()
+
+    # ==================== 状態の読み込み ====================
+
+    def _path(self, kind: str, generation: Optional[int] = None) -> str:
+        generation = self._state["generation"] if generation is None else generation
+        suffix = {"vectors": "bin", "docs": "jsonl", "offsets": "bin"}[kind]
+        return os.path.join(self.persist_directory, f"{kind}.{generation}.{suffix}")
+
+    def _state_path(self) -> str:
+        return os.path.join(self.persist_directory, STATE_FILENAME)
+
+    def _new_state(self) -> Dict:
+        return {"format": STATE_FORMAT, "generation": 0, "dim": None,
+                "dtype": self._default_dtype, "rows": 0, "deleted": []}
+
+    def _refresh(self):
+        """state.jsonが更新されていれば読み込み直す（呼び出し側でロックを取得していること）"""
+        try:
+            st = os.stat(self._state_path())
+            signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except FileNotFoundError:
+            signature = None
+        if signature == self._signature and self._state:
+            return
+
+        state = self._new_state()
+        if signature is not None:
+            with open(self._state_path(), "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("format") != STATE_FORMAT:
+                raise ValueError(f"未対応のベクトルストアの形式です: {state.get('format')}")
+        self._open(state)
+        self._signature = signature
+        # 別プロセスが書き込んだ可能性があるため、チャンクIDの対応は読み込み直す
+        self._id_rows = None
+
+    def _open(self, state: Dict):
+        """状態に対応するファイルをメモリマップで開く"""
+        self._state = state
+        rows, dim = state["rows"], state["dim"]
+        if rows and dim:
+            self._vectors = np.memmap(self._path("vectors"), dtype=state["dtype"], mode="r", shape=(rows, dim))
+            self._offsets = np.memmap(self._path("offsets"), dtype=np.int64, mode="r", shape=(rows,))
+        else:
+            self._vectors, self._offsets = None, None
+        self._deleted = np.zeros(rows, dtype=bool)
+        if state["deleted"]:
+            self._deleted[state["deleted"]] = True
+
+    def _write_state(self, state: Dict):
+        """状態を一時ファイルに書いてから置き換え、自分の表示も更新"""
+        temp_path = f"{self._state_path()}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self._state_path())
+        st = os.stat(self._state_path())
+        self._open(state)
+        self._signature = (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _iter_records(self) -> Iterator[Tuple[int, Dict]]:
+        """書き込み完了済みの全行の(行番号, {"id", "text", "metadata"})"""
+        rows = self._state["rows"]
+        if not rows:
+            return
+        with open(self._path("docs"), "rb") as f:
+            for row in range(rows):
+                yield row, json.loads(f.readline())
+
+    def _get_id_rows(self) -> Dict[str, int]:
+        """有効な行のチャンクID → 行番号"""
+        if self._id_rows is None:
+            self._id_rows = {
+                record["id"]: row for row, record in self._iter_records() if not self._deleted[row]
+            }
+        return self._id_rows
+
+    def _read_records(self, rows: List[int]) -> List[Dict]:
+        """指定した行のチャンクを読み込む（サイドファイルの該当範囲だけを読む）"""
+        records = []
+        with open(self._path("docs"), "rb") as f:
+            for row in rows:
+                start = int(self._offsets[row - 1]) if row > 0 else 0
+                f.seek(start)
+                records.append(json.loads(f.read(int(self._offsets[row]) - start)))
+        return records
+
+    # ==================== 書き込み ====================
+
+    @staticmethod
+    def _normalize(vectors) -> np.ndarray:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if matrix.ndim == 1:
+            matrix = matrix[None, :]
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _committed_sizes(self, state: Dict) -> Tuple[int, int]:
+        """書き込み完了済みの(Embeddingファイル, サイドファイル)のバイト数"""
+        rows = state["rows"]
+        if not rows:
+            return 0, 0
+        with open(self._path("offsets", state["generation"]), "rb") as f:
+            f.seek((rows - 1) * 8)
+            docs_bytes = int(np.frombuffer(f.read(8), dtype=np.int64)[0])
+        return rows * state["dim"] * np.dtype(state["dtype"]).itemsize, docs_bytes
+
+    def _append(self, state: Dict, vectors: np.ndarray, records: List[Dict]):
+        """行をファイルに追記（途中で失敗した書き込みの残りは切り詰めてから書く）"""
+        vector_bytes, docs_bytes = self._committed_sizes(state)
+        lines = [json.dumps(record, ensure_ascii=False, default=str).encode("utf-8") + b"\n" for record in records]
+        offsets = docs_bytes + np.cumsum([len(line) for line in lines], dtype=np.int64)
+
+        for kind, committed, data in (
+            ("vectors", vector_bytes, vectors.astype(state["dtype"]).tobytes()),
+            ("docs", docs_bytes, b"".join(lines)),
+            ("offsets", state["rows"] * 8, offsets.tobytes()),
+        ):
+            path = self._path(kind, state["generation"])
+            with open(path, "ab") as f:
+                f.truncate(committed)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def add_embeddings(self, texts: List[str], embeddings: List[List[float]],
+                       metadatas: Optional[List[Dict]] = None, ids: Optional[List[str]] = None,
+                       **kwargs) -> List[str]:
+        """
+        計算済みのEmbeddingを保存（同じチャンクIDの行は置き換える）
+
+        Args:
+            texts: チャンクのテキスト
+            embeddings: textsに対応するEmbedding
+            metadatas: チャンクのメタデータ
+            ids: チャンクID
+
+        Returns:
+            保存したチャンクID
+        """
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [str(i) for i in range(len(texts))]
+        vectors = self._normalize(embeddings)
+
+        with self._lock:
+            self._refresh()
+            id_rows = self._get_id_rows()
+            state = dict(self._state)
+            if state["dim"] is None:
+                state["dim"] = int(vectors.shape[1])
+            elif state["dim"] != vectors.shape[1]:
+                raise ValueError(f"Embeddingの次元が一致しません: {vectors.shape[1]}（保存済み: {state['dim']}）")
+
+            # upsert: 既存の行は削除済みにして末尾に追記する（同じバッチ内の重複は最後を使う）
+            deleted = set(state["deleted"])
+            new_rows = {}
+            for i, chunk_id in enumerate(ids):
+                if chunk_id in id_rows:
+                    deleted.add(id_rows.pop(chunk_id))
+                if chunk_id in new_rows:
+                    deleted.add(state["rows"] + new_rows[chunk_id])
+                new_rows[chunk_id] = i
+
+            records = [{"id": chunk_id, "text": text, "metadata": metadata}
+                       for chunk_id, text, metadata in zip(ids, texts, metadatas)]
+            self._append(state, vectors, records)
+
+            for chunk_id, i in new_rows.items():
+                id_rows[chunk_id] = state["rows"] + i
+            state["rows"] += len(records)
+            state["deleted"] = sorted(deleted)
+            self._write_state(state)
+            self._id_rows = id_rows
+            self._compact_if_needed()
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs) -> bool:
+        """
+        チャンクIDを指定して削除
+
+        Args:
+            ids: 削除するチャンクID
+
+        Returns:
+            いずれかの行を削除した場合True
+        """
+        if not ids:
+            return False
+        with self._lock:
+            self._refresh()
+            id_rows = self._get_id_rows()
+            rows = [id_rows.pop(chunk_id) for chunk_id in ids if chunk_id in id_rows]
+            if not rows:
+                return False
+            # 詰め直しでチャンクIDの対応が作り直されるため、先に反映しておく
+            self._id_rows = id_rows
+            self._mark_deleted(rows)
+        return True
+
+    def delete_by_source(self, source: str) -> int:
+        """
+        メタデータのsourceが一致するチャンクを削除
+
+        Args:
+            source: load_file()がメタデータに書き込んだファイルパス
+
+        Returns:
+            削除したチャンク数
+        """
+        with self._lock:
+            self._refresh()
+            rows = [row for row, record in self._iter_records()
+                    if not self._deleted[row] and record["metadata"].get("source") == source]
+            if rows:
+                self._mark_deleted(rows)
+                self._id_rows = None
+        return len(rows)
+
+    def _mark_deleted(self, rows: List[int]):
+        state = dict(self._state)
+        state["deleted"] = sorted(set(state["deleted"]) | set(rows))
+        self._write_state(state)
+        self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        """削除済みの行が多ければ、有効な行だけを新しい世代のファイルに書き直す"""
+        state = self._state
+        if not state["rows"] or len(state["deleted"]) <= state["rows"] * COMPACT_RATIO:
+            return
+
+        live = np.flatnonzero(~self._deleted)
+        new_state = dict(state, generation=state["generation"] + 1, rows=0, deleted=[])
+        records = [record for row, record in self._iter_records() if not self._deleted[row]]
+        for start in range(0, len(live), SEARCH_BLOCK_ROWS):
+            block = live[start:start + SEARCH_BLOCK_ROWS]
+            self._append(new_state, np.asarray(self._vectors[block]), records[start:start + SEARCH_BLOCK_ROWS])
+            new_state["rows"] += len(block)
+
+        old_generation = state["generation"]
+        self._write_state(new_state)
+        self._id_rows = {record["id"]: row for row, record in enumerate(records)}
+        # 古い世代のファイルを削除（開いている読み手はメモリマップ経由で読み続けられる）
+        for kind in ("vectors", "docs", "offsets"):
+            try:
+                os.remove(self._path(kind, old_generation))
+            except OSError:
+                pass
+        print(f"ベクトルストアを詰め直しました: {len(live)}件（削除済み {state['rows'] - len(live)}件を除去）")
+
+    # ==================== 検索 ====================
+
+    def _snapshot(self, filter: Optional[Dict] = None):
+        """
+        検索に使う状態を取得
+
+        Returns:
+            (Embeddingの行列, 削除済みの行, 状態, フィルタに一致する有効な行番号（フィルタなしはNone）)
+        """
+        conditions = parse_filters(filter)
+        with self._lock:
+            self._refresh()
+            rows = None
+            if conditions and self._vectors is not None:
+                rows = np.flatnonzero(self._filter_mask(conditions) & ~self._deleted)
+            return self._vectors, self._deleted, self._state, rows
+
+    def _load_columns(self) -> Dict:
+        """
+        フィルタ用のメタデータの列を読み込む（呼び出し側でロックを取得していること）
+
+        文字列は語彙の番号（なしは-1）、数値はfloat64（なしはNaN）の配列で持つ。
+        同じ世代に追記された行だけを読み足す。
+        """
+        state = self._state
+        columns = self._columns
+        if columns is None or columns["generation"] != state["generation"] or columns["rows"] > state["rows"]:
+            columns = {"generation": state["generation"], "rows": 0, "vocab": {key: {} for key in STRING_FIELDS},
+                       "values": {key: np.zeros(0) for key in STRING_FIELDS + ("page", INDEXED_AT_TS_FIELD)}}
+            self._columns = columns
+        start, rows = columns["rows"], state["rows"]
+        if start >= rows:
+            return columns
+
+        new_values = {key: [] for key in columns["values"]}
+        with open(self._path("docs"), "rb") as f:
+            f.seek(int(self._offsets[start - 1]) if start > 0 else 0)
+            for _ in range(start, rows):
+                metadata = json.loads(f.readline())["metadata"]
+                for key in STRING_FIELDS:
+                    value = metadata.get(key)
+                    vocab = columns["vocab"][key]
+                    new_values[key].append(-1 if value is None else vocab.setdefault(value, len(vocab)))
+                for key in ("page", INDEXED_AT_TS_FIELD):
+                    value = metadata.get(key)
+                    new_values[key].append(np.nan if value is None else value)
+        for key, values in new_values.items():
+            dtype = np.int32 if key in STRING_FIELDS else np.float64
+            columns["values"][key] = np.concatenate([columns["values"][key].astype(dtype), np.array(values, dtype=dtype)])
+        columns["rows"] = rows
+        return columns
+
+    def _filter_mask(self, conditions: List) -> np.ndarray:
+        """条件にすべて一致する行のマスク（呼び出し側でロックを取得していること）"""
+        columns = self._load_columns()
+        mask = np.ones(self._state["rows"], dtype=bool)
+        for key, operator, value in conditions:
+            column = columns["values"][key]
+            if key in STRING_FIELDS:
+                # 文字列は語彙の番号で比較する（語彙にない値はどの行にも一致しない）
+                vocab = columns["vocab"][key]
+                value = [vocab.get(v, -2) for v in value] if isinstance(value, list) else vocab.get(value, -2)
+            if operator == "$eq":
+                match = column == value
+            elif operator == "$ne":
+                match = column != value
+            elif operator in ("$in", "$nin"):
+                match = np.isin(column, value)
+                if operator == "$nin":
+                    match = ~match
+            else:
+                with np.errstate(invalid="ignore"):
+                    match = {"$gt": np.greater, "$gte": np.greater_equal,
+                             "$lt": np.less, "$lte": np.less_equal}[operator](column, value)
+            mask &= match
+        return mask
+
+    def _top_k(self, vectors: np.ndarray, deleted: np.ndarray, query: np.ndarray, k: int,
+               rows: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        内積の上位k行を(行番号, コサイン類似度)の降順で返す
+
+        rowsを指定した場合は、その行（フィルタに一致する有効な行）だけの内積を計算する。
+        """
+        n = vectors.shape[0] if rows is None else len(rows)
+        scores = np.empty(n, dtype=np.float32)
+        convert = vectors.dtype != np.float32
+        block_rows = HALF_BLOCK_ROWS if convert else SEARCH_BLOCK_ROWS
+        for start in range(0, n, block_rows):
+            block = vectors[start:start + block_rows] if rows is None else vectors[rows[start:start + block_rows]]
+            if convert:
+                block = block.astype(np.float32)
+            np.dot(block, query, out=scores[start:start + len(block)])
+        if rows is None:
+            scores[deleted] = -np.inf
+            k = min(k, n - int(deleted.sum()))
+        else:
+            k = min(k, n)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(row if rows is None else rows[row]), float(scores[row])) for row in top]
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict] = None, **kwargs) -> List[Tuple[Document, float]]:
+        """
+        Embeddingで類似チャンクを検索
+
+        Args:
+            embedding: クエリのEmbedding
+            k: 取得する件数
+            filter: メタデータのフィルタ（metadata_filterの形式）。一致する行だけの内積を計算する
+
+        Returns:
+            (Document, 距離)のリスト。距離は 1 - コサイン類似度（小さいほど類似）
+        """
+        return [(doc, distance) for doc, distance, _ in self._search_by_vector(embedding, k, filter)]
+
+    def similarity_search_with_vectors(self, embedding: List[float], k: int = 4,
+                                       filter: Optional[Dict] = None) -> List[Tuple[Document, float, np.ndarray]]:
+        """
+        similarity_search_by_vector_with_score()と同じ検索で、各チャンクのEmbedding
+        （正規化済み、float32）も返す（MMRなど候補同士の類似度を計算する処理用）
+
+        Returns:
+            (Document, 距離, Embedding)のリスト
+        """
+        return self._search_by_vector(embedding, k, filter, with_vectors=True)
+
+    def _search_by_vector(self, embedding: List[float], k: int, filter: Optional[Dict] = None,
+                          with_vectors: bool = False) -> List[Tuple[Document, float, Optional[np.ndarray]]]:
+        """Embeddingで類似チャンクを検索（with_vectors=Trueの場合は行のEmbeddingも取り出す）"""
+        vectors, deleted, state, rows = self._snapshot(filter)
+        if vectors is None:
+            return []
+        query = self._normalize(embedding)[0]
+        if query.shape[0] != vectors.shape[1]:
+            raise ValueError(f"Embeddingの次元が一致しません: {query.shape[0]}（保存済み: {vectors.shape[1]}）")
+
+        top = self._top_k(vectors, deleted, query, k, rows)
+        with self._lock:
+            self._refresh()
+            if self._state["generation"] != state["generation"]:
+                # 検索中に（別プロセスで）詰め直された場合は行番号が変わるため検索し直す
+                return self._search_by_vector(embedding, k, filter, with_vectors)
+            records = self._read_records([row for row, _ in top])
+        if with_vectors:
+            row_vectors = vectors[[row for row, _ in top]].astype(np.float32)
+        else:
+            row_vectors = [None] * len(top)
+        return [
+            (Document(page_content=record["text"], metadata=record["metadata"]), 1.0 - score, vector)
+            for record, (_, score), vector in zip(records, top, row_vectors)
+        ]
+
+    def _top_k_many(self, vectors: np.ndarray, deleted: np.ndarray, queries: np.ndarray,
+                    k: int, rows: Optional[np.ndarray] = None) -> List[List[Tuple[int, float]]]:
+        """
+        複数クエリの内積の上位k行をまとめて求める
+
+        行列を1回だけ走査し、ブロックごとに (行数 x クエリ数) のスコアを行列積で計算して
+        クエリごとの上位k件の候補と統合する。rowsを指定した場合はその行だけを走査する。
+
+        Returns:
+            クエリごとの(行番号, コサイン類似度)の降順のリスト
+        """
+        n = vectors.shape[0] if rows is None else len(rows)
+        m = queries.shape[0]
+        k = min(k, n - int(deleted.sum())) if rows is None else min(k, n)
+        if k <= 0:
+            return [[] for _ in range(m)]
+
+        best_scores = np.empty((m, 0), dtype=np.float32)
+        best_rows = np.empty((m, 0), dtype=np.int64)
+        for start in range(0, n, BATCH_BLOCK_ROWS):
+            if rows is None:
+                block = vectors[start:start + BATCH_BLOCK_ROWS]
+            else:
+                block = vectors[rows[start:start + BATCH_BLOCK_ROWS]]
+            if block.dtype != np.float32:
+                block = block.astype(np.float32)
+            scores = queries @ block.T
+            if rows is None:
+                scores[:, deleted[start:start + len(block)]] = -np.inf
+
+            block_k = min(k, scores.shape[1])
+            top = np.argpartition(-scores, block_k - 1, axis=1)[:, :block_k]
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            best_rows = np.concatenate([best_rows, top + start], axis=1)
+            if best_scores.shape[1] > k:
+                keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        if rows is not None:
+            best_rows = rows[best_rows]
+        return [
+            [(int(row), float(score)) for row, score in zip(row_ids, scores) if score != -np.inf]
+            for row_ids, scores in zip(best_rows, best_scores)
+        ]
+
+    def similarity_search_by_vectors_with_score(self, embeddings: List[List[float]], k: int = 4,
+                                                filter: Optional[Dict] = None) -> List[List[Tuple[Document, float]]]:
+        """
+        複数のEmbeddingでまとめて類似チャンクを検索（評価などの一括処理用）
+
+        Args:
+            embeddings: クエリのEmbeddingのリスト
+            k: クエリごとに取得する件数
+            filter: メタデータのフィルタ（metadata_filterの形式）
+
+        Returns:
+            クエリごとの(Document, 距離)のリスト（入力と同じ順）
+        """
+        if not embeddings:
+            return []
+        vectors, deleted, state, rows = self._snapshot(filter)
+        if vectors is None:
+            return [[] for _ in embeddings]
+        queries = self._normalize(embeddings)
+        if queries.shape[1] != vectors.shape[1]:
+            raise ValueError(f"Embeddingの次元が一致しません: {queries.shape[1]}（保存済み: {vectors.shape[1]}）")
+
+        tops = self._top_k_many(vectors, deleted, queries, k, rows)
+        rows = sorted({row for top in tops for row, _ in top})
+        with self._lock:
+            self._refresh()
+            if self._state["generation"] != state["generation"]:
+                # 検索中に（別プロセスで）詰め直された場合は行番号が変わるため検索し直す
+                return self.similarity_search_by_vectors_with_score(embeddings, k, filter)
+            records = dict(zip(rows, self._read_records(rows)))
+        return [
+            [
+                (Document(page_content=records[row]["text"], metadata=records[row]["metadata"]), 1.0 - score)
+                for row, score in top
+            ]
+            for top in tops
+        ]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Dict] = None,
+                                     **kwargs) -> List[Tuple[Document, float]]:
+        """クエリ文字列で類似チャンクを検索（(Document, 距離)のリスト）"""
+        if self.embedding_function is None:
+            raise ValueError("embedding_functionが設定されていません")
+        return self.similarity_search_by_vector_with_score(self.embedding_function.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict] = None, **kwargs) -> List[Document]:
+        """クエリ文字列で類似チャンクを検索（Documentのリスト）"""
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def count(self) -> int:
+        """有効なチャンク数"""
+        with self._lock:
+            self._refresh()
+            return int(self._state["rows"] - len(self._state["deleted"]))
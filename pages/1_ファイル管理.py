@@ -2,9 +2,12 @@
 ファイル管理画面
 """
 import os
+import time
+import hashlib
 import streamlit as st
 from pathlib import Path
-from ingest import ingest
+from ingest import delete_from_index, get_indexed_hash, compute_file_hash
+from ingest_worker import get_ingest_worker, estimate_eta, estimate_fraction, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_ERROR
 
 # 定数定義
 import os
@@ -19,6 +22,15 @@ st.set_page_config(
     layout="wide"
 )
 
+# 進捗表示の更新間隔（秒）
+PROGRESS_POLL_INTERVAL = 1.0
+# アップロードを書き込む1ブロックのバイト数
+UPLOAD_BLOCK_SIZE = 1024 * 1024
+
+# upload_file()の結果
+UPLOAD_SAVED = "saved"
+UPLOAD_UNCHANGED = "unchanged"
+
 # セッション状態の初期化
 if "indexing_status" not in st.session_state:
     st.session_state.indexing_status = "未実行"
@@ -85,24 +97,109 @@ def delete_file(filename: str):
         return False
 
 
+def hash_uploaded_file(uploaded_file) -> str:
+    """アップロードされたファイルのSHA-256ハッシュをブロック単位で計算（ディスクには書き込まない）"""
+    sha256 = hashlib.sha256()
+    uploaded_file.seek(0)
+    for block in iter(lambda: uploaded_file.read(UPLOAD_BLOCK_SIZE), b""):
+        sha256.update(block)
+    uploaded_file.seek(0)
+    return sha256.hexdigest()
+
+
+def _hash_file_on_disk(file_path: Path):
+    """docs/にあるファイルのハッシュ（読めない場合はNone）"""
+    try:
+        return compute_file_hash(file_path)
+    except OSError:
+        return None
+
+
 def upload_file(uploaded_file):
-    """ファイルをアップロードして保存"""
+    """
+    ファイルをアップロードして保存
+    
+    一時ファイルにブロック単位で書き込みながらハッシュを計算し、書き込み完了後に
+    既存ファイルとアトミックに置き換える（書き込み途中のファイルをインデックス
+    処理が読むことはない）。インデックス済みの内容とdocs/にあるファイルの内容が
+    どちらもアップロードと同じ場合は、書き込みとインデックス処理を省略する。
+    
+    Returns:
+        UPLOAD_SAVED（保存した）、UPLOAD_UNCHANGED（インデックス済み・保存済みと同じ内容）、
+        失敗した場合はNone
+    """
     ensure_docs_dir()
     file_path = Path(DOCS_DIR) / uploaded_file.name
+    indexed_hash = get_indexed_hash(uploaded_file.name)
     
-    # 既存ファイルの場合は上書き
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+    # 同じサイズのファイルがインデックス済みなら、書き込む前にハッシュだけ比較する
+    # （ディスク上のファイルがインデックス後に更新されている場合があるため、
+    # インデックス済みの内容とディスク上の内容の両方が一致する場合だけ省略する）
+    if (indexed_hash and file_path.is_file()
+            and file_path.stat().st_size == uploaded_file.size
+            and hash_uploaded_file(uploaded_file) == indexed_hash
+            and _hash_file_on_disk(file_path) == indexed_hash):
+        print(f"内容が変わっていないためスキップしました: {uploaded_file.name}")
+        return UPLOAD_UNCHANGED
     
-    return True
+    # 一時ファイル名は対応拡張子で終わらないため、インデックス処理の対象にならない
+    temp_path = Path(DOCS_DIR) / f".{uploaded_file.name}.{os.getpid()}.upload"
+    try:
+        sha256 = hashlib.sha256()
+        uploaded_file.seek(0)
+        with open(temp_path, "wb") as f:
+            for block in iter(lambda: uploaded_file.read(UPLOAD_BLOCK_SIZE), b""):
+                sha256.update(block)
+                f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+        
+        # 既存ファイルの場合は上書き
+        os.replace(temp_path, file_path)
+    except Exception as e:
+        print(f"アップロードエラー: {uploaded_file.name} - {e}")
+        try:
+            temp_path.unlink()
+        except OSError:
+            pass
+        return None
+    
+    # docs/から消えていたインデックス済みファイルを戻しただけなら、インデックス処理は不要
+    if sha256.hexdigest() == indexed_hash:
+        return UPLOAD_UNCHANGED
+    return UPLOAD_SAVED
+
+
+def remove_from_index(filename: str):
+    """
+    削除したファイルのチャンクだけをインデックスから削除
+    
+    インデックスジョブの実行中・待機中は、そのジョブの後に差分インデックスを
+    投入して削除を反映する（ジョブと同時にマニフェストを書き換えないため）。
+    削除したチャンクを重複として参照していたファイルがあれば、それらを保存し直す
+    差分インデックスをバックグラウンドで実行する（画面の処理を止めない）。
+    """
+    try:
+        if get_ingest_worker().is_busy():
+            return run_ingest()
+        _, dependents = delete_from_index(filename)
+        if dependents:
+            return run_ingest()
+        return True
+    except Exception as e:
+        st.error(f"インデックスからの削除エラー: {e}")
+        return False
 
 
-def run_ingest():
-    """インデックス処理を実行"""
+def run_ingest(full_rebuild: bool = False):
+    """
+    インデックス処理をバックグラウンドワーカーに投入（通常は変更ファイルのみの差分インデックス）
+    
+    待機中のジョブがある場合はそのジョブにまとめられる。
+    """
     try:
-        with st.spinner("インデックス処理を実行中..."):
-            ingest()
-            st.session_state.indexing_status = "完了"
+        get_ingest_worker().submit(full_rebuild=full_rebuild)
+        st.session_state.indexing_status = "実行中"
         return True
     except Exception as e:
         st.error(f"インデックス処理エラー: {e}")
@@ -110,6 +207,73 @@ def run_ingest():
         return False
 
 
+def format_seconds(seconds: float) -> str:
+    """秒数を「X分Y秒」形式に変換"""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}秒"
+    return f"{seconds // 60}分{seconds % 60}秒"
+
+
+def render_ingest_progress():
+    """最新のインデックスジョブの状態と進捗を表示"""
+    job = get_ingest_worker().latest_job()
+    progress = (job or {}).get("progress") or {}
+    if job is None:
+        pass
+    elif job["status"] == JOB_QUEUED:
+        st.session_state.indexing_status = "待機中"
+    elif job["status"] == JOB_RUNNING:
+        st.session_state.indexing_status = "実行中"
+    elif job["status"] == JOB_DONE:
+        st.session_state.indexing_status = "完了"
+    elif job["status"] == JOB_ERROR:
+        st.session_state.indexing_status = f"エラー: {job['error']}"
+    
+    status_color = "🟢" if st.session_state.indexing_status == "完了" else "🟡" if "エラー" not in st.session_state.indexing_status else "🔴"
+    st.write(f"**状態**: {status_color} {st.session_state.indexing_status}")
+    
+    if job is None:
+        return
+    if job["status"] == JOB_QUEUED:
+        st.info(f"⏳ インデックス処理の順番を待っています（{job['merged']}件の要求をまとめて実行します）")
+    elif job["status"] == JOB_RUNNING:
+        files_total = progress.get("files_total", 0)
+        files_parsed = progress.get("files_parsed", 0)
+        chunks_parsed = progress.get("chunks_parsed", 0)
+        chunks_duplicate = progress.get("chunks_duplicate", 0)
+        chunks_to_write = chunks_parsed - chunks_duplicate
+        chunks_written = progress.get("chunks_written", 0)
+        
+        st.progress(estimate_fraction(job), text="インデックス処理を実行中...")
+        
+        eta = estimate_eta(job)
+        st.caption(
+            f"📄 解析済みファイル: {files_parsed} / {files_total}　"
+            f"♻️ 重複として除外: {chunks_duplicate} チャンク　"
+            f"🧮 Embedding済み: {progress.get('chunks_embedded', 0)} / {chunks_to_write} チャンク　"
+            f"💾 書き込み済み: {chunks_written} / {chunks_to_write} チャンク　"
+            f"⏱️ 残り時間（推定）: {format_seconds(eta) if eta is not None else '計算中'}"
+        )
+    elif job["status"] == JOB_DONE:
+        elapsed = (job["finished_at"] or 0) - (job["started_at"] or 0)
+        st.caption(f"✓ 前回のインデックス処理: 完了（{format_seconds(elapsed)}、"
+                   f"{progress.get('chunks_written', 0)} チャンク書き込み）")
+
+
+def render_ingest_progress_live():
+    """ジョブの実行中は一定間隔で進捗表示を更新する"""
+    if hasattr(st, "fragment"):
+        # Streamlit 1.37以降: フラグメントだけを定期的に再実行する
+        @st.fragment(run_every=PROGRESS_POLL_INTERVAL)
+        def _progress_fragment():
+            render_ingest_progress()
+        _progress_fragment()
+    else:
+        # 古いStreamlitではページの最後でページ全体を再実行する（ページ末尾を参照）
+        render_ingest_progress()
+
+
 # ==================== メイン画面 ====================
 st.title("📁 ファイル管理")
 
@@ -170,14 +334,18 @@ if uploaded_files:
     with col2:
         if st.button("アップロード", type="primary", use_container_width=True):
             success_count = 0
+            saved_count = 0
             error_files = []
             
             with st.spinner("アップロード中..."):
                 for uploaded_file in uploaded_files:
-                    if upload_file(uploaded_file):
-                        success_count += 1
-                    else:
+                    result = upload_file(uploaded_file)
+                    if result is None:
                         error_files.append(uploaded_file.name)
+                        continue
+                    success_count += 1
+                    if result == UPLOAD_SAVED:
+                        saved_count += 1
             
             # 結果を表示
             if success_count == len(uploaded_files):
@@ -186,9 +354,11 @@ if uploaded_files:
                 else:
                     st.success(f"✓ {success_count}件のファイルをアップロードしました")
                 
-                # インデックス処理を実行
-                if run_ingest():
-                    st.success("✓ インデックス処理が完了しました")
+                # 内容が変わったファイルがある場合だけ、インデックス処理をバックグラウンドで実行
+                if saved_count == 0:
+                    st.info("内容がインデックス済みのファイルと同じため、インデックス処理は不要です")
+                elif run_ingest():
+                    st.success("✓ インデックス処理を開始しました")
                 st.rerun()
             else:
                 if error_files:
@@ -239,9 +409,9 @@ else:
                     if st.button("はい", key=f"yes_{file_info['name']}", type="primary"):
                         if delete_file(file_info['name']):
                             st.success(f"✓ {file_info['name']} を削除しました")
-                            # インデックス処理を実行
-                            if run_ingest():
-                                st.success("✓ インデックス処理が完了しました")
+                            # このファイルのチャンクだけをインデックスから削除
+                            if remove_from_index(file_info['name']):
+                                st.success("✓ インデックスから削除しました")
                             # セッション状態をリセット
                             st.session_state[f"confirm_delete_{file_info['name']}"] = False
                             st.rerun()
@@ -262,16 +432,16 @@ st.subheader("🔧 インデックス管理")
 
 col1, col2 = st.columns([2, 1])
 
-with col1:
-    status_color = "🟢" if st.session_state.indexing_status == "完了" else "🟡" if "エラー" not in st.session_state.indexing_status else "🔴"
-    st.write(f"**状態**: {status_color} {st.session_state.indexing_status}")
-
 with col2:
     if st.button("🔄 手動で再インデックス", help="Chroma DBを再構築します", use_container_width=True):
-        if run_ingest():
-            st.success("✓ 再インデックスが完了しました")
+        if run_ingest(full_rebuild=True):
+            st.success("✓ 再インデックスを開始しました")
             st.rerun()
 
+with col1:
+    # 状態と進捗（ジョブ実行中は定期的に更新）
+    render_ingest_progress_live()
+
 # フッター情報
 st.divider()
 col1, col2, col3 = st.columns(3)
@@ -300,3 +470,8 @@ with st.sidebar:
     2. 自動的にインデックス処理が実行されます
     3. **RAG チャット**ページで質問を入力
     """)
+
+# フラグメント非対応のStreamlitでは、ジョブ実行中はページ全体を定期的に再実行して進捗を更新
+if not hasattr(st, "fragment") and get_ingest_worker().is_busy():
+    time.sleep(PROGRESS_POLL_INTERVAL)
+    st.rerun()
@@ -0,0 +1,218 @@
+"""
+PDFから抽出したページテキストの永続キャッシュ（ファイル内容のハッシュ＋パーサーのバージョンで管理）
+"""
+import os
+import json
+import zlib
+import hashlib
+import threading
+from typing import List, Dict, Optional, Tuple
+
+# 定数定義
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PARSE_CACHE_DIR = os.path.join(BASE_DIR, ".parse_cache")
+# 解析キャッシュを使うか（"0"で無効）
+PARSE_CACHE_ENABLED = os.getenv("PARSE_CACHE_ENABLED", "1") != "0"
+# キャッシュの最大サイズ（圧縮後のバイト数、MB単位）
+PARSE_CACHE_MAX_MB = int(os.getenv("PARSE_CACHE_MAX_MB", "256"))
+# 上限を超えた場合、この割合まで古いエントリを削除する
+EVICTION_TARGET_RATIO = 0.8
+# 保存形式のバージョン（形式を変えたら上げる）
+PARSE_CACHE_FORMAT = 1
+# エントリファイルの拡張子
+_ENTRY_SUFFIX = ".json.z"
+
+
+def _package_version(name: str) -> str:
+    try:
+        from importlib.metadata import version
+        return version(name)
+    except Exception:
+        return "unknown"
+
+
+def parser_version(file_type: str) -> str:
+    """
+    ファイル形式ごとのパーサーのバージョン文字列
+
+    パーサーのライブラリが更新されると値が変わり、古いキャッシュは使われなくなる。
+    """
+    if file_type == "pdf":
+        parser = f"PyPDFLoader/pypdf-{_package_version('pypdf')}"
+    else:
+        parser = f"TextLoader/{file_type}"
+    return f"{parser}/langchain-community-{_package_version('langchain-community')}/format-{PARSE_CACHE_FORMAT}"
+
+
+class ParseCache:
+    """
+    ファイル内容のハッシュをキーにした抽出済みページのディスクキャッシュ
+
+    1ファイルにつき1エントリを、ページごとの(テキスト, メタデータ)のJSONを
+    zlibで圧縮して保存する。書き込みは一時ファイルからの置き換えで行うため、
+    複数のワーカープロセスから同時に使ってよい。パーサーのバージョンが
+    変わったエントリは次に保存したときに削除され、サイズ上限を超えたら
+    最近使われていないエントリから削除する。
+    """
+
+    def __init__(self, cache_dir: str = PARSE_CACHE_DIR, max_bytes: int = PARSE_CACHE_MAX_MB * 1024 * 1024):
+        """
+        初期化
+
+        Args:
+            cache_dir: キャッシュの保存ディレクトリ
+            max_bytes: キャッシュの最大バイト数
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_dir(self, file_hash: str) -> str:
+        return os.path.join(self.cache_dir, file_hash[:2])
+
+    def _entry_path(self, file_hash: str, parser: str) -> str:
+        parser_hash = hashlib.sha256(parser.encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self._entry_dir(file_hash), f"{file_hash}.{parser_hash}{_ENTRY_SUFFIX}")
+
+    # ==================== 読み書き ====================
+
+    def get(self, file_hash: str, parser: str) -> Optional[List[Tuple[str, Dict]]]:
+        """
+        抽出済みのページを取得
+
+        Args:
+            file_hash: ファイル内容のハッシュ
+            parser: parser_version()の値
+
+        Returns:
+            ページごとの(テキスト, メタデータ)のリスト（キャッシュにない場合はNone）
+        """
+        path = self._entry_path(file_hash, parser)
+        try:
+            with open(path, "rb") as f:
+                entry = json.loads(zlib.decompress(f.read()).decode("utf-8"))
+            if entry.get("parser") != parser:
+                raise ValueError("parser mismatch")
+            os.utime(path)  # 最終利用時刻として更新時刻を使う
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except Exception as e:
+            print(f"解析キャッシュ読み込みエラー: {e}")
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return [(page["text"], page["metadata"]) for page in entry["pages"]]
+
+    def put(self, file_hash: str, parser: str, pages: List[Tuple[str, Dict]]):
+        """
+        抽出したページを保存（同じファイルの古いパーサーのエントリは削除）
+
+        Args:
+            file_hash: ファイル内容のハッシュ
+            parser: parser_version()の値
+            pages: ページごとの(テキスト, メタデータ)のリスト
+        """
+        entry = {
+            "parser": parser,
+            "pages": [{"text": text, "metadata": metadata} for text, metadata in pages],
+        }
+        data = zlib.compress(json.dumps(entry, ensure_ascii=False, default=str).encode("utf-8"))
+
+        path = self._entry_path(file_hash, parser)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except Exception as e:
+            print(f"解析キャッシュ保存エラー: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+
+        # パーサーのバージョンが変わる前のエントリを削除
+        entry_dir = self._entry_dir(file_hash)
+        for name in os.listdir(entry_dir):
+            if name.startswith(f"{file_hash}.") and name.endswith(_ENTRY_SUFFIX) \
+                    and os.path.join(entry_dir, name) != path:
+                try:
+                    os.remove(os.path.join(entry_dir, name))
+                except OSError:
+                    pass
+
+        self._evict_if_needed()
+
+    # ==================== 容量管理 ====================
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """(最終利用時刻, サイズ, パス)のリスト"""
+        entries = []
+        for sub in os.scandir(self.cache_dir):
+            if not sub.is_dir():
+                continue
+            for item in os.scandir(sub.path):
+                if item.name.endswith(_ENTRY_SUFFIX):
+                    try:
+                        st = item.stat()
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, item.path))
+        return entries
+
+    def _evict_if_needed(self):
+        """サイズ上限を超えていれば、最近使われていないエントリから削除"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * EVICTION_TARGET_RATIO)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        print(f"解析キャッシュを整理しました: {removed}件削除")
+
+    # ==================== 統計 ====================
+
+    def stats(self) -> Dict:
+        """ヒット数・ミス数・エントリ数・サイズを取得"""
+        entries = self._entries()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(entries),
+            "size_bytes": sum(size for _, size, _ in entries),
+        }
+
+
+# グローバルインスタンス（ワーカープロセスごとに作成される）
+_parse_cache = None
+_parse_cache_lock = threading.Lock()
+
+
+def get_parse_cache() -> ParseCache:
+    """解析キャッシュのシングルトンインスタンスを取得"""
+    global _parse_cache
+    with _parse_cache_lock:
+        if _parse_cache is None:
+            _parse_cache = ParseCache()
+    return _parse_cache
@@ -0,0 +1,144 @@
+"""
+Supabase（PostgreSQL）への接続プール（プロセス全体で1つのSQLAlchemyエンジンを共有）
+
+PGVectorに接続文字列を渡すとインスタンスごとにエンジン（接続プール）が作られるため、
+エンジンをここで1つだけ作り、すべてのセッション・インデックス処理で共有する。
+"""
+import os
+import threading
+from typing import Dict, Optional
+
+# 定数定義
+# 常に保持する接続数
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+# 混雑時にpool_sizeを超えて一時的に開く接続数
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+# 接続が空くまで待つ秒数（超えるとエラー）
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# この秒数より古い接続は作り直す（Supabaseのプーラーにアイドル接続を切られる前に）
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# 接続を貸し出す前に生存確認する（切断された接続でのエラーを防ぐ）
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+
+class _PoolUsage:
+    """貸し出し中の接続数のピークを記録（プールのイベントから更新）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked_out = 0
+        self.peak = 0
+        self.checkouts = 0
+
+    def on_checkout(self, *args):
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.peak = max(self.peak, self.checked_out)
+
+    def on_checkin(self, *args):
+        with self._lock:
+            self.checked_out = max(0, self.checked_out - 1)
+
+    def reset_peak(self):
+        """ピークを現在の貸し出し数に戻す（ウォームアップで借りた分を数えない）"""
+        with self._lock:
+            self.peak = self.checked_out
+
+
+# グローバルインスタンス（全セッションで共有）
+_engine = None
+_engine_url = None
+_engine_lock = threading.Lock()
+_usage = _PoolUsage()
+
+
+def get_engine(database_url: Optional[str] = None):
+    """
+    接続プール付きのSQLAlchemyエンジンのシングルトンを取得
+
+    Args:
+        database_url: 接続文字列（省略時は環境変数DATABASE_URL）
+
+    Returns:
+        SQLAlchemyのEngine（接続文字列がない場合はNone）。PGVectorのconnection引数に渡す
+    """
+    global _engine, _engine_url
+    database_url = database_url or os.getenv("DATABASE_URL")
+    if not database_url:
+        return None
+    with _engine_lock:
+        if _engine is None:
+            from sqlalchemy import create_engine, event
+
+            _engine = create_engine(
+                database_url,
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_timeout=DB_POOL_TIMEOUT,
+                pool_recycle=DB_POOL_RECYCLE,
+                pool_pre_ping=DB_POOL_PRE_PING,
+            )
+            event.listen(_engine, "checkout", _usage.on_checkout)
+            event.listen(_engine, "checkin", _usage.on_checkin)
+            _engine_url = database_url
+            print(f"🔌 DB接続プールを作成しました（常時 {DB_POOL_SIZE} / 最大 {DB_POOL_SIZE + DB_MAX_OVERFLOW}接続）")
+        elif database_url != _engine_url:
+            raise ValueError("DB接続プールは別の接続文字列で作成済みです")
+    return _engine
+
+
+def pool_stats() -> Optional[Dict]:
+    """
+    接続プールの利用状況
+
+    Returns:
+        size（常時保持する接続数）、max（上限）、checked_out（貸し出し中）、
+        checked_in（待機中）、overflow、peak（貸し出し中のピーク）、utilization（checked_out / max）、
+        checkouts（貸し出し回数）の辞書（エンジンが未作成の場合はNone）
+    """
+    if _engine is None:
+        return None
+    pool = _engine.pool
+    limit = DB_POOL_SIZE + DB_MAX_OVERFLOW
+    checked_out = pool.checkedout()
+    return {
+        "size": pool.size(),
+        "max": limit,
+        "checked_out": checked_out,
+        "checked_in": pool.checkedin(),
+        "overflow": max(0, pool.overflow()),
+        "peak": _usage.peak,
+        "checkouts": _usage.checkouts,
+        "utilization": checked_out / limit if limit else 0.0,
+    }
+
+
+def warm_pool(connections: Optional[int] = None) -> int:
+    """
+    接続プールに接続を先に開いておく（最初の検索で接続を確立する時間を省く）
+
+    接続を同時に借りて生存確認（SELECT 1）し、プールに返す。返した接続は
+    pool_sizeの数まで開いたまま保持される。
+
+    Args:
+        connections: 開く接続数（省略時・上限はDB_POOL_SIZE）
+
+    Returns:
+        開いた接続数（エンジンが未作成の場合は0）
+    """
+    if _engine is None:
+        return 0
+    from sqlalchemy import text
+
+    held = []
+    try:
+        for _ in range(min(connections or DB_POOL_SIZE, DB_POOL_SIZE)):
+            connection = _engine.connect()
+            held.append(connection)
+            connection.execute(text("SELECT 1"))
+    finally:
+        for connection in held:
+            connection.close()
+        _usage.reset_peak()
+    return len(held)
@@ -2,31 +2,33 @@
 RAG検索とLLM回答生成のロジック
 """
 import os
-from typing import List, Dict, Tuple, Optional
-try:
-    from langchain_postgres import PGVector
-except ImportError:
-    # フォールバック: Chroma DBを使用（ローカル開発用）
-    try:
-        from langchain_community.vectorstores import Chroma
-    except ImportError:
-        from langchain.vectorstores import Chroma
-    PGVector = None
-try:
-    from langchain_openai import OpenAIEmbeddings
-except ImportError:
-    # フォールバック: langchain_communityを使用
-    from langchain_community.embeddings import OpenAIEmbeddings
-try:
-    from langchain_text_splitters import RecursiveCharacterTextSplitter
-except ImportError:
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
+import time
+import asyncio
+import hashlib
+import threading
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Tuple, Optional, Iterator, Generator, TYPE_CHECKING
 try:
     from langchain_core.documents import Document
 except ImportError:
     from langchain.schema import Document
-from openai import OpenAI
+import numpy as np
 from dotenv import load_dotenv
+from embedding_cache import CachedEmbeddings
+import index_versions
+from chunk_dedup import lookup_references
+from answer_cache import get_answer_cache, IndexStateWatcher, ANSWER_CACHE_ENABLED
+from numpy_vectorstore import NumpyVectorStore, NUMPY_DB_PATH
+from lexical_index import open_lexical_index, reciprocal_rank_fusion, LEXICAL_INDEX_ENABLED
+from context_packer import build_context, count_tokens, CONTEXT_TOKEN_BUDGET
+from metadata_filter import parse_filters, to_pgvector_filter, to_chroma_where
+from mmr import mmr_select, MMR_ENABLED, MMR_FETCH_K, MMR_LAMBDA
+from pg_engine import get_engine, pool_stats, warm_pool
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
 load_dotenv()
 
@@ -34,11 +36,25 @@ load_dotenv()
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CHROMA_DB_PATH = os.path.join(BASE_DIR, "chroma_db")
 EMBEDDING_MODEL = "text-embedding-3-small"
+LLM_MODEL = "gpt-4o-mini"
 K_SEARCH_RESULTS = 4
+# ベクトル検索とキーワード検索を統合する場合、それぞれ k * この値 件の候補を取る
+HYBRID_CANDIDATE_FACTOR = 2
+# search_many() / query_many() でEmbeddingをまとめて計算・検索するクエリ数
+QUERY_BATCH_SIZE = int(os.getenv("QUERY_BATCH_SIZE", "256"))
+# query_many() で同時に実行する回答生成（OpenAI API呼び出し）の数
+QUERY_CONCURRENCY = int(os.getenv("QUERY_CONCURRENCY", "8"))
 COLLECTION_NAME = "rag_documents"
+# warm_up()でインデックスファイルを読む単位（バイト）
+TOUCH_CHUNK_BYTES = 1024 * 1024
+
+# ベクトルストアの選択（"auto": Supabase優先・フォールバックでChroma DB、"chroma"、"numpy"）
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "auto")
+# ローカルに保存する場合のバックエンド
+LOCAL_BACKEND = "numpy" if VECTOR_BACKEND == "numpy" else "chroma"
 
 # データベース設定（Supabase優先、フォールバックでChroma DB）
-USE_SUPABASE = bool(os.getenv("DATABASE_URL"))
+USE_SUPABASE = bool(os.getenv("DATABASE_URL")) and VECTOR_BACKEND == "auto"
 
 # プロンプトテンプレート
 PROMPT_TEMPLATE = """あなたは業務アシスタントです。
@@ -53,43 +69,96 @@ PROMPT_TEMPLATE = """あなたは業務アシスタントです。
 """
 
 
+def _answer_cache_key() -> str:
+    """回答キャッシュのキー（モデル・プロンプト・検索件数・参照情報の上限・MMRの設定が変われば別の回答として扱う）"""
+    settings = f"{LLM_MODEL}|{EMBEDDING_MODEL}|{K_SEARCH_RESULTS}|{CONTEXT_TOKEN_BUDGET}|{PROMPT_TEMPLATE}"
+    if MMR_ENABLED:
+        settings += f"|mmr:{MMR_FETCH_K}:{MMR_LAMBDA}"
+    return hashlib.sha256(settings.encode("utf-8")).hexdigest()[:16]
+
+
+def _get_pgvector_class():
+    """PGVectorクラスを取得（初回の使用時にimport、利用できない場合はNone）"""
+    try:
+        from langchain_postgres import PGVector
+    except ImportError:
+        # フォールバック: Chroma DBを使用（ローカル開発用）
+        PGVector = None
+    return PGVector
+
+
+def _get_openai_embeddings_class():
+    """OpenAIEmbeddingsクラスを取得（初回の使用時にimport）"""
+    try:
+        from langchain_openai import OpenAIEmbeddings
+    except ImportError:
+        # フォールバック: langchain_communityを使用
+        from langchain_community.embeddings import OpenAIEmbeddings
+    return OpenAIEmbeddings
+
+
 class RAGSystem:
     """RAG検索とLLM回答生成を管理するクラス"""
     
     def __init__(self):
         """初期化"""
-        # Embeddingモデルの初期化（OpenAI text-embedding-3-small）
-        self.embeddings = OpenAIEmbeddings(
-            model=EMBEDDING_MODEL
+        # Embeddingモデルの初期化（OpenAI text-embedding-3-small、永続キャッシュ経由）
+        self.embeddings = CachedEmbeddings(
+            _get_openai_embeddings_class()(model=EMBEDDING_MODEL),
+            EMBEDDING_MODEL
         )
         
-        # Chroma DBの初期化
+        # ベクトルストアの初期化
         self.vectorstore = None
+        self.backend = None
+        # 使用中のローカルのベクトルストアのバージョン（再構築後のホットリロード用）
+        self._store_root = NUMPY_DB_PATH if LOCAL_BACKEND == "numpy" else os.path.abspath(CHROMA_DB_PATH)
+        self._store_version = None
+        self._reload_lock = threading.Lock()
         self._load_vectorstore()
         
+        # キーワード検索（n-gramの転置インデックス）
+        self.lexical_index = None
+        # キーワード検索だけで回答し、Embeddingを省略した検索の数（複数セッションのスレッドから更新）
+        self.embedding_skipped = 0
+        self._stats_lock = threading.Lock()
+        
         # OpenAIクライアントの初期化（APIキーがある場合のみ）
         self.openai_client = None
         self._init_openai_client()
+        # 非同期APIのOpenAIクライアント（イベントループごとに1つ作り、接続プールを共有する）
+        self._async_openai_clients = weakref.WeakKeyDictionary()
+        
+        # 回答の意味的キャッシュ（インデックスの更新はマニフェストから検知）
+        self.answer_cache = get_answer_cache() if ANSWER_CACHE_ENABLED else None
+        self._index_state = IndexStateWatcher()
     
     def _load_vectorstore(self):
-        """ベクトルストアを読み込む（Supabase優先、フォールバックでChroma DB）"""
+        """ベクトルストアを読み込む（Supabase優先、フォールバックでローカルのChroma DBまたはNumPy）"""
         # Supabaseが利用可能な場合
-        if USE_SUPABASE and PGVector:
+        PGVector = _get_pgvector_class() if USE_SUPABASE else None
+        if PGVector:
             try:
-                database_url = os.getenv("DATABASE_URL")
-                if database_url:
+                # プロセス全体で共有する接続プール（セッションごとに接続を開かない）
+                engine = get_engine()
+                if engine is not None:
                     self.vectorstore = PGVector(
-                        connection=database_url,
+                        connection=engine,
                         embeddings=self.embeddings,  # embedding_functionではなくembeddings
                         collection_name=COLLECTION_NAME
                     )
+                    self.backend = "pgvector"
                     print("✅ Supabase + pgvectorを使用しています")
                     return
             except Exception as e:
                 print(f"Supabase接続エラー: {e}")
                 print("⚠️ Chroma DBにフォールバックします")
         
-        # フォールバック: Chroma DBを使用（ローカル開発用）
+        # フォールバック: ローカルのベクトルストアを使用
+        self._reload_local_store()
+    
+    def _get_chroma_class(self):
+        """Chromaクラスを取得（利用できない場合はNone）"""
         try:
             from langchain_community.vectorstores import Chroma
         except ImportError:
@@ -97,88 +166,571 @@ class RAGSystem:
                 from langchain.vectorstores import Chroma
             except ImportError:
                 Chroma = None
+        return Chroma
+    
+    def _open_chroma(self, Chroma, chroma_path: str):
+        """指定ディレクトリのChroma DBを開く（失敗した場合はNone）"""
+        try:
+            return Chroma(
+                persist_directory=chroma_path,
+                embedding_function=self.embeddings,
+                collection_name=COLLECTION_NAME
+            )
+        except Exception as e:
+            print(f"Chroma DBの読み込みエラー: {e}")
+            # コレクション名なしで再試行（後方互換性）
+            try:
+                vectorstore = Chroma(
+                    persist_directory=chroma_path,
+                    embedding_function=self.embeddings
+                )
+                print("✅ Chroma DBを使用しています（フォールバック）")
+                return vectorstore
+            except Exception as e2:
+                print(f"Chroma DBの読み込みエラー（フォールバック）: {e2}")
+                return None
+    
+    def _open_local_store(self, path: str):
+        """ローカルのベクトルストアを開く（失敗した場合はNone）"""
+        if LOCAL_BACKEND == "numpy":
+            try:
+                return NumpyVectorStore(path, embedding_function=self.embeddings)
+            except Exception as e:
+                print(f"NumPyベクトルストアの読み込みエラー: {e}")
+                return None
         
-        if Chroma:
-            chroma_path = os.path.abspath(CHROMA_DB_PATH)
-            if os.path.exists(chroma_path) and os.listdir(chroma_path):
-                try:
-                    self.vectorstore = Chroma(
-                        persist_directory=chroma_path,
-                        embedding_function=self.embeddings,
-                        collection_name=COLLECTION_NAME
-                    )
-                    print("✅ Chroma DBを使用しています（ローカル）")
-                except Exception as e:
-                    print(f"Chroma DBの読み込みエラー: {e}")
-                    # コレクション名なしで再試行（後方互換性）
-                    try:
-                        self.vectorstore = Chroma(
-                            persist_directory=chroma_path,
-                            embedding_function=self.embeddings
-                        )
-                        print("✅ Chroma DBを使用しています（フォールバック）")
-                    except Exception as e2:
-                        print(f"Chroma DBの読み込みエラー（フォールバック）: {e2}")
-                        self.vectorstore = None
-            else:
-                self.vectorstore = None
-        else:
-            self.vectorstore = None
+        Chroma = self._get_chroma_class()
+        if not Chroma:
+            return None
+        return self._open_chroma(Chroma, path)
+    
+    def _reload_local_store(self):
+        """
+        公開中のバージョンのローカルのベクトルストア（Chroma DB / NumPy）に切り替える
+        
+        インデックスの全件再構築は新しいバージョンに書き込んでから公開されるため、
+        新しいバージョンを開いてから差し替え、古いバージョンの参照を解放する。
+        古いバージョンは参照がなくなった時点で削除される。
+        """
+        with self._reload_lock:
+            version = index_versions.get_current_version(self._store_root)
+            if version is None or version == self._store_version:
+                return
+            
+            index_versions.acquire(self._store_root, version)
+            vectorstore = self._open_local_store(index_versions.version_path(self._store_root, version))
+            if vectorstore is None:
+                index_versions.release(self._store_root, version)
+                return
+            
+            old_version = self._store_version
+            self.vectorstore = vectorstore
+            self.backend = LOCAL_BACKEND
+            self._store_version = version
+            name = "NumPyベクトルストア" if LOCAL_BACKEND == "numpy" else "Chroma DB"
+            print(f"✅ {name}を使用しています（ローカル、バージョン: {version}）")
+        
+        if old_version is not None:
+            index_versions.release(self._store_root, old_version)
+    
+    def _maybe_reload(self):
+        """ローカルのベクトルストアの新しいバージョンが公開されていれば切り替える"""
+        if self.backend == "pgvector":
+            # Supabase使用時はバージョン切り替えの対象外
+            return
+        if index_versions.get_current_version(self._store_root) != self._store_version:
+            self._reload_local_store()
+    
+    def _checkout_vectorstore(self):
+        """
+        検索に使うベクトルストアを取得し、検索中に削除されないよう参照を取得
+        
+        Returns:
+            (ベクトルストア, バージョンID)のタプル。release_vectorstore()で解放すること
+        """
+        self._maybe_reload()
+        with self._reload_lock:
+            vectorstore, version = self.vectorstore, self._store_version
+            if version is not None:
+                index_versions.acquire(self._store_root, version)
+        return vectorstore, version
+    
+    def _release_vectorstore(self, version: Optional[str]):
+        """_checkout_vectorstore()で取得した参照を解放"""
+        if version is not None:
+            index_versions.release(self._store_root, version)
     
     def _init_openai_client(self):
         """OpenAIクライアントを初期化"""
         api_key = os.getenv("OPENAI_API_KEY")
         if api_key:
             try:
+                from openai import OpenAI
                 self.openai_client = OpenAI(api_key=api_key)
             except Exception as e:
                 print(f"OpenAIクライアントの初期化エラー: {e}")
                 self.openai_client = None
     
-    def search(self, query: str, k: int = K_SEARCH_RESULTS) -> List[Dict]:
+    def _get_async_openai_client(self) -> Optional["AsyncOpenAI"]:
+        """
+        実行中のイベントループ用の非同期OpenAIクライアントを取得（APIキーがない場合はNone）
+        
+        非同期の接続は作成したイベントループでしか使えないため、ループごとに
+        クライアントを作り、同じループの呼び出し同士で接続プールを共有する。
+        """
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            return None
+        loop = asyncio.get_running_loop()
+        with self._reload_lock:
+            client = self._async_openai_clients.get(loop)
+            if client is None:
+                try:
+                    from openai import AsyncOpenAI
+                    client = AsyncOpenAI(api_key=api_key)
+                except Exception as e:
+                    print(f"OpenAIクライアントの初期化エラー: {e}")
+                    return None
+                self._async_openai_clients[loop] = client
+        return client
+    
+    def warm_up(self, touch_index: bool = False) -> Dict:
+        """
+        最初の質問で行う準備を先に済ませる（起動直後のバックグラウンド処理用）
+        
+        Supabaseの接続プールの接続、キーワード検索インデックス、トークン数を数える
+        エンコーディングを開く。touch_index=Trueの場合は、ローカルのベクトルストアと
+        キーワード検索インデックスのファイルを読み、OSのページキャッシュに載せる。
+        
+        Args:
+            touch_index: インデックスファイルを先読みするか
+            
+        Returns:
+            準備ごとの所要秒数の辞書
+        """
+        timings = {}
+        
+        def run(name, fn):
+            started = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:
+                print(f"ウォームアップエラー（{name}）: {e}")
+            timings[name] = time.perf_counter() - started
+        
+        if self.backend == "pgvector":
+            run("db_pool", warm_pool)
+        run("lexical_index", self._get_lexical_index)
+        run("tokenizer", lambda: count_tokens(""))
+        if touch_index:
+            run("touch_index", self._touch_index_files)
+        return timings
+    
+    def _touch_index_files(self) -> int:
+        """
+        ローカルのインデックスファイルを読み捨ててページキャッシュに載せる
+        
+        Returns:
+            読んだバイト数
+        """
+        vectorstore, version = self._checkout_vectorstore()
+        try:
+            paths = []
+            if version is not None:
+                for dirpath, _, filenames in os.walk(index_versions.version_path(self._store_root, version)):
+                    paths.extend(os.path.join(dirpath, name) for name in filenames)
+            lexical_index = self._get_lexical_index()
+            if lexical_index is not None:
+                paths.append(lexical_index.path)
+            
+            total = 0
+            buffer = bytearray(TOUCH_CHUNK_BYTES)
+            for path in paths:
+                try:
+                    with open(path, "rb", buffering=0) as f:
+                        while True:
+                            size = f.readinto(buffer)
+                            if not size:
+                                break
+                            total += size
+                except OSError:
+                    # 読んでいる間に削除されたファイルは飛ばす
+                    continue
+            return total
+        finally:
+            self._release_vectorstore(version)
+    
+    def search(self, query: str, k: int = K_SEARCH_RESULTS, filters: Optional[Dict] = None,
+               mmr: Optional[bool] = None) -> List[Dict]:
         """
-        ベクトル検索を実行
+        ベクトル検索とキーワード検索を実行し、順位を統合（Reciprocal Rank Fusion）
+        
+        型番・文書名のようにクエリがそのまま含まれるチャンクがキーワード検索で
+        見つかった場合は、Embeddingの計算とベクトル検索を省略する。
         
         Args:
             query: 検索クエリ
             k: 取得する検索結果数
+            filters: メタデータのフィルタ（filename・file_type・page・indexed_at、
+                形式はmetadata_filterを参照）。ベクトルストアの検索条件として渡し、
+                一致するチャンクの中から上位k件を取る
+            mmr: ベクトル検索の結果をMMR（Maximal Marginal Relevance）で多様化するか
+                （Noneの場合は環境変数MMR_ENABLED）。MMR_FETCH_K件の候補から、
+                互いに似すぎないチャンクを選ぶ
+            
+        Returns:
+            検索結果のリスト（ファイル名、ページ番号、チャンク、ベクトル検索の距離（score）、
+            キーワード検索のスコア（lexical_score）、同じ内容を持つ他のファイルを含む）
             
+        Raises:
+            ValueError: フィルタの形式が正しくない場合
+        """
+        parse_filters(filters)
+        return self._search(query, k, self._search_lexical(query, k, filters), filters, mmr)
+    
+    async def asearch(self, query: str, k: int = K_SEARCH_RESULTS, filters: Optional[Dict] = None,
+                      mmr: Optional[bool] = None) -> List[Dict]:
+        """
+        search()の非同期版
+        
+        EmbeddingのAPI呼び出しは非同期で待ち、ベクトルストア・キーワード検索の
+        ディスク・DBアクセスはスレッドで実行してイベントループを塞がない。
+        """
+        parse_filters(filters)
+        lexical = await asyncio.to_thread(self._search_lexical, query, k, filters)
+        return await self._asearch(query, k, lexical, filters, mmr)
+    
+    async def _asearch(self, query: str, k: int, lexical: Tuple[List[Dict], bool],
+                       filters: Optional[Dict] = None, mmr: Optional[bool] = None) -> List[Dict]:
+        """asearch()の本体（キーワード検索の結果を受け取る）"""
+        if not lexical[1]:
+            await self._aembed_query(query)
+        return await asyncio.to_thread(self._search, query, k, lexical, filters, mmr)
+    
+    async def _aembed_query(self, query: str):
+        """
+        クエリのEmbeddingを非同期で計算してメモリキャッシュに載せる
+        
+        続くベクトル検索・回答キャッシュの参照（スレッドで実行）は、キャッシュから
+        Embeddingを取得するためAPIを呼ばない。
+        """
+        if self.vectorstore is None and self.answer_cache is None:
+            return None
+        try:
+            return await self.embeddings.aembed_query(query)
+        except Exception as e:
+            # 失敗した場合は検索時に同期APIで再計算される
+            print(f"Embedding取得エラー: {e}")
+            return None
+    
+    def _get_lexical_index(self):
+        """キーワード検索インデックスを取得（インデックス処理の後に作成された場合も開く）"""
+        if self.lexical_index is None and LEXICAL_INDEX_ENABLED:
+            with self._reload_lock:
+                if self.lexical_index is None:
+                    self.lexical_index = open_lexical_index()
+        return self.lexical_index
+    
+    def _search_lexical(self, query: str, k: int, filters: Optional[Dict] = None) -> Tuple[List[Dict], bool]:
+        """
+        キーワード検索を実行
+        
         Returns:
-            検索結果のリスト（ファイル名、ページ番号、チャンクを含む）
+            (ヒットのリスト, 確信度が高いか)のタプル（インデックスがない場合は空）
         """
-        if not self.vectorstore:
+        lexical_index = self._get_lexical_index()
+        if lexical_index is None:
+            return [], False
+        try:
+            return lexical_index.search(query, k=k * HYBRID_CANDIDATE_FACTOR, filter=filters)
+        except Exception as e:
+            print(f"キーワード検索エラー: {e}")
+            return [], False
+    
+    def _filter_kwargs(self, vectorstore, filters: Optional[Dict]) -> Dict:
+        """フィルタをベクトルストアの検索条件（filter引数）に変換"""
+        conditions = parse_filters(filters)
+        if not conditions:
+            return {}
+        if isinstance(vectorstore, NumpyVectorStore):
+            return {"filter": filters}
+        if self.backend == "pgvector":
+            # cmetadataに対するSQLのWHERE句になる
+            return {"filter": to_pgvector_filter(conditions)}
+        # Chroma DBのwhere句
+        return {"filter": to_chroma_where(conditions)}
+    
+    def _search(self, query: str, k: int, lexical: Tuple[List[Dict], bool],
+                filters: Optional[Dict] = None, mmr: Optional[bool] = None) -> List[Dict]:
+        """search()の本体（キーワード検索の結果を受け取る）"""
+        lexical_hits, confident = lexical
+        if confident:
+            return self._lexical_results(lexical_hits, k)
+        
+        vectorstore, version = self._checkout_vectorstore()
+        if not vectorstore and not lexical_hits:
+            self._release_vectorstore(version)
             return []
         
         try:
-            # ベクトル検索を実行
-            docs = self.vectorstore.similarity_search_with_score(query, k=k)
-            
-            results = []
-            for i, (doc, score) in enumerate(docs, 1):
-                # メタデータからファイル名とページ番号を取得
-                metadata = doc.metadata
-                source = metadata.get("source", "unknown")
-                page = metadata.get("page", None)
-                
-                # ファイル名のみを抽出（パスから）
-                if isinstance(source, str):
-                    filename = os.path.basename(source)
+            docs = []
+            if vectorstore:
+                # ベクトル検索を実行（統合する場合は候補を多めに取る）
+                vector_k = self._vector_k(k, lexical_hits)
+                filter_kwargs = self._filter_kwargs(vectorstore, filters)
+                if MMR_ENABLED if mmr is None else mmr:
+                    docs = self._mmr_search(vectorstore, query, vector_k, filter_kwargs)
                 else:
-                    filename = str(source)
-                
-                results.append({
-                    "index": i,
-                    "filename": filename,
-                    "page": page,
-                    "chunk": doc.page_content,
-                    "score": float(score),
-                    "source": source
-                })
+                    docs = vectorstore.similarity_search_with_score(query, k=vector_k, **filter_kwargs)
+            return self._merge_results(docs, lexical_hits, k)
+        except Exception as e:
+            print(f"検索エラー: {e}")
+            return []
+        finally:
+            self._release_vectorstore(version)
+    
+    def _mmr_search(self, vectorstore, query: str, k: int, filter_kwargs: Dict) -> List[Tuple[Document, float]]:
+        """
+        MMR_FETCH_K件の候補をベクトル検索で取り、MMRでk件を選ぶ（選んだ順）
+        
+        候補のEmbeddingはベクトルストアに保存済みのものを使い、Embedding APIは呼ばない
+        （NumPyベクトルストアは行列から、Chroma DBは検索結果に含めて取得する。Supabaseは
+        Embedding列を読んでPGVectorのMMRで選ぶ）。候補のEmbeddingを取得できない
+        ベクトルストアでは、通常の類似度順の上位k件を返す。
+        """
+        query_vector = self.embeddings.embed_query(query)
+        fetch_k = max(MMR_FETCH_K, k)
+        if isinstance(vectorstore, NumpyVectorStore):
+            candidates = vectorstore.similarity_search_with_vectors(query_vector, k=fetch_k, **filter_kwargs)
+        elif self.backend == "pgvector":
+            # 候補とそのEmbedding列を1回のSQLで取得してMMRを計算する
+            return vectorstore.max_marginal_relevance_search_with_score_by_vector(
+                query_vector, k=k, fetch_k=fetch_k, lambda_mult=MMR_LAMBDA, **filter_kwargs
+            )
+        else:
+            candidates = self._chroma_search_with_vectors(vectorstore, query_vector, fetch_k, filter_kwargs)
+            if candidates is None:
+                # クエリのEmbeddingはメモリキャッシュにあるためAPIは呼ばない
+                return vectorstore.similarity_search_with_score(query, k=k, **filter_kwargs)
+        
+        docs = [(doc, score) for doc, score, _ in candidates]
+        if len(docs) <= k:
+            return docs
+        candidate_vectors = np.array([vector for _, _, vector in candidates], dtype=np.float32)
+        return [docs[i] for i in mmr_select(np.asarray(query_vector), candidate_vectors, k, MMR_LAMBDA)]
+    
+    def _chroma_search_with_vectors(self, vectorstore, query_vector: List[float], k: int,
+                                    filter_kwargs: Dict) -> Optional[List[Tuple[Document, float, List[float]]]]:
+        """
+        Chroma DBのコレクションを直接検索し、保存済みのEmbeddingも取得
+        
+        Returns:
+            (Document, 距離, Embedding)のリスト（コレクションを検索できない場合はNone）
+        """
+        collection = getattr(vectorstore, "_collection", None)
+        if collection is None:
+            return None
+        result = collection.query(
+            query_embeddings=[query_vector],
+            n_results=k,
+            where=filter_kwargs.get("filter"),
+            include=["documents", "metadatas", "distances", "embeddings"],
+        )
+        return [
+            (Document(page_content=text, metadata=metadata or {}), distance, vector)
+            for text, metadata, distance, vector in zip(
+                result["documents"][0], result["metadatas"][0], result["distances"][0], result["embeddings"][0]
+            )
+        ]
+    
+    def _vector_k(self, k: int, lexical_hits: List[Dict]) -> int:
+        """ベクトル検索で取る件数（キーワード検索と統合する場合は候補を多めに取る）"""
+        return k * HYBRID_CANDIDATE_FACTOR if lexical_hits else k
+    
+    def _lexical_results(self, lexical_hits: List[Dict], k: int) -> List[Dict]:
+        """キーワード検索だけの検索結果（Embeddingとベクトル検索を省略）"""
+        with self._stats_lock:
+            self.embedding_skipped += 1
+        return self._build_results([
+            (Document(page_content=hit["content"], metadata=hit["metadata"]), None, hit["score"])
+            for hit in lexical_hits[:k]
+        ])
+    
+    def _merge_results(self, docs: List[Tuple[Document, float]], lexical_hits: List[Dict], k: int) -> List[Dict]:
+        """ベクトル検索の結果とキーワード検索の結果から検索結果を作成"""
+        if lexical_hits:
+            entries = self._fuse_results(docs, lexical_hits, k)
+        else:
+            entries = [(doc, score, None) for doc, score in docs]
+        return self._build_results(entries)
+    
+    def search_many(self, queries: List[str], k: int = K_SEARCH_RESULTS,
+                    batch_size: int = QUERY_BATCH_SIZE, filters: Optional[Dict] = None,
+                    mmr: Optional[bool] = None) -> Iterator[List[Dict]]:
+        """
+        複数のクエリをまとめて検索（評価などの一括処理用）
+        
+        batch_size件ずつ、クエリのEmbeddingを1回のAPI呼び出しで計算し、
+        NumPyベクトルストアでは全クエリを1回の行列積で検索する。
+        
+        Args:
+            queries: 検索クエリのリスト
+            k: クエリごとに取得する検索結果数
+            batch_size: まとめて処理するクエリ数
+            filters: 全クエリに共通するメタデータのフィルタ（search()と同じ）
+            mmr: ベクトル検索の結果をMMRで多様化するか（search()と同じ）
             
+        Yields:
+            クエリごとの検索結果のリスト（search()と同じ形式・同じ結果、入力と同じ順）
+        """
+        parse_filters(filters)
+        for start in range(0, len(queries), batch_size):
+            yield from self._search_batch(queries[start:start + batch_size], k, filters, mmr)
+    
+    def _search_batch(self, queries: List[str], k: int, filters: Optional[Dict] = None,
+                      mmr: Optional[bool] = None) -> List[List[Dict]]:
+        """search_many()の1バッチ分の検索"""
+        lexical = [self._search_lexical(query, k, filters) for query in queries]
+        results = [None] * len(queries)
+        pending = []
+        for i, (lexical_hits, confident) in enumerate(lexical):
+            if confident:
+                results[i] = self._lexical_results(lexical_hits, k)
+            else:
+                pending.append(i)
+        if not pending:
             return results
+        
+        vectorstore, version = self._checkout_vectorstore()
+        try:
+            docs_list = [[] for _ in pending]
+            if vectorstore and (MMR_ENABLED if mmr is None else mmr):
+                docs_list = self._mmr_search_many(
+                    vectorstore,
+                    [queries[i] for i in pending],
+                    [self._vector_k(k, lexical[i][0]) for i in pending],
+                    filters
+                )
+            elif vectorstore:
+                docs_list = self._vector_search_many(
+                    vectorstore,
+                    [queries[i] for i in pending],
+                    max(self._vector_k(k, lexical[i][0]) for i in pending),
+                    filters
+                )
         except Exception as e:
             print(f"検索エラー: {e}")
-            return []
+            docs_list = [[] for _ in pending]
+        finally:
+            self._release_vectorstore(version)
+        
+        for i, docs in zip(pending, docs_list):
+            lexical_hits = lexical[i][0]
+            try:
+                results[i] = self._merge_results(docs[:self._vector_k(k, lexical_hits)], lexical_hits, k)
+            except Exception as e:
+                print(f"検索エラー: {e}")
+                results[i] = []
+        return results
+    
+    def _vector_search_many(self, vectorstore, queries: List[str], k: int,
+                            filters: Optional[Dict] = None) -> List[List[Tuple[Document, float]]]:
+        """
+        複数クエリのベクトル検索
+        
+        Embeddingはまとめて計算してメモリキャッシュに載せるため、一括検索に対応していない
+        ベクトルストア（Supabase・Chroma DB）でクエリごとに検索してもAPIは呼ばない。
+        """
+        vectors = self.embeddings.embed_queries(queries)
+        filter_kwargs = self._filter_kwargs(vectorstore, filters)
+        if isinstance(vectorstore, NumpyVectorStore):
+            return vectorstore.similarity_search_by_vectors_with_score(vectors, k=k, **filter_kwargs)
+        return [vectorstore.similarity_search_with_score(query, k=k, **filter_kwargs) for query in queries]
+    
+    def _mmr_search_many(self, vectorstore, queries: List[str], ks: List[int],
+                         filters: Optional[Dict] = None) -> List[List[Tuple[Document, float]]]:
+        """
+        複数クエリのMMR検索（クエリごとにsearch()と同じ件数の候補からMMRで選ぶ）
+        
+        Embeddingはまとめて計算してメモリキャッシュに載せるため、クエリごとの
+        _mmr_search()ではAPIを呼ばない。
+        """
+        self.embeddings.embed_queries(queries)
+        filter_kwargs = self._filter_kwargs(vectorstore, filters)
+        return [self._mmr_search(vectorstore, query, k, filter_kwargs) for query, k in zip(queries, ks)]
+    
+    def _fuse_results(self, docs: List[Tuple[Document, float]], lexical_hits: List[Dict],
+                      k: int) -> List[Tuple[Document, Optional[float], Optional[float]]]:
+        """
+        ベクトル検索とキーワード検索の結果をReciprocal Rank Fusionで統合
+        
+        Returns:
+            (Document, ベクトル検索の距離, キーワード検索のスコア)のリスト（上位k件）
+        """
+        entries = {}
+        vector_ranking, lexical_ranking = [], []
+        for doc, score in docs:
+            key = doc.metadata.get("chunk_id") or doc.page_content
+            entries.setdefault(key, [doc, None, None])[1] = score
+            vector_ranking.append(key)
+        for hit in lexical_hits:
+            key = hit["chunk_id"]
+            entry = entries.setdefault(
+                key, [Document(page_content=hit["content"], metadata=hit["metadata"]), None, None]
+            )
+            entry[2] = hit["score"]
+            lexical_ranking.append(key)
+        
+        fused = reciprocal_rank_fusion([vector_ranking, lexical_ranking])
+        return [tuple(entries[key]) for key, _ in fused[:k]]
+    
+    def _build_results(self, entries: List[Tuple[Document, Optional[float], Optional[float]]]) -> List[Dict]:
+        """
+        検索結果の辞書を作成
+        
+        Args:
+            entries: (Document, ベクトル検索の距離, キーワード検索のスコア)のリスト
+            
+        Returns:
+            検索結果のリスト
+        """
+        results = []
+        for i, (doc, score, lexical_score) in enumerate(entries, 1):
+            # メタデータからファイル名とページ番号を取得
+            metadata = doc.metadata
+            source = metadata.get("source", "unknown")
+            page = metadata.get("page", None)
+            
+            # ファイル名のみを抽出（パスから）
+            if isinstance(source, str):
+                filename = os.path.basename(source)
+            else:
+                filename = str(source)
+            
+            results.append({
+                "index": i,
+                "filename": filename,
+                "page": page,
+                "chunk": doc.page_content,
+                "score": float(score) if score is not None else None,
+                "lexical_score": lexical_score,
+                "source": source,
+                "chunk_id": metadata.get("chunk_id"),
+                "start_index": metadata.get("start_index"),
+                "end_index": metadata.get("end_index"),
+                "duplicates": []
+            })
+        
+        # 重複排除でまとめられた、同じ内容を持つ他のファイル・ページを付加
+        references = lookup_references([r["chunk_id"] for r in results])
+        for result in results:
+            for ref in references.get(result["chunk_id"], []):
+                result["duplicates"].append({
+                    "filename": os.path.basename(ref["source"]) if ref["source"] else "unknown",
+                    "page": ref["page"],
+                })
+        
+        return results
     
     def generate_answer(self, question: str, context_results: List[Dict]) -> Tuple[str, bool]:
         """
@@ -195,32 +747,12 @@ class RAGSystem:
         if not context_results:
             return "参照情報が見つかりませんでした。", False
         
-        # コンテキストを構築
-        context_parts = []
-        for result in context_results:
-            filename = result["filename"]
-            page = result["page"]
-            chunk = result["chunk"]
-            
-            page_info = f" (page {page})" if page is not None else ""
-            context_parts.append(f"[{filename}{page_info}]\n{chunk}")
-        
-        context = "\n\n".join(context_parts)
-        
         # OpenAI APIが利用可能な場合
         if self.openai_client:
             try:
-                prompt = PROMPT_TEMPLATE.format(
-                    context=context,
-                    question=question
-                )
-                
                 response = self.openai_client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": "あなたは業務アシスタントです。"},
-                        {"role": "user", "content": prompt}
-                    ],
+                    model=LLM_MODEL,
+                    messages=self._build_messages(question, context_results),
                     temperature=0.0
                 )
                 
@@ -234,6 +766,112 @@ class RAGSystem:
             # APIキー未設定時: 検索結果を返す
             return self._format_fallback_answer(context_results), False
     
+    def generate_answer_stream(self, question: str,
+                               context_results: List[Dict]) -> Generator[str, None, Tuple[str, bool]]:
+        """
+        LLMの回答をトークンが届くたびに返す（generate_answer()のストリーミング版）
+        
+        最初のトークンが届くまでの時間（TTFT）と生成全体の時間をログに出力する。
+        APIキー未設定時・APIエラー時はフォールバック回答をまとめて返す。
+        
+        Args:
+            question: 質問
+            context_results: 検索結果のリスト
+            
+        Yields:
+            回答テキストの断片
+            
+        Returns:
+            (回答テキスト全体, LLM使用フラグ)のタプル（ジェネレータの戻り値）
+        """
+        if not context_results:
+            answer = "参照情報が見つかりませんでした。"
+            yield answer
+            return answer, False
+        if not self.openai_client:
+            answer = self._format_fallback_answer(context_results)
+            yield answer
+            return answer, False
+        
+        parts = []
+        started = time.perf_counter()
+        ttft = None
+        try:
+            stream = self.openai_client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=self._build_messages(question, context_results),
+                temperature=0.0,
+                stream=True
+            )
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                token = chunk.choices[0].delta.content
+                if not token:
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                parts.append(token)
+                yield token
+        except Exception as e:
+            print(f"OpenAI APIエラー: {e}")
+            if not parts:
+                answer = self._format_fallback_answer(context_results)
+                yield answer
+                return answer, False
+            # 途中まで表示した回答は残し、中断したことを示す（キャッシュには保存しない）
+            notice = "\n\n（回答の生成が中断されました）"
+            yield notice
+            return "".join(parts) + notice, False
+        
+        elapsed = time.perf_counter() - started
+        print(f"⏱️ 回答生成: 最初のトークンまで {ttft or elapsed:.2f}秒 / 全体 {elapsed:.2f}秒")
+        return "".join(parts).strip(), True
+    
+    async def agenerate_answer(self, question: str, context_results: List[Dict]) -> Tuple[str, bool]:
+        """
+        generate_answer()の非同期版（AsyncOpenAIで回答を生成し、待機中にスレッドを占有しない）
+        
+        Args:
+            question: 質問
+            context_results: 検索結果のリスト
+            
+        Returns:
+            (回答テキスト, LLM使用フラグ)のタプル
+        """
+        if not context_results:
+            return "参照情報が見つかりませんでした。", False
+        
+        client = self._get_async_openai_client()
+        if client is None:
+            return self._format_fallback_answer(context_results), False
+        try:
+            response = await client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=self._build_messages(question, context_results),
+                temperature=0.0
+            )
+            return response.choices[0].message.content.strip(), True
+        except Exception as e:
+            print(f"OpenAI APIエラー: {e}")
+            return self._format_fallback_answer(context_results), False
+    
+    def _build_messages(self, question: str, context_results: List[Dict]) -> List[Dict]:
+        """
+        検索結果から参照情報を組み立て、LLMに渡すメッセージを作成
+        
+        同じページで重なるチャンクは結合し、参照情報はCONTEXT_TOKEN_BUDGETトークンまでに収める。
+        """
+        context = build_context(context_results)
+        prompt = PROMPT_TEMPLATE.format(
+            context=context,
+            question=question
+        )
+        return [
+            {"role": "system", "content": "あなたは業務アシスタントです。"},
+            {"role": "user", "content": prompt}
+        ]
+    
     def _format_fallback_answer(self, context_results: List[Dict]) -> str:
         """
         APIキー未設定時のフォールバック回答を生成
@@ -259,32 +897,223 @@ class RAGSystem:
         
         return "\n".join(answer_parts)
     
-    def query(self, question: str) -> Tuple[str, List[Dict], bool]:
+    def cache_stats(self) -> Dict:
+        """
+        キャッシュの利用状況を取得
+        
+        Returns:
+            query_embedding（クエリEmbeddingのメモリキャッシュ）、
+            answer（回答キャッシュ、無効時はNone）の統計と、
+            embedding_skipped（キーワード検索だけで回答した検索の数）を持つ辞書
+        """
+        with self._stats_lock:
+            embedding_skipped = self.embedding_skipped
+        return {
+            "query_embedding": self.embeddings.query_cache.stats(),
+            "answer": self.answer_cache.stats() if self.answer_cache else None,
+            "embedding_skipped": embedding_skipped,
+        }
+    
+    def db_pool_stats(self) -> Optional[Dict]:
+        """
+        Supabaseの接続プール（全セッションで共有）の利用状況を取得
+        
+        Returns:
+            pg_engine.pool_stats()の辞書（Supabaseを使用していない場合はNone）
+        """
+        if self.backend != "pgvector":
+            return None
+        return pool_stats()
+    
+    def _lookup_answer(self, question: str):
+        """
+        回答キャッシュから近い質問の回答を探す
+        
+        Returns:
+            (キャッシュの回答（なければNone）, 質問のEmbedding, インデックスの状態)のタプル
+        """
+        state, changed = self._index_state.current()
+        if changed:
+            # インデックスが更新された場合、参照元が変わった回答をまとめて削除
+            self.answer_cache.invalidate(state)
+        try:
+            # クエリEmbeddingはメモリキャッシュに残るため、続く検索では再計算しない
+            vector = self.embeddings.embed_query(question)
+        except Exception as e:
+            print(f"回答キャッシュ: Embedding取得エラー: {e}")
+            return None, None, state
+        return self.answer_cache.lookup(_answer_cache_key(), vector, state), vector, state
+    
+    def query(self, question: str, filters: Optional[Dict] = None) -> Tuple[str, List[Dict], bool]:
         """
         質問に対して検索と回答生成を実行
         
         Args:
             question: 質問
+            filters: 検索対象を絞るメタデータのフィルタ（search()と同じ）
             
         Returns:
             (回答テキスト, 検索結果リスト, LLM使用フラグ)のタプル
         """
+        parse_filters(filters)
+        # キーワード検索で確実に見つかる質問は、回答キャッシュ（Embeddingが必要）を使わない
+        lexical = self._search_lexical(question, K_SEARCH_RESULTS, filters)
+        
+        vector, state = None, None
+        # フィルタつきの質問は検索対象が異なるため、回答キャッシュを使わない
+        if self.answer_cache and not filters and not lexical[1]:
+            cached, vector, state = self._lookup_answer(question)
+            if cached:
+                print(f"💾 回答キャッシュを使用しました（類似度 {cached['similarity']:.3f}）")
+                return cached["answer"], cached["references"], True
+        
         # 検索実行
-        search_results = self.search(question)
+        search_results = self._search(question, K_SEARCH_RESULTS, lexical, filters)
         
         # 回答生成
         answer, used_llm = self.generate_answer(question, search_results)
         
+        # LLMで生成した回答のみ保存（フォールバック回答は保存しない）
+        if self.answer_cache and used_llm and vector is not None:
+            try:
+                self.answer_cache.put(_answer_cache_key(), question, vector, answer, search_results, state)
+            except Exception as e:
+                print(f"回答キャッシュ保存エラー: {e}")
+        
+        return answer, search_results, used_llm
+    
+    def query_stream(self, question: str, filters: Optional[Dict] = None) -> Tuple[Iterator[str], List[Dict]]:
+        """
+        質問に対して検索を実行し、回答をストリーミングで返す（query()のストリーミング版）
+        
+        検索は呼び出し時に実行し、回答はジェネレータを読み進めるたびに生成する。
+        生成し終えた回答は回答キャッシュに保存する。
+        
+        Args:
+            question: 質問
+            filters: 検索対象を絞るメタデータのフィルタ（search()と同じ）
+            
+        Returns:
+            (回答テキストの断片のジェネレータ, 検索結果リスト)のタプル
+        """
+        parse_filters(filters)
+        lexical = self._search_lexical(question, K_SEARCH_RESULTS, filters)
+        
+        vector, state = None, None
+        if self.answer_cache and not filters and not lexical[1]:
+            cached, vector, state = self._lookup_answer(question)
+            if cached:
+                print(f"💾 回答キャッシュを使用しました（類似度 {cached['similarity']:.3f}）")
+                return iter([cached["answer"]]), cached["references"]
+        
+        search_results = self._search(question, K_SEARCH_RESULTS, lexical, filters)
+        return self._stream_answer(question, search_results, vector, state), search_results
+    
+    def _stream_answer(self, question: str, search_results: List[Dict], vector, state) -> Iterator[str]:
+        """回答をストリーミングし、生成し終えたら回答キャッシュに保存"""
+        answer, used_llm = yield from self.generate_answer_stream(question, search_results)
+        
+        # LLMで生成した回答のみ保存（フォールバック回答は保存しない）
+        if self.answer_cache and used_llm and vector is not None:
+            try:
+                self.answer_cache.put(_answer_cache_key(), question, vector, answer, search_results, state)
+            except Exception as e:
+                print(f"回答キャッシュ保存エラー: {e}")
+    
+    async def aquery(self, question: str, filters: Optional[Dict] = None) -> Tuple[str, List[Dict], bool]:
+        """
+        query()の非同期版
+        
+        質問のEmbeddingを非同期で計算した後、回答キャッシュの参照とベクトル検索を
+        並行して実行し、回答生成はAsyncOpenAIで待つ。
+        
+        Args:
+            question: 質問
+            filters: 検索対象を絞るメタデータのフィルタ（search()と同じ）
+            
+        Returns:
+            (回答テキスト, 検索結果リスト, LLM使用フラグ)のタプル
+        """
+        parse_filters(filters)
+        lexical = await asyncio.to_thread(self._search_lexical, question, K_SEARCH_RESULTS, filters)
+        
+        vector, state = None, None
+        if self.answer_cache and not filters and not lexical[1]:
+            await self._aembed_query(question)
+            (cached, vector, state), search_results = await asyncio.gather(
+                asyncio.to_thread(self._lookup_answer, question),
+                asyncio.to_thread(self._search, question, K_SEARCH_RESULTS, lexical)
+            )
+            if cached:
+                print(f"💾 回答キャッシュを使用しました（類似度 {cached['similarity']:.3f}）")
+                return cached["answer"], cached["references"], True
+        else:
+            search_results = await self._asearch(question, K_SEARCH_RESULTS, lexical, filters)
+        
+        answer, used_llm = await self.agenerate_answer(question, search_results)
+        
+        # LLMで生成した回答のみ保存（フォールバック回答は保存しない）
+        if self.answer_cache and used_llm and vector is not None:
+            try:
+                await asyncio.to_thread(
+                    self.answer_cache.put, _answer_cache_key(), question, vector, answer, search_results, state
+                )
+            except Exception as e:
+                print(f"回答キャッシュ保存エラー: {e}")
+        
         return answer, search_results, used_llm
+    
+    def query_many(self, questions: List[str], k: int = K_SEARCH_RESULTS, concurrency: int = QUERY_CONCURRENCY,
+                   filters: Optional[Dict] = None) -> Iterator[Tuple[str, List[Dict], bool]]:
+        """
+        複数の質問に対して検索と回答生成を実行（夜間の評価などの一括処理用）
+        
+        検索はsearch_many()でまとめて行い、回答生成は最大concurrency件を並行して実行する。
+        評価のため毎回LLMで回答を生成し、回答キャッシュは使わない。
+        
+        Args:
+            questions: 質問のリスト
+            k: 質問ごとに取得する検索結果数
+            concurrency: 同時に実行する回答生成の数
+            filters: 全質問に共通するメタデータのフィルタ（search()と同じ）
+            
+        Yields:
+            質問ごとの(回答テキスト, 検索結果リスト, LLM使用フラグ)のタプル（入力と同じ順）
+        """
+        # 未取得の結果を溜めすぎないよう、先行して投入する回答生成の数を制限する
+        max_pending = concurrency * 2
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        try:
+            pending = deque()
+            for question, search_results in zip(questions, self.search_many(questions, k, filters=filters)):
+                pending.append((executor.submit(self.generate_answer, question, search_results), search_results))
+                # 先頭から順に、完了したもの（または上限に達した場合は完了を待って）を返す
+                while pending and (len(pending) >= max_pending or pending[0][0].done()):
+                    future, search_results = pending.popleft()
+                    answer, used_llm = future.result()
+                    yield answer, search_results, used_llm
+            while pending:
+                future, search_results = pending.popleft()
+                answer, used_llm = future.result()
+                yield answer, search_results, used_llm
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
 
 
-# グローバルインスタンス（必要に応じて）
+# グローバルインスタンス（全セッションで共有）
 _rag_system = None
+_rag_system_lock = threading.Lock()
 
 
 def get_rag_system() -> RAGSystem:
-    """RAGシステムのシングルトンインスタンスを取得"""
+    """
+    RAGシステムのシングルトンインスタンスを取得
+    
+    同時に開始した複数のセッションから呼ばれても、インスタンス（とベクトルストアの
+    接続）は1つだけ作る。
+    """
     global _rag_system
-    if _rag_system is None:
-        _rag_system = RAGSystem()
+    with _rag_system_lock:
+        if _rag_system is None:
+            _rag_system = RAGSystem()
     return _rag_system
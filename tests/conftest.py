@@ -0,0 +1,44 @@
+"""
+テスト共通のフィクスチャ（一時ディレクトリのインデックス、OpenAI互換の偽サーバー）
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import embedding_cache  # noqa: E402
+import ingest  # noqa: E402
+from benchmarks.fake_openai_server import start_server  # noqa: E402
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """インデックスの保存先をすべて一時ディレクトリに向ける"""
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    monkeypatch.setattr(ingest, "USE_SUPABASE", False)
+    monkeypatch.setattr(ingest, "LOCAL_BACKEND", "numpy")
+    monkeypatch.setattr(ingest, "NUMPY_DB_PATH", str(tmp_path / "numpy_db"))
+    monkeypatch.setattr(ingest, "DEDUP_INDEX_PATH", str(tmp_path / "dedup.sqlite"))
+    monkeypatch.setattr(ingest, "LEXICAL_INDEX_PATH", str(tmp_path / "lexical.sqlite"))
+    manifest_path = str(tmp_path / "manifest.json")
+    monkeypatch.setattr(ingest.load_manifest, "__defaults__", (manifest_path,))
+    monkeypatch.setattr(ingest.save_manifest, "__defaults__", (manifest_path,))
+    monkeypatch.setattr(embedding_cache, "_embedding_cache",
+                        embedding_cache.EmbeddingCache(str(tmp_path / "embedding_cache")))
+    monkeypatch.setattr(embedding_cache, "_query_embedding_cache", embedding_cache.QueryEmbeddingCache())
+    docs_dir = tmp_path / "docs"
+    docs_dir.mkdir()
+    return tmp_path, docs_dir
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    """OpenAI互換の偽サーバーを起動し、OpenAIクライアントの接続先をそこに向ける"""
+    server = start_server(dim=64)
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_port}/v1")
+    monkeypatch.setenv("OPENAI_API_KEY", "dummy")
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,114 @@
+"""
+chunk_dedup.pyの重複排除のテスト（一時ディレクトリのSQLiteを使用）
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document  # noqa: E402
+
+from chunk_dedup import ChunkDeduplicator, lookup_references, minhash_signature, normalize_text  # noqa: E402
+
+BASE_TEXT = (
+    "本製品の保証期間は購入日から2年間です。延長保証に加入すると最長5年間まで延長できます。"
+    "消耗品（フィルター、パッキンなど）は保証の対象外です。修理を依頼する場合はサポート窓口に"
+    "ご連絡ください。受付時間は平日9時から17時までです。土日祝日は受け付けておりません。"
+)
+# 1文字だけ異なる（推定Jaccard類似度は閾値を超える）
+NEAR_TEXT = BASE_TEXT.replace("17時", "18時")
+OTHER_TEXT = "管理者パスワードは12文字以上で、90日ごとに変更してください。初期パスワードのままでは使用できません。"
+
+
+@pytest.fixture
+def dedup(tmp_path):
+    deduplicator = ChunkDeduplicator(str(tmp_path / "dedup.sqlite"))
+    yield deduplicator
+    deduplicator.close()
+
+
+def add(dedup, source_key, *contents):
+    chunks = [Document(page_content=content, metadata={"source": f"docs/{source_key}", "page": 0})
+              for content in contents]
+    _, kept_ids = dedup.deduplicate(source_key, chunks, [f"{source_key}:{i}" for i in range(len(contents))])
+    return kept_ids
+
+
+def test_normalize_text_ignores_width_case_and_spaces():
+    assert normalize_text("ＡＢＣ の\n設定　Ｘ") == "abcの設定x"
+
+
+def test_exact_duplicate_collapses_to_reference(dedup, tmp_path):
+    assert add(dedup, "a.txt", BASE_TEXT) == ["a.txt:0"]
+    # 空白・全角半角の違いは正規化で同じ内容とみなす
+    assert add(dedup, "b.txt", BASE_TEXT.replace("2年間", " ２年間 ")) == []
+
+    stats = dedup.stats()
+    assert (stats["stored"], stats["references"]) == (1, 1)
+    assert (stats["exact_duplicates"], stats["near_duplicates"]) == (1, 0)
+    references = lookup_references(["a.txt:0"], str(tmp_path / "dedup.sqlite"))
+    assert references == {"a.txt:0": [{"source": "docs/b.txt", "page": 0, "similarity": 1.0}]}
+
+
+def test_near_duplicate_collapses_to_reference(dedup, tmp_path):
+    similarity = float((minhash_signature(normalize_text(BASE_TEXT)) ==
+                        minhash_signature(normalize_text(NEAR_TEXT))).mean())
+    assert dedup.threshold <= similarity < 1.0
+
+    add(dedup, "a.txt", BASE_TEXT)
+    assert add(dedup, "b.txt", NEAR_TEXT) == []
+
+    stats = dedup.stats()
+    assert (stats["exact_duplicates"], stats["near_duplicates"]) == (0, 1)
+    [reference] = lookup_references(["a.txt:0"], str(tmp_path / "dedup.sqlite"))["a.txt:0"]
+    assert reference["similarity"] == pytest.approx(similarity)
+
+
+def test_distinct_chunks_are_kept(dedup):
+    assert add(dedup, "a.txt", BASE_TEXT, OTHER_TEXT) == ["a.txt:0", "a.txt:1"]
+    assert dedup.stats()["stored"] == 2
+
+
+def test_duplicates_within_one_file_collapse(dedup):
+    assert add(dedup, "a.txt", BASE_TEXT, OTHER_TEXT, BASE_TEXT) == ["a.txt:0", "a.txt:1"]
+
+
+def test_remove_file_returns_dependent_files(dedup):
+    add(dedup, "a.txt", BASE_TEXT, OTHER_TEXT)
+    add(dedup, "b.txt", BASE_TEXT)
+    add(dedup, "c.txt", NEAR_TEXT)
+    add(dedup, "d.txt", OTHER_TEXT)
+
+    assert dedup.remove_file("a.txt") == ["b.txt", "c.txt", "d.txt"]
+    assert (dedup.stats()["stored"], dedup.stats()["references"]) == (0, 0)
+
+    # 削除後は同じ内容を新しいチャンクとして保存する
+    assert add(dedup, "b.txt", BASE_TEXT) == ["b.txt:0"]
+
+
+def test_remove_referencing_file_keeps_canonical_chunk(dedup):
+    add(dedup, "a.txt", BASE_TEXT)
+    add(dedup, "b.txt", BASE_TEXT)
+
+    assert dedup.remove_file("b.txt") == []
+    assert (dedup.stats()["stored"], dedup.stats()["references"]) == (1, 0)
+    assert add(dedup, "b.txt", BASE_TEXT) == []
+
+
+def test_state_persists_across_instances(tmp_path):
+    path = str(tmp_path / "dedup.sqlite")
+    first = ChunkDeduplicator(path)
+    add(first, "a.txt", BASE_TEXT)
+    first.close()
+
+    second = ChunkDeduplicator(path)
+    try:
+        assert add(second, "b.txt", BASE_TEXT) == []
+    finally:
+        second.close()
+
+
+def test_lookup_references_without_index(tmp_path):
+    assert lookup_references(["a.txt:0"], str(tmp_path / "missing.sqlite")) == {}
@@ -0,0 +1,126 @@
+"""
+context_packer.pyの参照情報の組み立てのテスト
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document  # noqa: E402
+
+from context_packer import build_context, count_tokens, format_part, pack_context  # noqa: E402
+from text_chunker import TextChunker  # noqa: E402
+
+PAGE_TEXT = "".join(
+    f"第{i}条 本マニュアルは製品の設置手順と保守点検について説明します。作業前に電源を切ってください。\n"
+    for i in range(30)
+)
+
+
+def make_result(index, chunk, start=None, end=None, source="docs/manual.pdf", page=3):
+    return {
+        "index": index,
+        "filename": os.path.basename(source),
+        "source": source,
+        "page": page,
+        "chunk": chunk,
+        "start_index": start,
+        "end_index": end,
+    }
+
+
+def chunk_results(chunk_size=200, chunk_overlap=40):
+    doc = Document(page_content=PAGE_TEXT, metadata={})
+    chunks = TextChunker(chunk_size, chunk_overlap).split_documents([doc])
+    return [make_result(i + 1, c.page_content, c.metadata["start_index"], c.metadata["end_index"])
+            for i, c in enumerate(chunks)]
+
+
+def test_overlapping_chunks_merge_without_repeating_text():
+    results = chunk_results()
+    assert results[0]["end_index"] > results[1]["start_index"]
+
+    [part] = pack_context(results[:3], budget=100000)
+
+    assert part["indexes"] == [1, 2, 3]
+    assert (part["start_index"], part["end_index"]) == (results[0]["start_index"], results[2]["end_index"])
+    assert part["chunk"] == PAGE_TEXT[part["start_index"]:part["end_index"]]
+    assert part["tokens"] == count_tokens(format_part(part))
+
+
+def test_out_of_order_chunks_merge_in_page_order():
+    results = chunk_results()
+    [part] = pack_context([results[2], results[0], results[1]], budget=100000)
+    assert part["indexes"] == [3, 2, 1]
+    assert part["chunk"] == PAGE_TEXT[results[0]["start_index"]:results[2]["end_index"]]
+
+
+def test_chunk_bridging_two_parts_merges_them():
+    results = chunk_results()
+    parts = pack_context([results[0], results[2]], budget=100000)
+    assert len(parts) == 2
+
+    [part] = pack_context([results[0], results[2], results[1]], budget=100000)
+    assert sorted(part["indexes"]) == [1, 2, 3]
+    assert part["chunk"] == PAGE_TEXT[results[0]["start_index"]:results[2]["end_index"]]
+
+
+def test_adjacent_chunks_merge_with_newline():
+    text = "保証期間は2年間です。\n消耗品は対象外です。"
+    first, second = text.split("\n")
+    [part] = pack_context([make_result(1, first, 0, len(first)),
+                           make_result(2, second, len(first) + 1, len(text))], budget=100000)
+    assert part["chunk"] == text
+
+
+def test_different_pages_and_files_are_not_merged():
+    results = chunk_results()
+    first, second = results[0], results[1]
+    parts = pack_context([first, dict(second, page=4), dict(second, source="docs/other.pdf", filename="other.pdf")],
+                         budget=100000)
+    assert [part["indexes"] for part in parts] == [[1], [2], [2]]
+
+
+def test_results_without_offsets_are_kept_as_is():
+    results = [make_result(1, "本文A"), make_result(2, "本文A")]
+    parts = pack_context(results, budget=100000)
+    assert [part["chunk"] for part in parts] == ["本文A", "本文A"]
+    assert build_context(results, budget=100000) == "[manual.pdf (page 3)]\n本文A\n\n[manual.pdf (page 3)]\n本文A"
+
+
+@pytest.mark.parametrize("budget", [60, 150, 300, 700])
+def test_token_budget_is_respected(budget):
+    results = chunk_results()
+    # 結合されない別ページの結果を混ぜ、上限で飛ばされる結果の後ろに収まる結果があるようにする
+    mixed = [dict(r, page=r["index"] % 3) for r in results] + [make_result(99, "短い本文", page=9)]
+
+    parts = pack_context(mixed, budget=budget)
+
+    assert parts
+    assert count_tokens(build_context(mixed, budget=budget)) <= budget
+    assert sum(part["tokens"] for part in parts) + len(parts) - 1 <= budget
+
+
+def test_skipped_result_lets_later_smaller_result_in():
+    large = make_result(2, "大きな本文です。" * 40, page=5)
+    small = make_result(3, "短い本文", page=6)
+    first = make_result(1, "最上位の本文", page=4)
+    budget = count_tokens(format_part(first)) + count_tokens(format_part(small)) + 5
+
+    parts = pack_context([first, large, small], budget=budget)
+    assert [part["indexes"] for part in parts] == [[1], [3]]
+
+
+def test_top_result_is_truncated_to_fit_budget():
+    result = make_result(1, "長い本文です。" * 100)
+    [part] = pack_context([result], budget=40)
+    assert part["tokens"] <= 40
+    assert result["chunk"].startswith(part["chunk"]) and part["chunk"]
+    assert part["start_index"] is None
+
+
+def test_empty_results():
+    assert pack_context([], budget=100) == []
+    assert build_context([], budget=100) == ""
@@ -0,0 +1,146 @@
+"""
+embedding_cache.pyのテスト（一時ディレクトリのキャッシュを使用）
+"""
+import os
+import sys
+import asyncio
+import multiprocessing
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding_cache import CachedEmbeddings, EmbeddingCache, QueryEmbeddingCache  # noqa: E402
+
+MODEL = "test-model"
+
+
+class RecordingEmbeddings:
+    """APIに渡したテキストを記録する、テキストから決定的なベクトルを返すEmbedding"""
+
+    def __init__(self):
+        self.calls = []
+
+    @staticmethod
+    def vector(text):
+        return [float(len(text)), float(sum(map(ord, text)) % 97), 1.0]
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+
+def _vector(writer, i):
+    return [float(writer), float(i), float(writer * 1000 + i)]
+
+
+def _write_entries(cache_dir, writer, count):
+    """別プロセスからキャッシュに追記する"""
+    cache = EmbeddingCache(cache_dir)
+    for start in range(0, count, 2):
+        ids = range(start, min(start + 2, count))
+        cache.put_many(MODEL, [f"{writer}-{i}" for i in ids], [_vector(writer, i) for i in ids])
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return EmbeddingCache(str(tmp_path / "embedding_cache"))
+
+
+@pytest.fixture
+def embeddings(cache):
+    return CachedEmbeddings(RecordingEmbeddings(), MODEL, cache, QueryEmbeddingCache())
+
+
+def test_concurrent_writers_in_separate_processes(tmp_path):
+    """複数プロセスが同時に追記しても、各エントリが自分のベクトルを指す"""
+    cache_dir = str(tmp_path / "embedding_cache")
+    EmbeddingCache(cache_dir)
+    writers, count = 4, 300
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=_write_entries, args=(cache_dir, w, count)) for w in range(writers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    cache = EmbeddingCache(cache_dir)
+    texts = [f"{w}-{i}" for w in range(writers) for i in range(count)]
+    assert cache.get_many(MODEL, texts) == [_vector(w, i) for w in range(writers) for i in range(count)]
+    assert cache.stats()["size_bytes"] == writers * count * 3 * 4
+
+
+def test_eviction_keeps_recent_entries_consistent(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embedding_cache"), max_bytes=50 * 3 * 4)
+    for i in range(0, 100, 10):
+        cache.put_many(MODEL, [f"0-{j}" for j in range(i, i + 10)], [_vector(0, j) for j in range(i, i + 10)])
+
+    texts = [f"0-{j}" for j in range(100)]
+    vectors = cache.get_many(MODEL, texts)
+    assert vectors[-10:] == [_vector(0, j) for j in range(90, 100)]
+    # 削除されずに残ったエントリは、詰め直した後も自分のベクトルを指す
+    assert all(v is None or v == _vector(0, j) for j, v in enumerate(vectors))
+    assert cache.stats()["size_bytes"] <= 50 * 3 * 4
+
+
+def test_embed_documents_computes_each_text_once(embeddings, cache):
+    texts = ["チャンクA", "チャンクB", "チャンクA"]
+    assert embeddings.embed_documents(texts) == [RecordingEmbeddings.vector(t) for t in texts]
+    assert embeddings.underlying.calls == [["チャンクA", "チャンクB"]]
+
+    # 2回目はディスクのキャッシュから返す
+    assert embeddings.embed_documents(texts) == [RecordingEmbeddings.vector(t) for t in texts]
+    assert len(embeddings.underlying.calls) == 1
+    assert cache.stats()["entries"] == 2
+
+
+def test_embed_query_sends_original_text_and_keys_by_normalized_text(embeddings, cache):
+    vector = embeddings.embed_query("  ＡＢＣの　設定  ")
+    # APIには入力そのもの（全角・空白を含む）を渡す
+    assert embeddings.underlying.calls == [["  ＡＢＣの　設定  "]]
+    assert vector == RecordingEmbeddings.vector("  ＡＢＣの　設定  ")
+
+    # 正規化すると同じになる質問はメモリキャッシュから返す
+    assert embeddings.embed_query("ABCの 設定") == vector
+    assert len(embeddings.underlying.calls) == 1
+    assert embeddings.query_cache.stats()["hits"] == 1
+
+    # クエリのベクトルはディスクのキャッシュに保存しない
+    assert cache.stats()["entries"] == 0
+
+
+def test_aembed_query_matches_embed_query(embeddings, cache):
+    vector = asyncio.run(embeddings.aembed_query("保証期間 "))
+    assert embeddings.underlying.calls == [["保証期間 "]]
+    assert embeddings.embed_query("保証期間") == vector
+    assert len(embeddings.underlying.calls) == 1
+    assert cache.stats()["entries"] == 0
+
+
+def test_embed_queries_batches_missing_queries(embeddings, cache):
+    embeddings.embed_query("質問1")
+    vectors = embeddings.embed_queries(["質問1", "質問2", " 質問2 ", "質問3"])
+
+    # キャッシュにない質問だけを1回で計算し、正規化して同じ質問は最初のテキストで計算する
+    assert embeddings.underlying.calls[1:] == [["質問2", "質問3"]]
+    assert vectors == [RecordingEmbeddings.vector(t) for t in ["質問1", "質問2", "質問2", "質問3"]]
+    assert embeddings.embed_query("質問3") == vectors[3]
+    assert len(embeddings.underlying.calls) == 2
+    assert cache.stats()["entries"] == 0
+
+
+def test_query_cache_evicts_least_recently_used():
+    query_cache = QueryEmbeddingCache(max_entries=2)
+    query_cache.put(MODEL, "a", [1.0])
+    query_cache.put(MODEL, "b", [2.0])
+    assert query_cache.get(MODEL, "a") == [1.0]
+    query_cache.put(MODEL, "c", [3.0])
+    assert query_cache.get(MODEL, "b") is None
+    assert query_cache.get(MODEL, "a") == [1.0]
@@ -0,0 +1,96 @@
+"""
+embedding_scheduler.pyのテスト（OpenAI互換の偽サーバーを使用）
+"""
+import os
+import sys
+import time
+
+import numpy as np
+import openai
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai_server import fake_embedding  # noqa: E402
+from embedding_scheduler import EmbeddingScheduler, _TokenBucket, pack_batches  # noqa: E402
+
+MODEL = "text-embedding-3-small"
+
+
+def make_texts(n):
+    return [f"テキスト{i}の内容です。" * (1 + i % 3) for i in range(n)]
+
+
+def test_pack_batches_respects_token_and_input_limits():
+    assert pack_batches([5, 5, 5, 5], max_tokens=10) == [[0, 1], [2, 3]]
+    assert pack_batches([3, 3, 3, 3, 3], max_tokens=100, max_inputs=2) == [[0, 1], [2, 3], [4]]
+    # 上限を超える入力は単独のバッチにする
+    assert pack_batches([4, 30, 4], max_tokens=10) == [[0], [1], [2]]
+
+
+def test_token_bucket_waits_when_empty():
+    bucket = _TokenBucket(tokens_per_minute=600)  # 毎秒10トークン
+    bucket.acquire(600)
+    started = time.monotonic()
+    bucket.acquire(3)
+    assert time.monotonic() - started >= 0.2
+
+
+def test_results_keep_input_order_across_batches(fake_openai):
+    texts = make_texts(40)
+    scheduler = EmbeddingScheduler(MODEL, max_concurrency=4, max_batch_tokens=50)
+
+    vectors = scheduler.embed_documents(texts)
+
+    np.testing.assert_allclose(vectors, [fake_embedding(text, fake_openai.dim) for text in texts], rtol=1e-6)
+    progress = scheduler.progress()
+    assert progress["chunks"] == len(texts)
+    assert progress["requests"] == fake_openai.request_count > 1
+
+
+def test_rate_limit_waits_retry_after_and_retries(fake_openai):
+    fake_openai.rate_limit_every = 3
+    fake_openai.retry_after = 0.3
+    texts = make_texts(30)
+    scheduler = EmbeddingScheduler(MODEL, max_concurrency=4, max_batch_tokens=50)
+
+    started = time.monotonic()
+    vectors = scheduler.embed_documents(texts)
+
+    np.testing.assert_allclose(vectors, [fake_embedding(text, fake_openai.dim) for text in texts], rtol=1e-6)
+    progress = scheduler.progress()
+    assert progress["rate_limited"] >= 1
+    assert progress["retries"] == progress["rate_limited"]
+    assert time.monotonic() - started >= fake_openai.retry_after
+
+
+def test_concurrency_halves_on_rate_limit_and_grows_back():
+    scheduler = EmbeddingScheduler(MODEL, client=object(), max_concurrency=8)
+
+    def finish(**kwargs):
+        scheduler._acquire_slot()
+        scheduler._release_slot(**kwargs)
+
+    finish(succeeded=False, rate_limited=True)
+    assert scheduler.progress()["concurrency"] == 4
+    finish(succeeded=False, rate_limited=True)
+    assert scheduler.progress()["concurrency"] == 2
+
+    # 現在の同時実行数と同じ回数だけ成功が続くと1つ戻す
+    for _ in range(2):
+        finish(succeeded=True)
+    assert scheduler.progress()["concurrency"] == 3
+    for _ in range(3 + 4 + 5 + 6 + 7):
+        finish(succeeded=True)
+    assert scheduler.progress()["concurrency"] == 8
+
+
+def test_insufficient_quota_fails_without_retry(fake_openai):
+    fake_openai.insufficient_quota = True
+    scheduler = EmbeddingScheduler(MODEL)
+
+    with pytest.raises(openai.RateLimitError):
+        scheduler.embed_documents(["テキスト"])
+
+    assert fake_openai.request_count == 1
+    assert scheduler.progress()["retries"] == 0
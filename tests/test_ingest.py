@@ -0,0 +1,101 @@
+"""
+ingest.pyの全件再構築のテスト（NumPyベクトルストア、一時ディレクトリを使用）
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import index_versions  # noqa: E402
+import ingest  # noqa: E402
+
+
+def test_full_rebuild_without_chunks_keeps_existing_index(workspace, capsys):
+    """チャンクが1件も書き込まれない全件再構築は、エラーにならず既存のインデックスを残す"""
+    tmp_path, docs_dir = workspace
+    # 空のファイルはチャンクにならない
+    (docs_dir / "empty.txt").write_text("", encoding="utf-8")
+
+    ingest.ingest(str(docs_dir), str(tmp_path / "chroma_db"), full_rebuild=True)
+
+    assert "チャンクが空のため" in capsys.readouterr().out
+    assert index_versions.get_current_version(ingest.NUMPY_DB_PATH) is None
+    assert not os.path.exists(ingest.LEXICAL_INDEX_PATH)
+    assert not os.path.exists(f"{ingest.LEXICAL_INDEX_PATH}.{os.getpid()}.tmp")
+    assert not os.path.exists(f"{ingest.DEDUP_INDEX_PATH}.{os.getpid()}.tmp")
+
+
+def test_full_rebuild_failure_raises_original_error(workspace, monkeypatch):
+    """書き込み中のエラーは、後片付けで隠されずにそのまま送出される"""
+    tmp_path, docs_dir = workspace
+    (docs_dir / "a.txt").write_text("本文" * 100, encoding="utf-8")
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("書き込みエラー")
+
+    monkeypatch.setattr(ingest, "_write_files", fail)
+    with pytest.raises(RuntimeError, match="書き込みエラー"):
+        ingest.ingest(str(docs_dir), str(tmp_path / "chroma_db"), full_rebuild=True)
+    assert not os.path.exists(f"{ingest.LEXICAL_INDEX_PATH}.{os.getpid()}.tmp")
+
+
+def _open_store(tmp_path):
+    return ingest.open_vectorstore("numpy", None, str(tmp_path / "chroma_db"))
+
+
+def test_delete_from_index_removes_only_that_file(workspace, fake_openai):
+    tmp_path, docs_dir = workspace
+    (docs_dir / "a.txt").write_text("保証期間は購入日から2年間です。", encoding="utf-8")
+    (docs_dir / "b.txt").write_text("サポート窓口の受付時間は平日9時から17時までです。", encoding="utf-8")
+    ingest.ingest(str(docs_dir), str(tmp_path / "chroma_db"), full_rebuild=True)
+    requests_before = fake_openai.request_count
+
+    (docs_dir / "a.txt").unlink()
+    deleted, dependents = ingest.delete_from_index("a.txt", str(docs_dir), str(tmp_path / "chroma_db"))
+
+    assert (deleted, dependents) == (1, [])
+    assert list(ingest.load_manifest()["files"]) == ["b.txt"]
+    assert _open_store(tmp_path).count() == 1
+    # 削除ではEmbedding APIを呼ばない
+    assert fake_openai.request_count == requests_before
+
+
+def test_delete_canonical_duplicate_defers_dependents_to_ingest(workspace, fake_openai):
+    """重複チャンクの保存元を削除しても、参照していたファイルの再処理はその場で行わない"""
+    tmp_path, docs_dir = workspace
+    (docs_dir / "a.txt").write_text("同じ内容のドキュメントです。" * 5, encoding="utf-8")
+    (docs_dir / "b.txt").write_text("同じ内容のドキュメントです。" * 5, encoding="utf-8")
+    ingest.ingest(str(docs_dir), str(tmp_path / "chroma_db"), full_rebuild=True)
+    files = ingest.load_manifest()["files"]
+    canonical = next(key for key, entry in files.items() if entry["chunk_ids"])
+    other = "b.txt" if canonical == "a.txt" else "a.txt"
+    assert _open_store(tmp_path).count() == 1
+
+    (docs_dir / canonical).unlink()
+    deleted, dependents = ingest.delete_from_index(canonical, str(docs_dir), str(tmp_path / "chroma_db"))
+
+    assert (deleted, dependents) == (1, [other])
+    assert _open_store(tmp_path).count() == 0
+    # 次の差分インデックスで保存し直されるよう、ハッシュを消しておく
+    assert ingest.load_manifest()["files"][other]["hash"] is None
+
+    ingest.ingest(str(docs_dir), str(tmp_path / "chroma_db"))
+    assert _open_store(tmp_path).count() == 1
+    assert ingest.load_manifest()["files"][other]["chunk_ids"]
+
+
+def test_delete_without_recorded_chunk_ids_falls_back_to_source(workspace, fake_openai):
+    """マニフェストにチャンクIDがないファイルは、sourceメタデータで削除する"""
+    tmp_path, docs_dir = workspace
+    (docs_dir / "a.txt").write_text("保証期間は購入日から2年間です。", encoding="utf-8")
+    ingest.ingest(str(docs_dir), str(tmp_path / "chroma_db"), full_rebuild=True)
+    manifest = ingest.load_manifest()
+    manifest["files"]["a.txt"]["chunk_ids"] = []
+    ingest.save_manifest(manifest)
+
+    deleted, _ = ingest.delete_from_index("a.txt", str(docs_dir), str(tmp_path / "chroma_db"))
+
+    assert deleted == 1
+    assert _open_store(tmp_path).count() == 0
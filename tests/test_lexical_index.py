@@ -0,0 +1,94 @@
+"""
+lexical_index.pyのキーワード検索のテスト（一時ディレクトリのSQLiteを使用）
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document  # noqa: E402
+
+from lexical_index import LexicalIndex, ngrams, reciprocal_rank_fusion  # noqa: E402
+
+
+@pytest.fixture
+def index(tmp_path):
+    lexical_index = LexicalIndex(str(tmp_path / "lexical.sqlite"))
+    yield lexical_index
+    lexical_index.close()
+
+
+def add(index, *contents, source="docs/manual.txt"):
+    metadata = {"source": source, "filename": os.path.basename(source)}
+    chunks = [Document(page_content=content, metadata=dict(metadata)) for content in contents]
+    index.add_chunks(chunks, [f"{source}:{i}" for i in range(len(contents))])
+
+
+def test_ngrams_skip_hiragana_only_grams():
+    grams = ngrams("設定します")
+    assert "設定" in grams
+    assert "しま" not in grams and "ます" not in grams
+
+
+def test_common_grams_still_score(index):
+    # すべてのチャンクに現れるn-gramだけの質問でも、検索結果が空にならない
+    add(index, *[f"仕様書の第{i}章" for i in range(20)])
+    hits, _ = index.search("仕様書", k=3)
+    assert len(hits) == 3
+
+
+def test_rare_gram_ranks_first(index):
+    add(index, "製品AB-100の設定手順", "製品CD-200の設定手順", "一般的な設定手順")
+    hits, _ = index.search("AB-100", k=3)
+    assert hits[0]["content"] == "製品AB-100の設定手順"
+
+
+def test_confident_on_unique_exact_phrase(index):
+    add(index, "型番XZ-9000の保証期間は2年です", "保証の手続きについて", "設定の手順について")
+    hits, confident = index.search("XZ-9000", k=3)
+    assert hits[0]["content"].startswith("型番XZ-9000")
+    assert confident
+
+
+def test_not_confident_on_partial_token(index):
+    # 「ab-100」は「ab-1000」の途中で切れるため完全一致ではない
+    add(index, "型番AB-1000の保証期間", "設定の手順について")
+    hits, confident = index.search("AB-100", k=3)
+    assert hits
+    assert not confident
+
+
+def test_not_confident_without_margin(index):
+    # 同じ型番を含むチャンクが複数あれば、スコアの差がつかずベクトル検索と統合する
+    add(index, "型番XZ-9000の保証期間", "型番XZ-9000の設定手順")
+    hits, confident = index.search("XZ-9000", k=3)
+    assert len(hits) == 2
+    assert not confident
+
+
+def test_not_confident_for_long_query(index):
+    # 長い質問は文章の一部が一致しても、質問の意図と合うとは限らない
+    text = "保証期間は購入日から2年間で延長保証に加入すると最長5年間まで延長できますが消耗品は対象外です"
+    add(index, text)
+    hits, confident = index.search(text, k=3)
+    assert hits
+    assert not confident
+
+
+def test_filter_and_delete_by_source(index):
+    add(index, "型番XZ-9000の保証", source="docs/a.txt")
+    add(index, "型番XZ-9000の設定", source="docs/b.txt")
+    hits, _ = index.search("XZ-9000", k=3, filter={"filename": "b.txt"})
+    assert [hit["metadata"]["source"] for hit in hits] == ["docs/b.txt"]
+
+    assert index.delete_by_source("docs/b.txt") == 1
+    hits, _ = index.search("XZ-9000", k=3)
+    assert [hit["metadata"]["source"] for hit in hits] == ["docs/a.txt"]
+    assert index.stats()["chunks"] == 1
+
+
+def test_reciprocal_rank_fusion_prefers_items_in_both_rankings():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "d", "b"]])
+    assert [key for key, _ in fused][:2] == ["c", "b"]
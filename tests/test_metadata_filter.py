@@ -0,0 +1,115 @@
+"""
+metadata_filter.pyのフィルタの検証と条件式への変換のテスト
+"""
+import os
+import sys
+import json
+import sqlite3
+import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metadata_filter import parse_filters, to_chroma_where, to_pgvector_filter, to_sqlite_where  # noqa: E402
+
+
+@pytest.mark.parametrize("filters", [
+    {"source": "docs/a.txt"},                     # 未対応のメタデータ
+    {"page": {"$regex": "1"}},                    # 未対応の演算子
+    {"filename": {"$gte": "a"}},                  # 文字列の範囲比較
+    {"indexed_at": "2025-01-01"},                 # indexed_atの一致比較
+    {"indexed_at": {"$gte": "2025/01/01"}},       # 日時の形式
+    {"indexed_at": {"$gte": 20250101}},           # 日時以外の値
+    {"page": "3"},                                # pageに文字列
+    {"page": True},                               # pageに真偽値
+    {"page": {"$in": []}},                        # 空のリスト
+    {"file_type": {"$in": "pdf"}},                # リスト以外
+    {"filename": 1},                              # 文字列以外
+])
+def test_parse_filters_rejects_invalid_input(filters):
+    with pytest.raises(ValueError):
+        parse_filters(filters)
+
+
+def test_parse_filters_normalizes_values():
+    assert parse_filters(None) == []
+    assert parse_filters({}) == []
+    assert parse_filters({"filename": "料金表.pdf", "file_type": {"$in": [".PDF", "md"]},
+                          "page": {"$gte": 3, "$lte": 10}}) == [
+        ("filename", "$eq", "料金表.pdf"),
+        ("file_type", "$in", ["pdf", "md"]),
+        ("page", "$gte", 3),
+        ("page", "$lte", 10),
+    ]
+
+
+def test_parse_filters_converts_indexed_at_to_timestamp():
+    expected = datetime.datetime(2025, 1, 1).timestamp()
+    for value in ("2025-01-01", datetime.date(2025, 1, 1), datetime.datetime(2025, 1, 1)):
+        assert parse_filters({"indexed_at": {"$gte": value}}) == [("indexed_at_ts", "$gte", expected)]
+
+
+def test_to_chroma_where():
+    assert to_chroma_where([]) is None
+    assert to_chroma_where(parse_filters({"filename": "a.pdf"})) == {"filename": {"$eq": "a.pdf"}}
+    assert to_chroma_where(parse_filters({"file_type": {"$nin": ["pdf"]}, "page": {"$lt": 5}})) == {
+        "$and": [{"file_type": {"$nin": ["pdf"]}}, {"page": {"$lt": 5}}]
+    }
+
+
+def test_to_pgvector_filter_turns_string_equality_into_in():
+    assert to_pgvector_filter([]) is None
+    assert to_pgvector_filter(parse_filters({"filename": "a.pdf"})) == {"filename": {"$in": ["a.pdf"]}}
+    assert to_pgvector_filter(parse_filters({"filename": "a.pdf", "page": 2, "file_type": {"$ne": "md"}})) == {
+        "$and": [{"filename": {"$in": ["a.pdf"]}}, {"page": {"$eq": 2}}, {"file_type": {"$ne": "md"}}]
+    }
+
+
+def test_to_sqlite_where_builds_parameterized_sql():
+    assert to_sqlite_where([]) == ("1", [])
+    assert to_sqlite_where(parse_filters({"file_type": {"$nin": ["pdf", "md"]}, "page": {"$gt": 1}}), "m") == (
+        "json_extract(m, '$.file_type') NOT IN (?,?) AND json_extract(m, '$.page') > ?",
+        ["pdf", "md", 1],
+    )
+
+
+ROWS = [
+    {"filename": "a.pdf", "file_type": "pdf", "page": 1, "indexed_at_ts": 100.0},
+    {"filename": "a.pdf", "file_type": "pdf", "page": 5, "indexed_at_ts": 100.0},
+    {"filename": "b.md", "file_type": "md", "page": 0, "indexed_at_ts": 200.0},
+    {"filename": "c.txt", "file_type": "txt", "indexed_at_ts": 300.0},
+]
+
+
+@pytest.mark.parametrize("filters,expected", [
+    ({"filename": "a.pdf"}, [0, 1]),
+    ({"filename": {"$ne": "a.pdf"}}, [2, 3]),
+    ({"file_type": {"$in": ["md", "TXT"]}}, [2, 3]),
+    ({"file_type": {"$nin": ["pdf"]}}, [2, 3]),
+    ({"page": {"$gte": 1, "$lt": 5}}, [0]),
+    ({"filename": "a.pdf", "page": {"$gt": 1}}, [1]),
+    ({"page": {"$ne": 1}}, [1, 2, 3]),
+    ({"filename": "missing.pdf"}, []),
+])
+def test_to_sqlite_where_selects_matching_rows(filters, expected):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE chunks (id INTEGER, metadata TEXT)")
+    conn.executemany("INSERT INTO chunks VALUES (?, ?)", [(i, json.dumps(row)) for i, row in enumerate(ROWS)])
+
+    where, params = to_sqlite_where(parse_filters(filters))
+    rows = conn.execute(f"SELECT id FROM chunks WHERE {where} ORDER BY id", params).fetchall()
+    assert [row[0] for row in rows] == expected
+
+
+def test_to_sqlite_where_compares_indexed_at_numerically():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE chunks (id INTEGER, metadata TEXT)")
+    day = datetime.datetime(2025, 6, 1)
+    conn.executemany("INSERT INTO chunks VALUES (?, ?)", [
+        (0, json.dumps({"indexed_at_ts": (day - datetime.timedelta(days=1)).timestamp()})),
+        (1, json.dumps({"indexed_at_ts": (day + datetime.timedelta(hours=1)).timestamp()})),
+    ])
+
+    where, params = to_sqlite_where(parse_filters({"indexed_at": {"$gte": "2025-06-01"}}))
+    assert conn.execute(f"SELECT id FROM chunks WHERE {where}", params).fetchall() == [(1,)]
@@ -0,0 +1,72 @@
+"""
+mmr.pyのMaximal Marginal Relevanceのテスト
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mmr import mmr_select  # noqa: E402
+
+QUERY = np.array([1.0, 0.0])
+# 0と1はほぼ同じ向き、2は斜め、3はクエリと直交
+CANDIDATES = np.array([
+    [1.0, 0.1],
+    [1.0, 0.12],
+    [0.7, -0.7],
+    [0.0, 1.0],
+])
+
+
+@pytest.mark.parametrize("lambda_mult,expected", [
+    (1.0, [0, 1, 2, 3]),   # 関連度のみ
+    (0.5, [0, 2, 1, 3]),   # 0とほぼ同じ1より、向きの異なる2を先に選ぶ
+    (0.0, [0, 3, 2, 1]),   # 多様性のみ（最初の1件だけは関連度で選ぶ）
+])
+def test_known_selection_order(lambda_mult, expected):
+    assert mmr_select(QUERY, CANDIDATES, 4, lambda_mult) == expected
+
+
+def reference_mmr(query, candidates, k, lambda_mult):
+    """候補ごとに選択済みとの類似度を計算し直す素朴な実装（最初の1件は関連度で選ぶ）"""
+    candidates = candidates / np.linalg.norm(candidates, axis=1, keepdims=True)
+    query = query / np.linalg.norm(query)
+    selected = []
+    for _ in range(k):
+        best, best_score = None, -np.inf
+        for i in range(len(candidates)):
+            if i in selected:
+                continue
+            relevance = candidates[i] @ query
+            if selected:
+                score = lambda_mult * relevance - (1.0 - lambda_mult) * max(
+                    candidates[i] @ candidates[j] for j in selected)
+            else:
+                score = relevance
+            if score > best_score:
+                best, best_score = i, score
+        selected.append(best)
+    return selected
+
+
+@pytest.mark.parametrize("lambda_mult", [0.0, 0.3, 0.5, 0.8, 1.0])
+def test_matches_reference_implementation(lambda_mult):
+    rng = np.random.RandomState(0)
+    for _ in range(5):
+        candidates = rng.normal(size=(40, 16))
+        query = rng.normal(size=16)
+        assert mmr_select(query, candidates, 8, lambda_mult) == reference_mmr(query, candidates, 8, lambda_mult)
+
+
+def test_k_larger_than_candidates_and_empty():
+    assert sorted(mmr_select(QUERY, CANDIDATES, 10, 0.5)) == [0, 1, 2, 3]
+    assert mmr_select(QUERY, np.zeros((0, 2)), 3) == []
+    assert mmr_select(QUERY, CANDIDATES, 0) == []
+
+
+def test_zero_vectors_do_not_produce_nan():
+    candidates = np.array([[0.0, 0.0], [1.0, 0.0], [0.0, 1.0]])
+    assert mmr_select(QUERY, candidates, 3, 0.5) == [1, 0, 2]
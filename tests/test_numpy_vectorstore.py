@@ -0,0 +1,181 @@
+"""
+numpy_vectorstore.pyのテスト（一時ディレクトリのベクトルストアを使用）
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy_vectorstore  # noqa: E402
+from numpy_vectorstore import NumpyVectorStore  # noqa: E402
+
+DIM = 16
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    """ブロックをまたぐ上位kの統合も通るよう、ブロックを小さくする"""
+    monkeypatch.setattr(numpy_vectorstore, "SEARCH_BLOCK_ROWS", 64)
+    monkeypatch.setattr(numpy_vectorstore, "HALF_BLOCK_ROWS", 32)
+    monkeypatch.setattr(numpy_vectorstore, "BATCH_BLOCK_ROWS", 50)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return NumpyVectorStore(str(tmp_path / "numpy_db"))
+
+
+def make_vectors(n, seed=0):
+    return np.random.RandomState(seed).normal(size=(n, DIM)).astype(np.float32)
+
+
+def add(store, ids, vectors):
+    """チャンクIDをテキストに、番号をメタデータに持たせて保存する"""
+    metadatas = [{"filename": f"{i % 3}.txt", "page": i % 7} for i in range(len(ids))]
+    store.add_embeddings(list(ids), vectors.tolist(), metadatas=metadatas, ids=list(ids))
+
+
+def brute_force(ids, vectors, query, k):
+    """全件のコサイン類似度で求めた上位k件の(チャンクID, 距離)"""
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = normalized @ (query / np.linalg.norm(query))
+    order = np.argsort(-scores, kind="stable")[:k]
+    return [ids[i] for i in order], [1.0 - float(scores[i]) for i in order]
+
+
+def search_ids(store, query, k, filter=None):
+    results = store.similarity_search_by_vector_with_score(query.tolist(), k=k, filter=filter)
+    return [doc.page_content for doc, _ in results], [distance for _, distance in results]
+
+
+def test_top_k_matches_brute_force(store):
+    ids = [f"c{i}" for i in range(300)]
+    vectors = make_vectors(300)
+    add(store, ids, vectors)
+
+    for query in make_vectors(5, seed=1):
+        expected_ids, expected_distances = brute_force(ids, vectors, query, 10)
+        actual_ids, actual_distances = search_ids(store, query, 10)
+        assert actual_ids == expected_ids
+        np.testing.assert_allclose(actual_distances, expected_distances, atol=1e-5)
+
+
+def test_batch_search_matches_single_search(store):
+    ids = [f"c{i}" for i in range(300)]
+    add(store, ids, make_vectors(300))
+    store.delete(ids=ids[::5])
+    queries = make_vectors(7, seed=2)
+
+    many = store.similarity_search_by_vectors_with_score(queries.tolist(), k=8)
+    for results, query in zip(many, queries):
+        single = store.similarity_search_by_vector_with_score(query.tolist(), k=8)
+        assert [doc.page_content for doc, _ in results] == [doc.page_content for doc, _ in single]
+        np.testing.assert_allclose([d for _, d in results], [d for _, d in single], atol=1e-5)
+
+
+def test_float16_store_matches_brute_force(tmp_path):
+    store = NumpyVectorStore(str(tmp_path / "numpy_db"), dtype="float16")
+    ids = [f"c{i}" for i in range(200)]
+    vectors = make_vectors(200)
+    add(store, ids, vectors)
+
+    query = make_vectors(1, seed=3)[0]
+    expected_ids, expected_distances = brute_force(ids, vectors, query, 5)
+    actual_ids, actual_distances = search_ids(store, query, 5)
+    assert actual_ids == expected_ids
+    np.testing.assert_allclose(actual_distances, expected_distances, atol=1e-2)
+
+
+def test_upsert_replaces_rows(store):
+    vectors = make_vectors(20)
+    add(store, [f"c{i}" for i in range(20)], vectors)
+    replacement = make_vectors(1, seed=4)
+    store.add_embeddings(["新しいテキスト"], replacement.tolist(), metadatas=[{}], ids=["c3"])
+
+    assert store.count() == 20
+    results = store.similarity_search_by_vector_with_score(replacement[0].tolist(), k=1)
+    assert results[0][0].page_content == "新しいテキスト"
+    assert results[0][1] == pytest.approx(0.0, abs=1e-5)
+    # 置き換え前のEmbeddingでは古い行が見つからない
+    assert "c3" not in search_ids(store, vectors[3], 20)[0]
+
+
+def test_delete_marks_rows_and_persists(store, tmp_path):
+    ids = [f"c{i}" for i in range(20)]
+    vectors = make_vectors(20)
+    add(store, ids, vectors)
+
+    assert store.delete(ids=["c1", "c2", "missing"])
+    assert not store.delete(ids=["missing"])
+    assert store.count() == 18
+    assert store.delete_by_source("unknown") == 0
+
+    reopened = NumpyVectorStore(str(tmp_path / "numpy_db"))
+    assert reopened.count() == 18
+    live_ids = [i for i in ids if i not in ("c1", "c2")]
+    live_vectors = np.array([v for i, v in zip(ids, vectors) if i not in ("c1", "c2")])
+    assert search_ids(reopened, vectors[1], 5)[0] == brute_force(live_ids, live_vectors, vectors[1], 5)[0]
+
+
+def test_delete_by_source(store):
+    store.add_embeddings(["a", "b", "c"], make_vectors(3).tolist(),
+                         metadatas=[{"source": "docs/a.txt"}, {"source": "docs/b.txt"}, {"source": "docs/a.txt"}],
+                         ids=["a", "b", "c"])
+    assert store.delete_by_source("docs/a.txt") == 2
+    assert store.count() == 1
+    # 削除済みの行は再度削除されない
+    assert store.delete_by_source("docs/a.txt") == 0
+
+
+def test_compaction_rewrites_live_rows(store, tmp_path):
+    ids = [f"c{i}" for i in range(100)]
+    vectors = make_vectors(100)
+    add(store, ids, vectors)
+    deleted = set(ids[:40])
+    store.delete(ids=sorted(deleted))
+
+    # 削除済みが30%を超えたため、有効な行だけの新しい世代に詰め直される
+    assert store._state["generation"] == 1
+    assert store._state["rows"] == 60 and store._state["deleted"] == []
+    assert sorted(os.listdir(tmp_path / "numpy_db")) == ["docs.1.jsonl", "offsets.1.bin", "state.json", "vectors.1.bin"]
+
+    live_ids = ids[40:]
+    query = make_vectors(1, seed=5)[0]
+    assert search_ids(store, query, 10)[0] == brute_force(live_ids, vectors[40:], query, 10)[0]
+    # 詰め直した後も、チャンクIDから正しい行を削除・置き換えできる
+    assert store.delete(ids=["c50"])
+    store.add_embeddings(["置き換え"], vectors[60:61].tolist(), ids=["c60"])
+    assert store.count() == 59
+    assert search_ids(store, vectors[60], 1)[0] == ["置き換え"]
+
+
+def test_filtered_search_matches_brute_force_on_subset(store):
+    ids = [f"c{i}" for i in range(150)]
+    vectors = make_vectors(150)
+    add(store, ids, vectors)
+    store.delete(ids=["c0", "c3"])
+
+    query = make_vectors(1, seed=6)[0]
+    subset = [i for i in range(150) if i % 3 == 0 and i % 7 >= 2 and i not in (0, 3)]
+    expected = brute_force([ids[i] for i in subset], vectors[subset], query, 5)[0]
+    assert search_ids(store, query, 5, filter={"filename": "0.txt", "page": {"$gte": 2}})[0] == expected
+    assert search_ids(store, query, 5, filter={"filename": "missing.txt"})[0] == []
+
+
+def test_other_instance_sees_writes(store, tmp_path):
+    reader = NumpyVectorStore(str(tmp_path / "numpy_db"))
+    assert reader.count() == 0
+    add(store, ["c0", "c1"], make_vectors(2))
+    assert reader.count() == 2
+    assert search_ids(reader, make_vectors(2)[1], 1)[0] == ["c1"]
+
+
+def test_dimension_mismatch_raises(store):
+    add(store, ["c0"], make_vectors(1))
+    with pytest.raises(ValueError):
+        store.add_embeddings(["x"], [[1.0, 0.0]], ids=["x"])
+    with pytest.raises(ValueError):
+        store.similarity_search_by_vector_with_score([1.0, 0.0], k=1)
@@ -0,0 +1,131 @@
+"""
+rag.pyの検索のテスト（一時ディレクトリのNumPyベクトルストア、OpenAI互換の偽サーバーを使用）
+"""
+import os
+import sys
+import asyncio
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ingest  # noqa: E402
+import rag  # noqa: E402
+from chunk_dedup import lookup_references  # noqa: E402
+from embedding_scheduler import EmbeddingScheduler  # noqa: E402
+from lexical_index import open_lexical_index  # noqa: E402
+
+DOCS = {
+    "warranty.txt": "保証期間は購入日から2年間です。型番XZ-9000は延長保証の対象です。",
+    "setup.md": "# 初期設定\n電源を入れてから管理画面で言語とタイムゾーンを設定します。",
+    "network.md": "# ネットワーク\n有線LANまたは無線LANで接続します。固定IPアドレスも設定できます。",
+    "parts.txt": "交換部品の型番はRX-200-Fです。フィルターは半年ごとに交換してください。",
+    "support.txt": "サポート窓口の受付時間は平日9時から17時までです。",
+    "billing.txt": "請求書は毎月末日に発行され、翌月20日までにお支払いください。",
+    "security.md": "# セキュリティ\n管理者パスワードは12文字以上で、90日ごとに変更してください。",
+    "backup.md": "# バックアップ\n設定のバックアップは管理画面からファイルとしてダウンロードできます。",
+}
+
+QUERIES = [
+    "XZ-9000",
+    "保証期間はどのくらいですか",
+    "無線LANの設定方法",
+    "パスワードの変更",
+    "請求書の支払期限",
+    "RX-200-F",
+]
+
+
+@pytest.fixture
+def rag_system(workspace, fake_openai, monkeypatch):
+    """ドキュメントをインデックスしたRAGSystem（Embeddingはインデックス処理と同じスケジューラ経由）"""
+    tmp_path, docs_dir = workspace
+    for name, text in DOCS.items():
+        (docs_dir / name).write_text(text, encoding="utf-8")
+    ingest.ingest(str(docs_dir), str(tmp_path / "chroma_db"), full_rebuild=True)
+
+    monkeypatch.setattr(rag, "USE_SUPABASE", False)
+    monkeypatch.setattr(rag, "LOCAL_BACKEND", "numpy")
+    monkeypatch.setattr(rag, "NUMPY_DB_PATH", ingest.NUMPY_DB_PATH)
+    monkeypatch.setattr(rag, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(rag, "_get_openai_embeddings_class", lambda: EmbeddingScheduler)
+    monkeypatch.setattr(rag, "open_lexical_index", lambda: open_lexical_index(ingest.LEXICAL_INDEX_PATH))
+    monkeypatch.setattr(rag, "lookup_references", lambda ids: lookup_references(ids, ingest.DEDUP_INDEX_PATH))
+    return rag.RAGSystem()
+
+
+def _assert_same_results(actual, expected):
+    assert [r["chunk_id"] for r in actual] == [r["chunk_id"] for r in expected]
+    for a, e in zip(actual, expected):
+        assert a["score"] == (pytest.approx(e["score"], abs=1e-5) if e["score"] is not None else None)
+        assert a["lexical_score"] == e["lexical_score"]
+
+
+@pytest.mark.parametrize("mmr", [False, True])
+def test_search_many_matches_search(rag_system, mmr):
+    """search_many()はクエリごとのsearch()と同じ結果を返す（MMRの有無とも）"""
+    many = list(rag_system.search_many(QUERIES, k=2, batch_size=4, mmr=mmr))
+    single = [rag_system.search(query, k=2, mmr=mmr) for query in QUERIES]
+
+    assert len(many) == len(QUERIES)
+    for batch_results, query_results in zip(many, single):
+        _assert_same_results(batch_results, query_results)
+
+
+def test_search_many_uses_mmr_default(rag_system, monkeypatch):
+    """mmrを省略した場合はsearch()と同じくMMR_ENABLEDに従う"""
+    monkeypatch.setattr(rag, "MMR_ENABLED", True)
+    many = list(rag_system.search_many(QUERIES, k=2))
+    for batch_results, query in zip(many, QUERIES):
+        _assert_same_results(batch_results, rag_system.search(query, k=2, mmr=True))
+
+
+def test_lexical_only_search_counts_skipped_embedding(rag_system):
+    results = rag_system.search("RX-200-F", k=2)
+    assert results[0]["filename"] == "parts.txt"
+    assert results[0]["score"] is None
+    assert rag_system.cache_stats()["embedding_skipped"] == 1
+
+
+def test_asearch_matches_search(rag_system):
+    for query in QUERIES:
+        _assert_same_results(asyncio.run(rag_system.asearch(query, k=2)), rag_system.search(query, k=2))
+
+
+def test_aquery_matches_query(rag_system):
+    """aquery()はquery()と同じ回答・検索結果を返す（回答は偽サーバーが入力から決定的に作る）"""
+    for question in ["保証期間はどのくらいですか", "RX-200-F"]:
+        answer, results, used_llm = rag_system.query(question)
+        async_answer, async_results, async_used_llm = asyncio.run(rag_system.aquery(question))
+
+        assert used_llm and async_used_llm
+        assert async_answer == answer
+        _assert_same_results(async_results, results)
+
+
+def test_agenerate_answer_matches_generate_answer(rag_system):
+    results = rag_system.search("無線LANの設定方法")
+    assert asyncio.run(rag_system.agenerate_answer("無線LANの設定方法", results)) == \
+        rag_system.generate_answer("無線LANの設定方法", results)
+    assert asyncio.run(rag_system.agenerate_answer("質問", [])) == rag_system.generate_answer("質問", [])
+
+
+def test_agenerate_answer_api_error_falls_back_like_sync(rag_system, fake_openai):
+    """APIエラー時は同期版と同じくフォールバック回答を返し、LLM使用フラグはFalseになる"""
+    results = rag_system.search("無線LANの設定方法")
+    fake_openai.rate_limit_every = 1
+    fake_openai.retry_after = 0.01
+
+    answer, used_llm = asyncio.run(rag_system.agenerate_answer("無線LANの設定方法", results))
+
+    assert not used_llm
+    assert (answer, used_llm) == rag_system.generate_answer("無線LANの設定方法", results)
+
+
+def test_async_invalid_filters_raise_like_sync(rag_system):
+    with pytest.raises(ValueError):
+        rag_system.query("質問", filters={"unknown": "x"})
+    with pytest.raises(ValueError):
+        asyncio.run(rag_system.aquery("質問", filters={"unknown": "x"}))
+    with pytest.raises(ValueError):
+        asyncio.run(rag_system.asearch("質問", filters={"page": "1"}))
@@ -0,0 +1,97 @@
+"""
+text_chunker.pyのチャンク分割のテスト
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_core.documents import Document  # noqa: E402
+
+from text_chunker import UNIT_TOKENS, TextChunker  # noqa: E402
+
+JAPANESE_TEXT = (
+    "本製品の保証期間は購入日から2年間です。延長保証に加入すると最長5年間まで延長できます。"
+    "消耗品（フィルター、パッキンなど）は保証の対象外です。\n"
+    "修理を依頼する場合は「サポート窓口」にご連絡ください。受付時間は平日9時から17時までです！"
+    "土日祝日の受付はありますか？いいえ、ありません。\n\n"
+    "The warranty covers defects in materials. It does not cover accidental damage, "
+    "misuse, or normal wear and tear."
+)
+
+
+@pytest.mark.parametrize("chunk_size,chunk_overlap", [(40, 0), (40, 10), (60, 20), (25, 5)])
+def test_offsets_round_trip_to_source_text(chunk_size, chunk_overlap):
+    chunker = TextChunker(chunk_size, chunk_overlap)
+    offsets = chunker.split_offsets(JAPANESE_TEXT)
+
+    assert chunker.split_text(JAPANESE_TEXT) == [JAPANESE_TEXT[start:end] for start, end in offsets]
+    for (start, end), (next_start, _) in zip(offsets, offsets[1:]):
+        assert start < next_start <= end + 2
+    for start, end in offsets:
+        assert 0 <= start < end <= len(JAPANESE_TEXT)
+        assert end - start <= chunk_size
+        assert JAPANESE_TEXT[start:end] == JAPANESE_TEXT[start:end].strip()
+    # 重なりを除いてつなげると元のテキストのすべての文字を含む
+    covered = set()
+    for start, end in offsets:
+        covered.update(range(start, end))
+    assert covered >= {i for i, ch in enumerate(JAPANESE_TEXT) if not ch.isspace()}
+
+
+def test_split_documents_records_offsets():
+    doc = Document(page_content=JAPANESE_TEXT, metadata={"source": "docs/manual.txt", "page": 0})
+    chunks = TextChunker(50, 10).split_documents([doc])
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        start, end = chunk.metadata["start_index"], chunk.metadata["end_index"]
+        assert JAPANESE_TEXT[start:end] == chunk.page_content
+        assert chunk.metadata["source"] == "docs/manual.txt"
+        assert chunk.metadata["page"] == 0
+
+
+def test_splits_after_japanese_sentence_endings():
+    text = "保証期間は2年間です。消耗品は対象外です。修理はサポート窓口に依頼してください。"
+    assert TextChunker(25, 0).split_text(text) == [
+        "保証期間は2年間です。消耗品は対象外です。",
+        "修理はサポート窓口に依頼してください。",
+    ]
+
+
+def test_keeps_closing_bracket_with_sentence():
+    text = "窓口に連絡してください。」と案内します。次の手順に進みます。"
+    chunks = TextChunker(14, 0).split_text(text)
+    assert chunks[0] == "窓口に連絡してください。」"
+
+
+def test_prefers_paragraph_break_over_sentence_end():
+    text = "第一段落の文です。もう一文あります。\n\n第二段落です。続きの文です。"
+    assert TextChunker(30, 0).split_text(text) == ["第一段落の文です。もう一文あります。", "第二段落です。続きの文です。"]
+
+
+def test_overlap_starts_at_a_boundary():
+    text = "一文目の内容です。二文目の内容です。三文目の内容です。四文目の内容です。"
+    chunks = TextChunker(20, 10).split_text(text)
+    assert chunks[:2] == ["一文目の内容です。二文目の内容です。", "二文目の内容です。三文目の内容です。"]
+
+
+def test_text_without_separators_is_cut_at_the_limit():
+    text = "あ" * 25
+    assert TextChunker(10, 0).split_offsets(text) == [(0, 10), (10, 20), (20, 25)]
+
+
+def test_token_unit_limits_token_count():
+    chunker = TextChunker(15, 3, unit=UNIT_TOKENS)
+    encoding = chunker._get_encoding()
+    for chunk in chunker.split_text(JAPANESE_TEXT):
+        assert len(encoding.encode(chunk)) <= 15
+
+
+def test_invalid_settings_raise():
+    with pytest.raises(ValueError):
+        TextChunker(10, 10)
+    with pytest.raises(ValueError):
+        TextChunker(10, 0, unit="words")
@@ -0,0 +1,226 @@
+"""
+日本語・英語混在テキスト向けのチャンク分割（オフセット方式）
+"""
+from bisect import bisect_left
+from typing import List, Tuple, Optional
+
+try:
+    from langchain_core.documents import Document
+except ImportError:
+    from langchain.schema import Document
+
+# チャンクの長さの単位
+UNIT_CHARS = "chars"
+UNIT_TOKENS = "tokens"
+
+# 分割位置の候補となる区切り文字列（優先度の高い順）。区切りの直後で分割する
+_SEPARATORS = (
+    ("\n\n",),                                   # 段落の区切り（空行）
+    ("\n",),                                     # 改行
+    ("。", "！", "？", "．", "!", "?", ". "),     # 文末
+    ("、", "，", ", ", "　", " "),                # 読点・カンマ・空白
+)
+_ALL_SEPARATORS = tuple(sep for group in _SEPARATORS for sep in group)
+# 文末の直後にあれば同じチャンクに含める閉じ括弧
+_CLOSING_BRACKETS = "」』）)]"
+
+
+class TextChunker:
+    """
+    テキストを1回の走査でチャンクの(開始, 終了)オフセットに分割する
+
+    長さの上限までの範囲で、最も優先度の高い区切り（段落 > 改行 > 文末 >
+    読点・空白）の最後の位置で区切る。区切りの検索はオフセットの範囲指定で
+    行い、部分文字列を作るのは最後にチャンクを取り出すときだけ。
+
+    長さの単位は文字数（従来のCHUNK_SIZE/CHUNK_OVERLAPと同じ意味）または
+    tiktokenのトークン数を選べる。
+    """
+
+    def __init__(self, chunk_size: int, chunk_overlap: int, unit: str = UNIT_CHARS,
+                 model: Optional[str] = None):
+        """
+        初期化
+
+        Args:
+            chunk_size: 1チャンクの長さの上限（unitの単位）
+            chunk_overlap: 隣り合うチャンクの重なりの長さ（unitの単位）
+            unit: "chars"（文字数）または "tokens"（トークン数）
+            model: unitが"tokens"の場合にトークン数を数えるモデル名
+        """
+        if unit not in (UNIT_CHARS, UNIT_TOKENS):
+            raise ValueError(f"未対応のチャンク単位です: {unit}")
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlapはchunk_sizeより小さくしてください")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.unit = unit
+        self.model = model
+        self._encoding = None
+
+    # ==================== 公開API ====================
+
+    def split_offsets(self, text: str) -> List[Tuple[int, int]]:
+        """
+        テキストをチャンクの(開始, 終了)オフセットのリストに分割
+
+        Args:
+            text: 分割するテキスト
+
+        Returns:
+            text[start:end] がチャンクとなるオフセットのリスト（前後の空白は含まない）
+        """
+        n = len(text)
+        if n == 0:
+            return []
+
+        advance, retreat = self._measure(text)
+        min_fill = self.chunk_size // 2
+
+        offsets = []
+        start = _skip_space(text, 0, n)
+        while start < n:
+            limit = max(advance(start, self.chunk_size), start + 1)
+            if limit >= n:
+                end = n
+            else:
+                end = _find_break(text, start, limit, advance(start, min_fill))
+
+            chunk_start, chunk_end = start, _trim_space(text, start, end)
+            if chunk_end > chunk_start:
+                offsets.append((chunk_start, chunk_end))
+            if end >= n:
+                break
+
+            # 重なり分だけ戻り、次の分割位置の候補から始める（単語・文の途中から始めない）
+            next_start = end
+            if self.chunk_overlap > 0:
+                overlap_start = _next_boundary(text, retreat(end, self.chunk_overlap), end)
+                if overlap_start > start:
+                    next_start = overlap_start
+            start = _skip_space(text, next_start, n)
+        return offsets
+
+    def split_text(self, text: str) -> List[str]:
+        """テキストをチャンクの文字列のリストに分割"""
+        return [text[start:end] for start, end in self.split_offsets(text)]
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        """
+        ドキュメントをチャンクに分割
+
+        各チャンクのメタデータには元のメタデータに加えて、ページテキスト内の
+        位置（start_index, end_index）を持たせる。
+
+        Args:
+            documents: 分割前のDocumentリスト
+
+        Returns:
+            分割後のDocumentリスト
+        """
+        chunks = []
+        for doc in documents:
+            text = doc.page_content
+            for start, end in self.split_offsets(text):
+                metadata = dict(doc.metadata)
+                metadata["start_index"] = start
+                metadata["end_index"] = end
+                chunks.append(Document(page_content=text[start:end], metadata=metadata))
+        return chunks
+
+    # ==================== 内部処理 ====================
+
+    def _get_encoding(self):
+        if self._encoding is None:
+            from embedding_scheduler import get_encoding
+            self._encoding = get_encoding(self.model or "text-embedding-3-small")
+        return self._encoding
+
+    def _measure(self, text: str):
+        """
+        長さの単位に応じて、位置を前後に移動する関数の組を作る
+
+        Returns:
+            (advance(position, units), retreat(position, units)) のタプル。
+            いずれも文字オフセットを返す
+        """
+        n = len(text)
+        if self.unit == UNIT_CHARS:
+            return (lambda position, units: min(n, position + units),
+                    lambda position, units: max(0, position - units))
+
+        # テキスト全体を一度だけエンコードし、各トークンの開始文字オフセットを使う
+        encoding = self._get_encoding()
+        tokens = encoding.encode(text, disallowed_special=())
+        _, token_starts = encoding.decode_with_offsets(tokens)
+
+        def advance(position: int, units: int) -> int:
+            index = bisect_left(token_starts, position) + units
+            return token_starts[index] if index < len(token_starts) else n
+
+        def retreat(position: int, units: int) -> int:
+            index = bisect_left(token_starts, position) - units
+            return token_starts[index] if index > 0 else 0
+
+        return advance, retreat
+
+
+def _find_break(text: str, start: int, limit: int, min_end: int) -> int:
+    """
+    (start, limit] の範囲で分割位置を決める
+
+    min_end以降にある最も優先度の高い区切りの最後の位置を選ぶ。
+    そのような区切りがなければ範囲内の最後の区切り、それもなければlimitで切る。
+    検索はstr.rfindで範囲内だけを見るため、部分文字列を作らない。
+    """
+    for group in _SEPARATORS:
+        position = _last_separator_end(text, group, min_end, limit)
+        if position > start:
+            return _extend_brackets(text, position, limit)
+    position = _last_separator_end(text, _ALL_SEPARATORS, start, limit)
+    if position > start:
+        return _extend_brackets(text, position, limit)
+    return limit
+
+
+def _last_separator_end(text: str, separators: Tuple[str, ...], low: int, high: int) -> int:
+    """text[low:high] 内で最後に現れる区切りの直後の位置（なければ-1）"""
+    best = -1
+    for sep in separators:
+        index = text.rfind(sep, low, high)
+        if index >= 0:
+            # ". " のように空白を含む区切りは空白の前で切る
+            end = index + len(sep.rstrip(" ")) if sep.strip(" ") else index + len(sep)
+            best = max(best, end)
+    return best
+
+
+def _next_boundary(text: str, low: int, high: int) -> int:
+    """text[low:high] 内で最初に現れる区切りの直後の位置（なければlow）"""
+    best = high
+    for sep in _ALL_SEPARATORS:
+        index = text.find(sep, low, high)
+        if 0 <= index and index + len(sep) < best:
+            best = index + len(sep)
+    return _extend_brackets(text, best, high) if best < high else low
+
+
+def _extend_brackets(text: str, position: int, limit: int) -> int:
+    """文末の直後の閉じ括弧を同じチャンクに含める"""
+    while position < limit and text[position] in _CLOSING_BRACKETS:
+        position += 1
+    return position
+
+
+def _skip_space(text: str, position: int, n: int) -> int:
+    """先頭の空白を飛ばした位置"""
+    while position < n and text[position].isspace():
+        position += 1
+    return position
+
+
+def _trim_space(text: str, start: int, end: int) -> int:
+    """末尾の空白を除いた終了位置"""
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return end
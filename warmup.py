@@ -0,0 +1,104 @@
+"""
+RAGシステムのバックグラウンドでのウォームアップ
+
+プロセスの起動直後（ログイン画面の表示中）に、RAGシステムの作成（LangChain・OpenAIの
+import、Embeddingモデル・OpenAIクライアントの作成、ベクトルストアへの接続）と
+RAGSystem.warm_up()をスレッドで実行し、ログイン後の最初の質問を待たせない。
+このモジュールは重いモジュールをimportしない（ログイン画面の表示を遅らせない）。
+"""
+import os
+import time
+import threading
+from typing import Dict, Optional
+
+# 定数定義
+# 起動時にウォームアップするか
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+# ローカルのインデックスファイルを先読みするか（ファイルが大きい場合は起動直後のディスクI/Oが増える）
+WARMUP_TOUCH_INDEX = os.getenv("WARMUP_TOUCH_INDEX", "0") == "1"
+
+# ウォームアップの状態
+STATE_IDLE = "idle"          # 未開始（無効の場合も含む）
+STATE_WARMING = "warming"    # 実行中
+STATE_READY = "ready"        # 完了
+STATE_FAILED = "failed"      # 失敗（最初の質問の時に改めて作成する）
+
+_lock = threading.Lock()
+_done = threading.Event()
+_thread = None
+_status = {"state": STATE_IDLE, "elapsed": None, "timings": {}, "error": None}
+
+
+def start_warmup(touch_index: bool = WARMUP_TOUCH_INDEX) -> bool:
+    """
+    ウォームアップをバックグラウンドのスレッドで開始（プロセスで1回だけ、2回目以降は何もしない）
+
+    Args:
+        touch_index: ローカルのインデックスファイルを先読みするか
+
+    Returns:
+        開始した場合True（実行済み・無効の場合はFalse）
+    """
+    global _thread
+    if not WARMUP_ENABLED:
+        return False
+    with _lock:
+        if _thread is not None:
+            return False
+        _status["state"] = STATE_WARMING
+        _thread = threading.Thread(target=_run, args=(touch_index,), name="rag-warmup", daemon=True)
+        _thread.start()
+    return True
+
+
+def _run(touch_index: bool):
+    """ウォームアップの本体（バックグラウンドのスレッド）"""
+    started = time.perf_counter()
+    try:
+        from rag import get_rag_system
+        timings = get_rag_system().warm_up(touch_index=touch_index)
+    except Exception as e:
+        elapsed = time.perf_counter() - started
+        with _lock:
+            _status.update(state=STATE_FAILED, elapsed=elapsed, error=str(e))
+        print(f"⚠️ RAGシステムのウォームアップエラー: {e}")
+    else:
+        elapsed = time.perf_counter() - started
+        with _lock:
+            _status.update(state=STATE_READY, elapsed=elapsed, timings=timings)
+        print(f"🔥 RAGシステムのウォームアップが完了しました（{elapsed:.1f}秒）")
+    finally:
+        _done.set()
+
+
+def warmup_status() -> Dict:
+    """
+    ウォームアップの状態
+
+    Returns:
+        state（idle / warming / ready / failed）、elapsed（所要秒数）、
+        timings（RAGSystem.warm_up()の準備ごとの秒数）、error（失敗時のメッセージ）の辞書
+    """
+    with _lock:
+        return dict(_status)
+
+
+def is_ready() -> bool:
+    """ウォームアップが完了しているか"""
+    return warmup_status()["state"] == STATE_READY
+
+
+def wait_until_ready(timeout: Optional[float] = None) -> bool:
+    """
+    ウォームアップの終了を待つ
+
+    Args:
+        timeout: 待つ最大秒数（Noneの場合は終了まで）
+
+    Returns:
+        完了した場合True（失敗・未開始・タイムアウトの場合はFalse）
+    """
+    if _thread is None:
+        return False
+    _done.wait(timeout)
+    return is_ready()